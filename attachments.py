@@ -0,0 +1,123 @@
+"""Build review attachments from command outputs.
+
+Outputs are streamed into the attachment - spilled outputs straight from
+their capture files - so the payload is never held in memory as a whole.
+Small payloads are plain text, larger ones are compressed with
+ATTACHMENT_COMPRESSION, and payloads over ATTACHMENT_PART_BYTES are split
+into numbered parts with a manifest saying which commands start in which part.
+Binary output is replaced by a note (see utils.looks_binary).
+"""
+import gzip
+import os
+import zipfile
+from config import ATTACHMENT_COMPRESS_MIN_BYTES, ATTACHMENT_COMPRESSION, ATTACHMENT_COMPRESS_LEVEL
+from config import ATTACHMENT_PART_BYTES, ATTACHMENT_MAX_PARTS
+from utils import write_command_output, output_size
+from tracing import span
+
+EXTENSIONS = {None: ".txt", "gzip": ".txt.gz", "zip": ".zip"}
+
+class _PartWriter:
+    """Writes text into one file, or a numbered series of them when split."""
+
+    def __init__(self, directory, stem, compression, split):
+        self.directory = directory
+        self.stem = stem
+        self.compression = compression
+        self.split = split
+        self.paths = []
+        self.sizes = []
+        self.omitted = 0
+        self._archive = None
+        self._stream = None
+
+    def _open(self):
+        index = len(self.paths) + 1
+        name = f"{self.stem}_part{index:02d}" if self.split else self.stem
+        path = os.path.join(self.directory, name + EXTENSIONS[self.compression])
+        if self.compression == "zip":
+            self._archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=ATTACHMENT_COMPRESS_LEVEL)
+            self._stream = self._archive.open(name + ".txt", "w", force_zip64=True)
+        elif self.compression == "gzip":
+            self._stream = gzip.open(path, "wb", compresslevel=ATTACHMENT_COMPRESS_LEVEL)
+        else:
+            self._stream = open(path, "wb")
+        self.paths.append(path)
+        self.sizes.append(0)
+
+    def _close_part(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def write(self, text):
+        data = text.encode("utf-8", "replace")
+        while data:
+            if self._stream is not None and self.split and self.sizes[-1] >= ATTACHMENT_PART_BYTES:
+                self._close_part()
+            if self._stream is None:
+                if len(self.paths) >= ATTACHMENT_MAX_PARTS:
+                    self.omitted += len(data)
+                    return
+                self._open()
+            room = ATTACHMENT_PART_BYTES - self.sizes[-1] if self.split else len(data)
+            chunk, data = data[:room], data[room:]
+            self._stream.write(chunk)
+            self.sizes[-1] += len(chunk)
+
+    @property
+    def part(self):
+        """Number of the part the next write goes to."""
+        if self._stream is not None and not (self.split and self.sizes[-1] >= ATTACHMENT_PART_BYTES):
+            return len(self.paths)
+        return len(self.paths) + 1
+
+    def close(self):
+        self._close_part()
+
+def _write_manifest(writer, starts):
+    path = os.path.join(writer.directory, f"{writer.stem}_manifest.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"The command outputs are split into {len(writer.paths)} parts "
+                f"({sum(writer.sizes)} bytes uncompressed). Concatenate them in order for the full text.\n\n")
+        for index, (part_path, size) in enumerate(zip(writer.paths, writer.sizes), 1):
+            f.write(f"Part {index:02d}: {os.path.basename(part_path)} ({size} bytes)\n")
+        f.write("\nCommands:\n")
+        for part, cmd in starts:
+            first_line = cmd.splitlines()[0][:120] if cmd else ""
+            f.write(f"[[{first_line}]] starts in part {part:02d}\n")
+        if writer.omitted:
+            f.write(f"\n{writer.omitted} bytes after part {ATTACHMENT_MAX_PARTS} were left out.\n")
+    return path
+
+def build_attachments(command_outputs, directory, stem="command_outputs", title=None):
+    """Write command outputs into attachment files in directory and return their paths.
+
+    The result is one plain or compressed file, or a manifest followed by the
+    parts when the outputs are larger than ATTACHMENT_PART_BYTES.
+    """
+    os.makedirs(directory, exist_ok=True)
+    estimate = sum(len(cmd) + output_size(output, full=True) for cmd, output in command_outputs.items())
+    compression = ATTACHMENT_COMPRESSION if estimate >= ATTACHMENT_COMPRESS_MIN_BYTES else None
+    writer = _PartWriter(directory, stem, compression, split=estimate > ATTACHMENT_PART_BYTES)
+    starts = []
+    with span("attachment.build", estimate=estimate, compression=compression or "none") as build_span:
+        try:
+            if title:
+                writer.write(title)
+            for cmd, output in command_outputs.items():
+                starts.append((writer.part, cmd))
+                write_command_output(writer.write, cmd, output, full=True)
+        finally:
+            writer.close()
+        paths = list(writer.paths)
+        if writer.split:
+            paths.insert(0, _write_manifest(writer, starts))
+        build_span.set(files=len(paths), written=sum(os.path.getsize(p) for p in paths))
+    if compression or writer.split:
+        print(f"Built {len(paths)} attachment file(s) from {estimate} bytes of output "
+              f"({compression or 'uncompressed'}, {sum(os.path.getsize(p) for p in paths)} bytes)")
+    return paths
@@ -0,0 +1,156 @@
+"""Run a script of prompts without the GUI.
+
+Usage:
+    python main.py --batch prompts.jsonl --output results.jsonl --parallel 8
+    cat prompts.jsonl | python main.py --batch - --output -
+
+Each input line is a JSON object or a bare JSON string (the prompt):
+
+    {"id": "repo-a", "prompt": "Update the dependencies", "working_dir": "repos/a"}
+
+Optional keys are "id", "working_dir", "chat_code", "session" and
+"max_rounds". Each prompt runs in a SessionManager session: the reply's
+commands are run in its working directory and sent back for review, and any
+commands in the review are run in turn, for at most max_rounds rounds.
+Prompts that share a session name, chat code or working directory run one
+after another in the same session; the other groups run in parallel, each in
+a new Poe chat unless it names one. One JSON result line per prompt is
+written as soon as it finishes.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from session_manager import SessionManager
+from command_result import to_json
+from utils import extract_commands
+from config import BATCH_MAX_ROUNDS
+
+def read_prompts(stream):
+    """Return the entries of a JSONL prompt script; invalid lines become entries with an error."""
+    entries = []
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            entries.append({"line": number, "error": f"Invalid JSON: {e}"})
+            continue
+        if isinstance(entry, str):
+            entry = {"prompt": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str):
+            entries.append({"line": number, "error": "Expected a prompt string or an object with a 'prompt'"})
+            continue
+        max_rounds = entry.get("max_rounds", BATCH_MAX_ROUNDS)
+        if isinstance(max_rounds, bool) or not isinstance(max_rounds, int) or max_rounds < 0:
+            entries.append({"id": entry.get("id"), "line": number,
+                            "error": f"max_rounds must be a non-negative integer, got {max_rounds!r}"})
+            continue
+        entry.setdefault("id", str(number))
+        entry["line"] = number
+        entries.append(entry)
+    return entries
+
+def group_prompts(entries):
+    """Split entries into groups that must run in order; groups are independent of each other."""
+    groups = {}
+    for entry in entries:
+        if entry.get("session"):
+            key = ("session", entry["session"])
+        elif entry.get("chat_code"):
+            key = ("chat", entry["chat_code"])
+        elif entry.get("working_dir"):
+            key = ("dir", os.path.abspath(entry["working_dir"]))
+        else:
+            key = ("line", entry["line"])
+        groups.setdefault(key, []).append(entry)
+    return list(groups.values())
+
+async def run_prompt(manager, session, entry):
+    """Send one prompt and work through its command/review rounds; returns the result dict."""
+    rounds = []
+    reply = await manager.send_message(session.id, entry["prompt"])
+    result = {"reply": reply, "rounds": rounds}
+    commands = extract_commands(reply)
+    max_rounds = entry.get("max_rounds", BATCH_MAX_ROUNDS)
+    while commands and len(rounds) < max_rounds:
+        outcome = await manager.run_commands(session.id, commands, review=True)
+        rounds.append({"commands": commands, "results": list(outcome["results"].values()),
+                       "review": outcome["review"]})
+        commands = extract_commands(outcome["review"] or "")
+    if commands:
+        result["unrun_commands"] = commands
+    return result
+
+async def run_group(manager, entries, limit, write):
+    """Run a group of dependent prompts in one session, holding one slot of the parallelism limit."""
+    async with limit:
+        first = entries[0]
+        try:
+            # No chat code means a new chat, so concurrent groups never share a conversation
+            session = manager.create_session(first.get("chat_code"), first.get("working_dir"), first.get("session"))
+        except Exception as e:
+            for entry in entries:
+                write({"id": entry["id"], "line": entry["line"], "status": "error", "error": str(e)})
+            return
+        try:
+            for entry in entries:
+                start = time.perf_counter()
+                record = {"id": entry["id"], "line": entry["line"], "session": session.id,
+                          "working_dir": session.working_dir, "prompt": entry["prompt"]}
+                try:
+                    record.update(await run_prompt(manager, session, entry))
+                    record["status"] = "ok"
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    record.update(status="error", error=str(e))
+                record["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                write(record)
+        finally:
+            await manager.close_session(session.id)
+
+async def run_batch(clients, entries, output, parallel):
+    """Run prompt entries with up to parallel independent groups at once, writing JSONL to output.
+
+    Returns the number of prompts that failed.
+    """
+    manager = SessionManager(clients)
+    limit = asyncio.Semaphore(max(1, parallel))
+    failed = 0
+
+    def write(record):
+        nonlocal failed
+        failed += record["status"] != "ok"
+        output.write(json.dumps(record, default=to_json) + "\n")
+        output.flush()
+
+    for entry in entries:
+        if "error" in entry:
+            write({"id": entry.get("id"), "line": entry["line"], "status": "error", "error": entry["error"]})
+    groups = group_prompts([entry for entry in entries if "error" not in entry])
+    print(f"Running {sum(len(g) for g in groups)} prompts in {len(groups)} independent groups, "
+          f"up to {parallel} at a time")
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[run_group(manager, group, limit, write) for group in groups])
+    finally:
+        await manager.close()
+    print(f"Batch finished in {time.perf_counter() - start:.1f} s: "
+          f"{len(entries) - failed} succeeded, {failed} failed")
+    return failed
+
+async def run_batch_file(clients, prompts_path, output_path, parallel, stdout=None):
+    """Read prompts from a file ('-' for stdin) and write results to a file ('-' for stdout)."""
+    if prompts_path == "-":
+        entries = read_prompts(sys.stdin)
+    else:
+        with open(prompts_path, "r", encoding="utf-8") as f:
+            entries = read_prompts(f)
+    if output_path == "-":
+        return await run_batch(clients, entries, stdout or sys.stdout, parallel)
+    with open(output_path, "w", encoding="utf-8") as output:
+        return await run_batch(clients, entries, output, parallel)
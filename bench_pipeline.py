@@ -0,0 +1,177 @@
+"""Offline pipeline benchmarks against the fake Poe backend.
+
+Usage:
+    python bench_pipeline.py [--rounds N] [--output results.json] [--baseline old.json]
+
+Measures end-to-end round trips (send, extract, execute, review), command batch
+throughput, command extraction speed and peak memory. Nothing talks to Poe;
+commands run inside a temporary directory.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from bench_startup import compare
+from context_budget import ContextBudgeter
+from fake_poe import FakeAsyncPoeApi
+from poe_client import PoeClientWrapper
+from utils import extract_commands
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values (nearest rank)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples_ms):
+    """Return p50/p95/p99/mean of millisecond samples."""
+    return {
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "mean_ms": round(statistics.mean(samples_ms), 3),
+    }
+
+async def fake_client(**api_kwargs):
+    """Return an initialized PoeClientWrapper backed by the fake API."""
+    api = FakeAsyncPoeApi(**api_kwargs)
+    return await PoeClientWrapper(
+        tokens={},
+        bot_name="fake-bot",
+        chat_code="fake-chat",
+        budgeter=ContextBudgeter(),
+        api=api
+    ).initialize()
+
+async def bench_round_trips(rounds, workdir, **api_kwargs):
+    """Time full send -> extract -> execute -> review round trips."""
+    from command_manager import run_commands
+    client = await fake_client(**api_kwargs)
+    loop = asyncio.get_running_loop()
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        reply = await client.send_message(f"Round {i}: continue with the task")
+        commands = extract_commands(reply)
+        if commands:
+            outputs = await loop.run_in_executor(None, run_commands, commands, workdir)
+            await client.send_outputs_for_review(outputs)
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+def bench_command_batch(batch_size, workdir):
+    """Measure how many commands per second a batch runs at."""
+    from command_manager import run_commands
+    commands = []
+    for i in range(batch_size):
+        if i % 2:
+            commands.append(f"DIR: batch/dir_{i}")
+        else:
+            commands.append(f"RUN: echo command {i}")
+    start = time.perf_counter()
+    run_commands(commands, workdir)
+    elapsed = time.perf_counter() - start
+    return {
+        "commands": batch_size,
+        "seconds": round(elapsed, 4),
+        "commands_per_second": round(batch_size / elapsed, 1),
+    }
+
+def bench_extraction(size_kb):
+    """Measure command extraction speed on a large reply."""
+    block = "Some explanation text for the user.\n[[RUN: echo hello]]\n[[DIR: some/dir]]\n"
+    text = block * (size_kb * 1024 // len(block) + 1)
+    runs = 5
+    start = time.perf_counter()
+    for _ in range(runs):
+        found = extract_commands(text)
+    elapsed = (time.perf_counter() - start) / runs
+    return {
+        "reply_kb": size_kb,
+        "commands_found": len(found),
+        "ms_per_reply": round(elapsed * 1000, 3),
+        "mb_per_second": round(len(text) / elapsed / 1_000_000, 1),
+    }
+
+async def bench_memory(workdir, rounds=5):
+    """Peak traced memory while processing replies with large command output."""
+    script = ["Checking the logs.\n\n[[RUN: seq 1 50000]]", "Done."]
+    tracemalloc.start()
+    try:
+        await bench_round_trips(rounds, workdir, script=script)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_kb": round(peak / 1024, 1)}
+
+async def run_benchmarks(args):
+    workdir = tempfile.mkdtemp(prefix="lililia_bench_")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # The pipeline logs heavily to stdout; keep it out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = {
+                "round_trip": await bench_round_trips(
+                    args.rounds, workdir,
+                    first_chunk_delay=args.latency,
+                    chunk_interval=args.chunk_interval,
+                    seed=1
+                ),
+                "command_batch": bench_command_batch(args.batch_size, workdir),
+                "extraction": bench_extraction(args.extract_kb),
+                "memory": await bench_memory(workdir),
+            }
+    finally:
+        os.chdir(previous_cwd)
+    return results
+
+def flatten(results):
+    """Flatten nested results to name -> value for baseline comparison."""
+    flat = {}
+    for group, metrics in results.items():
+        for name, value in metrics.items():
+            flat[f"{group}.{name}"] = value
+    return flat
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message/command pipeline offline")
+    parser.add_argument("--rounds", type=int, default=50, help="Round trips to time")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake first-chunk delay in seconds")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="Fake delay between chunks in seconds")
+    parser.add_argument("--batch-size", type=int, default=100, help="Commands in the batch throughput test")
+    parser.add_argument("--extract-kb", type=int, default=1024, help="Reply size for the extraction test")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Only compare metrics where lower is better
+        current = {k: v for k, v in flatten(results).items() if k.endswith(("_ms", "seconds", "peak_kb"))}
+        regressions = compare(current, flatten(baseline), args.tolerance)
+        if regressions:
+            print("Pipeline regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
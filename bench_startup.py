@@ -0,0 +1,109 @@
+"""Startup benchmark: import times and time until the chat window is interactive.
+
+Usage:
+    python bench_startup.py [--runs N] [--output results.json] [--baseline old.json]
+
+Each measurement runs in a fresh interpreter. With --baseline the script exits
+with status 1 when a metric is slower than the baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+INTERACTIVE_PROBE = """
+import time
+start = time.perf_counter()
+import gui
+window = gui.ChatInterface()
+window.update()
+elapsed = time.perf_counter() - start
+window.running = False
+window.destroy()
+print(elapsed)
+"""
+
+MODULES = ["main", "gui", "poe_client", "server", "command_executor"]
+
+def run_probe(code):
+    """Run a probe in a fresh interpreter and return its printed duration, or None."""
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    if proc.returncode != 0:
+        return None
+    try:
+        return float(proc.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+
+def measure(code, runs):
+    """Return the median of several probe runs in milliseconds, or None if it cannot run."""
+    samples = []
+    for _ in range(runs):
+        value = run_probe(code)
+        if value is None:
+            return None
+        samples.append(value * 1000)
+    return round(statistics.median(samples), 2)
+
+def run_benchmarks(runs):
+    results = {}
+    for module in MODULES:
+        results[f"import_{module}_ms"] = measure(IMPORT_PROBE.format(module=module), runs)
+    # Needs a display; reported as null on headless hosts
+    results["time_to_interactive_ms"] = measure(INTERACTIVE_PROBE, runs)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Return the metrics that regressed against the baseline."""
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if value is None or not old:
+            continue
+        if value > old * (1 + tolerance):
+            regressions.append(f"{name}: {old} ms -> {value} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark startup time")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.runs)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Startup regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
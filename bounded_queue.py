@@ -0,0 +1,82 @@
+import collections
+import queue
+import threading
+import time
+
+BLOCK = "block"
+COALESCE = "coalesce"
+DROP_OLDEST = "drop_oldest"
+POLICIES = (BLOCK, COALESCE, DROP_OLDEST)
+
+class BoundedQueue:
+    """A thread-safe FIFO holding at most maxsize items.
+
+    When it is full, put() applies the queue's policy: BLOCK waits for room
+    (raising queue.Full after timeout), COALESCE merges the new item into the
+    newest queued one with merge(old, new), and DROP_OLDEST discards the
+    oldest item. get()/get_nowait() raise queue.Empty like queue.Queue.
+    """
+
+    def __init__(self, maxsize, policy=BLOCK, merge=None, name="queue"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        if policy == COALESCE and merge is None:
+            raise ValueError("A coalescing queue needs a merge function")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.merge = merge
+        self.name = name
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.stats = {"put": 0, "got": 0, "dropped": 0, "coalesced": 0, "blocked_ms": 0.0, "max_depth": 0}
+
+    def put(self, item, timeout=None):
+        """Add item, applying the policy if the queue is full."""
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                if self.policy == COALESCE:
+                    self._items[-1] = self.merge(self._items[-1], item)
+                    self.stats["coalesced"] += 1
+                    self.stats["put"] += 1
+                    self._not_empty.notify()
+                    return
+                if self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.stats["dropped"] += 1
+                    print(f"{self.name} queue full; dropped its oldest item")
+                else:
+                    start = time.perf_counter()
+                    ready = self._not_full.wait_for(lambda: len(self._items) < self.maxsize, timeout)
+                    self.stats["blocked_ms"] = round(self.stats["blocked_ms"] + (time.perf_counter() - start) * 1000, 1)
+                    if not ready:
+                        raise queue.Full
+            self._items.append(item)
+            self.stats["put"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self._items))
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item, waiting up to timeout seconds for one."""
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            item = self._items.popleft()
+            self.stats["got"] += 1
+            self._not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def get_stats(self):
+        """Return the current depth, capacity, policy and counters."""
+        with self._lock:
+            return dict(self.stats, depth=len(self._items), maxsize=self.maxsize, policy=self.policy)
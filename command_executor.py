@@ -1,50 +1,129 @@
 import os
 import subprocess
 import shlex
+import threading
+import time
 from config import CMD_PREFIX_FILE, CMD_PREFIX_DIR, CMD_PREFIX_RUN, CMD_PREFIX_GIT, CMD_PREFIX_INSTALL
+from config import CMD_PREFIX_SHELL, CMD_PREFIX_PATCH
+from config import CMD_PREFIX_TREE, CMD_PREFIX_GLOB, CMD_PREFIX_GREP, CMD_PREFIX_SUMMARY
 from utils import expand_path
+from tracing import span
+from replay import recorder
+from file_ops import parse_file_command, atomic_write, group_file_ops, write_files
+from patcher import parse_patch_command, apply_patch, PatchError
+from command_result import CommandResult
+from resource_usage import run_measured, usage
+from settings import get_profile
+import workspace_index
+
+QUERY_PREFIXES = (CMD_PREFIX_TREE, CMD_PREFIX_GLOB, CMD_PREFIX_GREP, CMD_PREFIX_SUMMARY)
+IS_WINDOWS = os.name == 'nt'
 
 # Add a flag to track if we've set up Git credentials
 git_credentials_configured = False
+git_credentials_lock = threading.Lock()
 
-def execute_command(cmd):
-    """Execute a command extracted from the bot response and return the output."""
-    global git_credentials_configured
+def execute_command(cmd, cwd=None, shell=None, record=True):
+    """Execute a command extracted from the bot response and return its CommandResult.
     
+    Relative paths and subprocesses are resolved against cwd when given.
+    RUN commands go through shell (a PersistentShell) when one is given.
+    With record=False the result is not passed to the replay recorder.
+    """
     print(f"\nProcessing: {cmd}")
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
     
     # Automatically set up Git credentials if this is a git command and we haven't done it yet
-    if cmd.startswith(CMD_PREFIX_GIT) and not git_credentials_configured:
-        setup_git_credentials()
-        git_credentials_configured = True
+    if cmd.startswith(CMD_PREFIX_GIT):
+        ensure_git_credentials()
     
-    # File creation command
-    if cmd.startswith(CMD_PREFIX_FILE):
-        result = handle_file_command(cmd)
+    # Flag commands whose last run was expensive before running them again
+    warning = usage.check(cmd)
+    if warning:
+        print(warning)
     
-    # Directory creation command
-    elif cmd.startswith(CMD_PREFIX_DIR):
-        result = handle_dir_command(cmd)
+    started = time.time()
+    with span("command.execute", command=cmd[:80]):
+        # File creation command
+        if cmd.startswith(CMD_PREFIX_FILE):
+            result = handle_file_command(cmd, cwd)
     
-    # Shell command
-    elif cmd.startswith(CMD_PREFIX_RUN):
-        result = handle_run_command(cmd)
+        # Patch command
+        elif cmd.startswith(CMD_PREFIX_PATCH):
+            result = handle_patch_command(cmd, cwd)
     
-    # Git command
-    elif cmd.startswith(CMD_PREFIX_GIT):
-        result = handle_git_command(cmd)
+        # Directory creation command
+        elif cmd.startswith(CMD_PREFIX_DIR):
+            result = handle_dir_command(cmd, cwd)
     
-    # Install command
-    elif cmd.startswith(CMD_PREFIX_INSTALL):
-        result = handle_install_command(cmd)
+        # Shell command
+        elif cmd.startswith(CMD_PREFIX_RUN):
+            result = handle_run_command(cmd, cwd, shell)
+        
+        # Persistent shell control command
+        elif cmd.startswith(CMD_PREFIX_SHELL):
+            result = handle_shell_command(cmd, shell)
     
-    # Generic command
-    else:
-        result = handle_generic_command(cmd)
+        # Workspace query command, answered from the index
+        elif cmd.startswith(QUERY_PREFIXES):
+            result = handle_query_command(cmd, cwd)
+    
+        # Git command
+        elif cmd.startswith(CMD_PREFIX_GIT):
+            result = handle_git_command(cmd, cwd)
+    
+        # Install command
+        elif cmd.startswith(CMD_PREFIX_INSTALL):
+            result = handle_install_command(cmd, cwd)
+    
+        # Generic command
+        else:
+            result = handle_generic_command(cmd, cwd)
     
+    if not cmd.startswith(QUERY_PREFIXES):
+        # Anything else may have changed files; rescan before the next query
+        workspace_index.mark_dirty(cwd)
+    result.started = started
+    result.finish()
+    if warning:
+        result.message = f"{result.message}\n{warning}" if result.message else warning
+    usage.record(result)
+    if record:
+        recorder.record_command(cmd, result)
     return result
 
+def execute_commands(commands, cwd=None, shell=None):
+    """Execute commands in order, writing consecutive FILE:/DIR: commands as one batch.
+    
+    Returns a list of (command, CommandResult) pairs.
+    """
+    results = []
+    for is_file_batch, batch in group_file_ops(commands):
+        try:
+            if is_file_batch and len(batch) > 1:
+                print(f"\nProcessing {len(batch)} file commands as one batch")
+                with span("command.execute", command=f"{len(batch)} file commands"):
+                    batch_results = write_files(batch, cwd)
+                workspace_index.mark_dirty(cwd)
+                for cmd, result in batch_results:
+                    recorder.record_command(cmd, result.finish())
+                    usage.record(result)
+                results.extend(batch_results)
+            else:
+                results.append((batch[0], execute_command(batch[0], cwd, shell)))
+        except Exception as e:
+            error_message = f"Error executing command: {str(e)}"
+            print(error_message)
+            results.extend((cmd, CommandResult.error(cmd, error_message)) for cmd in batch)
+    return results
+
+def ensure_git_credentials():
+    """Set up Git credentials once per process, waiting if setup is already running."""
+    global git_credentials_configured
+    with git_credentials_lock:
+        if not git_credentials_configured:
+            setup_git_credentials()
+            git_credentials_configured = True
+
 def setup_git_credentials():
     """Configure Git to store credentials permanently to avoid prompts."""
     try:
@@ -64,7 +143,7 @@ def setup_git_credentials():
             print(f"Failed to configure Git credential storage: {store_result.stderr}")
         
         # For Windows: ensure we don't use modal dialogs for auth
-        if os.name == 'nt':
+        if IS_WINDOWS:
             modal_result = subprocess.run(
                 "git config --global core.askPass \"\"",
                 shell=True,
@@ -125,102 +204,189 @@ def setup_git_credentials():
         print(f"Error configuring Git credentials: {e}")
         return False
 
-def handle_file_command(cmd):
+def handle_file_command(cmd, cwd=None):
     """Handle file creation commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
-    parts = cmd.split("]]", 1)  # Split at the first ']]'
-    if len(parts) < 2:
-        result["message"] = "Error: Invalid FILE command format"
-        print(result["message"])
+    parsed = parse_file_command(cmd, cwd)
+    if parsed is None:
+        result.message = "Error: Invalid FILE command format"
+        print(result.message)
         return result
         
-    file_path = parts[0][len(CMD_PREFIX_FILE):].strip()  # Remove prefix
-    file_path = expand_path(file_path)
-    content = parts[1].strip()
+    file_path, content = parsed
     
     # Create directory if it doesn't exist
     directory = os.path.dirname(file_path)
     if directory and not os.path.exists(directory):
         try:
-            os.makedirs(directory)
-            result["message"] += f"Created directory: {directory}\n"
+            os.makedirs(directory, exist_ok=True)
+            result.message += f"Created directory: {directory}\n"
             print(f"Created directory: {directory}")
         except Exception as e:
-            result["stderr"] = str(e)
-            result["message"] += f"Error creating directory: {e}\n"
+            result.stderr = str(e)
+            result.message += f"Error creating directory: {e}\n"
             print(f"Error creating directory: {e}")
             return result
     
     # Write the file
     try:
-        with open(file_path, 'w') as f:
-            f.write(content)
-        result["message"] += f"File created: {file_path}"
-        print(f"File created: {file_path}")
+        with span("file.write", path=file_path, chars=len(content)):
+            changed = atomic_write(file_path, content)
+        if changed:
+            result.message += f"File created: {file_path}"
+        else:
+            result.message += f"File unchanged: {file_path}"
+        print(result.message.splitlines()[-1])
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] += f"Error creating file: {e}"
+        result.stderr = str(e)
+        result.message += f"Error creating file: {e}"
         print(f"Error creating file: {e}")
     
     return result
 
-def handle_dir_command(cmd):
+def handle_patch_command(cmd, cwd=None):
+    """Handle PATCH commands (unified diff or search/replace hunks)."""
+    result = CommandResult(cmd)
+    
+    try:
+        file_path, body = parse_patch_command(cmd, cwd)
+        with span("file.patch", path=file_path, chars=len(body)):
+            result.message = apply_patch(file_path, body)
+        result.returncode = 0
+        print(result.message)
+    except PatchError as e:
+        result.stderr = str(e)
+        result.returncode = 1
+        result.message = f"Patch not applied: {e}"
+        print(result.message)
+    except Exception as e:
+        result.stderr = str(e)
+        result.returncode = 1
+        result.message = f"Error applying patch: {e}"
+        print(result.message)
+    
+    return result
+
+def handle_dir_command(cmd, cwd=None):
     """Handle directory creation commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
     dir_path = cmd[len(CMD_PREFIX_DIR):].strip()
-    dir_path = expand_path(dir_path)
+    dir_path = expand_path(dir_path, cwd)
     
     try:
         os.makedirs(dir_path, exist_ok=True)
-        result["message"] = f"Directory created: {dir_path}"
-        print(result["message"])
+        result.message = f"Directory created: {dir_path}"
+        print(result.message)
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] = f"Error creating directory: {e}"
-        print(result["message"])
+        result.stderr = str(e)
+        result.message = f"Error creating directory: {e}"
+        print(result.message)
     
     return result
 
-def handle_run_command(cmd):
+def handle_run_command(cmd, cwd=None, shell=None):
     """Handle shell run commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
     shell_cmd = cmd[len(CMD_PREFIX_RUN):].strip()
     try:
         print(f"Executing: {shell_cmd}")
         
-        # Use shell=True on Windows for commands with && or environment variables
-        use_shell = os.name == 'nt' and ('&&' in shell_cmd or '%' in shell_cmd or '$' in shell_cmd)
-        proc_result = subprocess.run(
-            shell_cmd if use_shell else shlex.split(shell_cmd),
-            shell=use_shell,
-            capture_output=True,
-            text=True
-        )
+        if shell is not None:
+            # Reuse the conversation's shell so cd, exports and virtualenvs carry over
+            stdout, stderr, returncode = shell.run(shell_cmd, timeout=get_profile().shell_timeout)
+        else:
+            # Use shell=True on Windows for commands with && or environment variables
+            use_shell = IS_WINDOWS and ('&&' in shell_cmd or '%' in shell_cmd or '$' in shell_cmd)
+            with span("subprocess", command=shell_cmd):
+                proc_result = run_measured(
+                    shell_cmd if use_shell else shlex.split(shell_cmd),
+                    shell=use_shell,
+                    capture_output=True,
+                    text=True,
+                    errors="replace",  # Binary output is detected and left out of reviews
+                    timeout=get_profile().command_timeout or None,
+                    cwd=cwd
+                )
+            stdout, stderr, returncode = proc_result.stdout, proc_result.stderr, proc_result.returncode
+            result.set_rusage(proc_result.rusage)
         
-        result["stdout"] = proc_result.stdout
-        result["stderr"] = proc_result.stderr
-        result["returncode"] = proc_result.returncode
+        result.stdout = stdout
+        result.stderr = stderr
+        result.returncode = returncode
         
         print("Output:")
-        if proc_result.stdout:
-            print(proc_result.stdout)
-        if proc_result.stderr:
+        if stdout:
+            print(stdout)
+        if stderr:
             print("Error output:")
-            print(proc_result.stderr)
-        print(f"Command completed with exit code: {proc_result.returncode}")
+            print(stderr)
+        print(f"Command completed with exit code: {returncode}")
+    except Exception as e:
+        result.stderr = str(e)
+        result.message = f"Error executing command: {e}"
+        print(result.message)
+    
+    return result
+
+def handle_shell_command(cmd, shell=None):
+    """Handle persistent shell control commands (SHELL: restart)."""
+    result = CommandResult(cmd)
+    
+    action = cmd[len(CMD_PREFIX_SHELL):].strip().lower()
+    if shell is None:
+        result.message = "No persistent shell is active for this conversation"
+    elif action == "restart":
+        shell.restart()
+        result.message = "Persistent shell restarted"
+        result.returncode = 0
+    else:
+        result.message = f"Unknown shell action: {action}. Supported: restart"
+    print(result.message)
+    return result
+
+def handle_query_command(cmd, cwd=None):
+    """Handle TREE:, GLOB:, GREP: and SUMMARY: queries against the workspace index."""
+    result = CommandResult(cmd)
+    
+    index = workspace_index.get_index(cwd)
+    prefix = next(p for p in QUERY_PREFIXES if cmd.startswith(p))
+    args = cmd[len(prefix):].strip()
+    try:
+        with span("workspace.query", kind=prefix[:-1]):
+            if prefix == CMD_PREFIX_TREE:
+                parts = args.split()
+                path = parts[0] if parts else "."
+                depth = int(parts[1]) if len(parts) > 1 else 3
+                result.stdout = index.tree(path, depth)
+            elif prefix == CMD_PREFIX_GLOB:
+                matches = index.glob(args or "*")
+                result.stdout = "\n".join(matches) if matches else "No matches"
+            elif prefix == CMD_PREFIX_GREP:
+                # GREP: <regex> [path glob]; the glob is the last word when it looks like one
+                pattern, path_glob = args, None
+                head, _, tail = args.rpartition(" ")
+                if head and any(c in tail for c in "*?["):
+                    pattern, path_glob = head, tail
+                matches = index.grep(pattern, path_glob)
+                result.stdout = "\n".join(matches) if matches else "No matches"
+            else:
+                result.stdout = index.summary(args)
+        result.returncode = 0
+        print(result.stdout)
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] = f"Error executing command: {e}"
-        print(result["message"])
+        result.stderr = str(e)
+        result.returncode = 1
+        result.message = f"Error running query: {e}"
+        print(result.message)
     
     return result
 
-def handle_git_command(cmd):
+def handle_git_command(cmd, cwd=None):
     """Handle git commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
     git_cmd = cmd[len(CMD_PREFIX_GIT):].strip()
     try:
@@ -229,25 +395,30 @@ def handle_git_command(cmd):
         
         # Additional environment variables to prevent credential popups
         env = os.environ.copy()
-        if os.name == 'nt':  # Windows
+        if IS_WINDOWS:  # Windows
             env['GIT_TERMINAL_PROMPT'] = '0'
         else:  # Unix
             env['GIT_TERMINAL_PROMPT'] = '0'
             env['GIT_ASKPASS'] = '/bin/echo'
         
         # Use shell=True on Windows if needed
-        use_shell = os.name == 'nt' and ('&&' in git_cmd or '%' in git_cmd or '$' in git_cmd)
-        proc_result = subprocess.run(
-            full_cmd if use_shell else shlex.split(full_cmd),
-            shell=use_shell,
-            capture_output=True,
-            text=True,
-            env=env
-        )
+        use_shell = IS_WINDOWS and ('&&' in git_cmd or '%' in git_cmd or '$' in git_cmd)
+        with span("subprocess", command=full_cmd):
+            proc_result = run_measured(
+                full_cmd if use_shell else shlex.split(full_cmd),
+                shell=use_shell,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=get_profile().command_timeout or None,
+                env=env,
+                cwd=cwd
+            )
         
-        result["stdout"] = proc_result.stdout
-        result["stderr"] = proc_result.stderr
-        result["returncode"] = proc_result.returncode
+        result.stdout = proc_result.stdout
+        result.stderr = proc_result.stderr
+        result.returncode = proc_result.returncode
+        result.set_rusage(proc_result.rusage)
         
         print("Output:")
         if proc_result.stdout:
@@ -257,37 +428,42 @@ def handle_git_command(cmd):
             print(proc_result.stderr)
         print(f"Git command completed with exit code: {proc_result.returncode}")
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] = f"Error executing git command: {e}"
-        print(result["message"])
+        result.stderr = str(e)
+        result.message = f"Error executing git command: {e}"
+        print(result.message)
     
     return result
 
-def handle_install_command(cmd):
+def handle_install_command(cmd, cwd=None):
     """Handle package installation commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
     package = cmd[len(CMD_PREFIX_INSTALL):].strip()
     try:
         # Detect package manager
         pm_cmd = detect_package_manager(package)
         if not pm_cmd:
-            result["message"] = "Could not detect package manager. Please install manually."
-            print(result["message"])
+            result.message = "Could not detect package manager. Please install manually."
+            print(result.message)
             return result
             
         print(f"Installing {package} using command: {pm_cmd}")
-        use_shell = os.name == 'nt'  # Use shell=True on Windows for better compatibility
-        proc_result = subprocess.run(
-            pm_cmd if use_shell else shlex.split(pm_cmd),
-            shell=use_shell,
-            capture_output=True,
-            text=True
-        )
+        use_shell = IS_WINDOWS  # Use shell=True on Windows for better compatibility
+        with span("subprocess", command=pm_cmd):
+            proc_result = run_measured(
+                pm_cmd if use_shell else shlex.split(pm_cmd),
+                shell=use_shell,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=get_profile().command_timeout or None,
+                cwd=cwd
+            )
         
-        result["stdout"] = proc_result.stdout
-        result["stderr"] = proc_result.stderr
-        result["returncode"] = proc_result.returncode
+        result.stdout = proc_result.stdout
+        result.stderr = proc_result.stderr
+        result.returncode = proc_result.returncode
+        result.set_rusage(proc_result.rusage)
         
         print("Output:")
         if proc_result.stdout:
@@ -297,31 +473,36 @@ def handle_install_command(cmd):
             print(proc_result.stderr)
         print(f"Installation completed with exit code: {proc_result.returncode}")
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] = f"Error installing package: {e}"
-        print(result["message"])
+        result.stderr = str(e)
+        result.message = f"Error installing package: {e}"
+        print(result.message)
     
     return result
 
-def handle_generic_command(cmd):
+def handle_generic_command(cmd, cwd=None):
     """Handle generic commands."""
-    result = {"stdout": "", "stderr": "", "returncode": None, "message": ""}
+    result = CommandResult(cmd)
     
     try:
         print(f"Executing generic command: {cmd}")
         
         # Use shell=True on Windows for better compatibility
-        use_shell = os.name == 'nt' and ('&&' in cmd or '%' in cmd or '$' in cmd)
-        proc_result = subprocess.run(
-            cmd if use_shell else shlex.split(cmd),
-            shell=use_shell,
-            capture_output=True,
-            text=True
-        )
+        use_shell = IS_WINDOWS and ('&&' in cmd or '%' in cmd or '$' in cmd)
+        with span("subprocess", command=cmd):
+            proc_result = run_measured(
+                cmd if use_shell else shlex.split(cmd),
+                shell=use_shell,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=get_profile().command_timeout or None,
+                cwd=cwd
+            )
         
-        result["stdout"] = proc_result.stdout
-        result["stderr"] = proc_result.stderr
-        result["returncode"] = proc_result.returncode
+        result.stdout = proc_result.stdout
+        result.stderr = proc_result.stderr
+        result.returncode = proc_result.returncode
+        result.set_rusage(proc_result.rusage)
         
         print("Output:")
         if proc_result.stdout:
@@ -331,15 +512,15 @@ def handle_generic_command(cmd):
             print(proc_result.stderr)
         print(f"Command completed with exit code: {proc_result.returncode}")
     except Exception as e:
-        result["stderr"] = str(e)
-        result["message"] = f"Error executing command: {e}"
-        print(result["message"])
+        result.stderr = str(e)
+        result.message = f"Error executing command: {e}"
+        print(result.message)
     
     return result
 
 def detect_package_manager(package):
     """Detect the appropriate package manager for installation."""
-    if os.name == 'nt':  # Windows
+    if IS_WINDOWS:  # Windows
         # Check for Python packages first
         if os.path.exists(os.path.join(os.environ.get('SYSTEMDRIVE', 'C:'), 'Python')) or \
            os.path.exists(os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Programs', 'Python')):
@@ -1,55 +1,64 @@
 import os
 import tempfile
-from command_executor import execute_command
+from command_executor import execute_commands
 from utils import extract_commands
+from planner import run_plan
+from output_delta import OutputHistory
+from attachments import build_attachments
+from poe_client import build_review_summary
+from settings import get_profile
 
 # Create a dedicated folder for output files
 OUTPUT_DIR = os.path.join(os.getcwd(), "command_outputs")
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
 
-async def execute_commands_with_review(client, commands):
-    """Execute commands, save outputs to a file, and send file to bot for review."""
+def run_commands(commands, cwd=None, shell=None):
+    """Execute commands and return their CommandResults keyed by command.
+    
+    Independent commands run in parallel when the planner is enabled.
+    """
+    if get_profile().planner_enabled:
+        return dict(run_plan(commands, cwd, shell))
+    return dict(execute_commands(commands, cwd, shell))
+
+def read_fallback_text(output_files, command_outputs):
+    """Return the text to paste when attachments fail: the saved file if it is plain text, else a summary."""
+    if len(output_files) == 1 and output_files[0].endswith(".txt"):
+        with open(output_files[0], "r", encoding="utf-8") as f:
+            return f.read()
+    return build_review_summary(command_outputs)
+
+async def execute_commands_with_review(client, commands, history=None):
+    """Execute commands, save outputs to a file, and send file to bot for review.
+    
+    Outputs of commands already run in this conversation (tracked by history,
+    an OutputHistory) are sent as a diff against their previous run.
+    """
     if not commands:
         return
+    history = history or OutputHistory()
         
     print("\nExecuting commands:")
     for cmd in commands:
         print(f"  - {cmd}")
     
     # Execute all commands and collect outputs
-    command_outputs = {}
-    for cmd in commands:
-        try:
-            output = execute_command(cmd)
-            command_outputs[cmd] = output
-            
-            # Safely print the output preview
-            if output:
-                preview = output[:100] + ('...' if len(output) > 100 else '')
-            else:
-                preview = "(no output or error occurred)"
-            print(f"Command: {cmd}\nOutput: {preview}\n")
-        except Exception as e:
-            error_message = f"Error executing command: {str(e)}"
-            command_outputs[cmd] = error_message
-            print(f"Command: {cmd}\nOutput: {error_message}\n")
+    command_outputs = run_commands(commands)
+    for cmd, output in command_outputs.items():
+        print(f"Command: {cmd}\nOutput: {output.preview(100)}\n")
     
-    # Create a file in the dedicated output directory
-    output_file = os.path.join(OUTPUT_DIR, "command_outputs.txt")
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("Command Execution Results:\n\n")
-        for cmd, output in command_outputs.items():
-            f.write(f"Command: {cmd}\n")
-            f.write(f"Output:\n{output}\n")
-            f.write("-" * 50 + "\n\n")
+    # Save the outputs in the dedicated output directory, compressed or split by size
+    encoded = history.encode_all(command_outputs, full=True)
+    output_files = build_attachments(encoded, OUTPUT_DIR, "command_outputs", "Command Execution Results:\n\n")
     
-    print(f"Saved command outputs to: {output_file}")
+    print(f"Saved command outputs to: {', '.join(output_files)}")
     
     # Try to send the file as an attachment
+    response = None
     try:
         print("Sending file as attachment to bot...")
-        response = await client.send_message("I've executed the commands. Here are the results:", file_path=[output_file])
+        response = await client.send_message("I've executed the commands. Here are the results:", file_path=output_files)
         print(f"\nBot's review: {response}")
     except Exception as e:
         print(f"Error sending file attachment: {e}")
@@ -60,8 +69,7 @@ async def execute_commands_with_review(client, commands):
             response = await client.send_message(review_message)
             
             # Now send another message with the file contents
-            with open(output_file, "r", encoding="utf-8") as f:
-                file_contents = f.read()
+            file_contents = read_fallback_text(output_files, encoded)
             
             chunk_size = 1500  # Reasonable chunk size to avoid message limits
             for i in range(0, len(file_contents), chunk_size):
@@ -73,6 +81,9 @@ async def execute_commands_with_review(client, commands):
             print(f"\nBot's review: {response}")
         except Exception as e2:
             print(f"Error with fallback method: {e2}")
+            response = None
+    # The outputs are the previous run only if the bot got them
+    history.commit(response is not None)
         
     # Extract and execute any commands from the review
     new_commands = extract_commands(response)
@@ -82,43 +93,33 @@ async def execute_commands_with_review(client, commands):
             print(f"  - {cmd}")
         
         # Execute new commands automatically
-        await execute_commands_recursive(client, new_commands)
+        await execute_commands_recursive(client, new_commands, history=history)
 
-async def execute_commands_recursive(client, commands, depth=0):
+async def execute_commands_recursive(client, commands, depth=0, history=None):
     """Execute commands recursively, saving outputs to files."""
     if not commands or depth > 3:  # Limit recursion depth
         return
+    history = history or OutputHistory()
         
     print(f"\nExecuting {'follow-up ' if depth > 0 else ''}commands:")
     for cmd in commands:
         print(f"  - {cmd}")
     
     # Execute all commands and collect outputs
-    command_outputs = {}
-    for cmd in commands:
-        try:
-            output = execute_command(cmd)
-            command_outputs[cmd] = output
-        except Exception as e:
-            error_message = f"Error executing command: {str(e)}"
-            command_outputs[cmd] = error_message
-            print(f"Command: {cmd}\nOutput: {error_message}\n")
+    command_outputs = run_commands(commands)
     
-    # Create a file in the dedicated output directory
-    output_file = os.path.join(OUTPUT_DIR, f"followup_outputs_{depth}.txt")
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(f"Follow-up Command Results (Level {depth+1}):\n\n")
-        for cmd, output in command_outputs.items():
-            f.write(f"Command: {cmd}\n")
-            f.write(f"Output:\n{output}\n")
-            f.write("-" * 50 + "\n\n")
+    # Save the outputs in the dedicated output directory, compressed or split by size
+    encoded = history.encode_all(command_outputs, full=True)
+    output_files = build_attachments(encoded, OUTPUT_DIR, f"followup_outputs_{depth}",
+                                     f"Follow-up Command Results (Level {depth+1}):\n\n")
     
-    print(f"Saved follow-up outputs to: {output_file}")
+    print(f"Saved follow-up outputs to: {', '.join(output_files)}")
     
     # Try to send the file as an attachment
+    response = None
     try:
         print("Sending file as attachment to bot...")
-        response = await client.send_message(f"I've executed the follow-up commands (level {depth+1}). Here are the results:", file_path=[output_file])
+        response = await client.send_message(f"I've executed the follow-up commands (level {depth+1}). Here are the results:", file_path=output_files)
         print(f"\nBot's follow-up response: {response}")
     except Exception as e:
         print(f"Error sending file attachment: {e}")
@@ -129,8 +130,7 @@ async def execute_commands_recursive(client, commands, depth=0):
             response = await client.send_message(review_message)
             
             # Now send another message with the file contents
-            with open(output_file, "r", encoding="utf-8") as f:
-                file_contents = f.read()
+            file_contents = read_fallback_text(output_files, encoded)
             
             chunk_size = 1500  # Reasonable chunk size to avoid message limits
             for i in range(0, len(file_contents), chunk_size):
@@ -142,8 +142,11 @@ async def execute_commands_recursive(client, commands, depth=0):
             print(f"\nBot's follow-up response: {response}")
         except Exception as e2:
             print(f"Error with fallback method: {e2}")
+            response = None
+    # The outputs are the previous run only if the bot got them
+    history.commit(response is not None)
     
     # Extract and execute any further commands
     more_commands = extract_commands(response)
     if more_commands:
-        await execute_commands_recursive(client, more_commands, depth + 1)
\ No newline at end of file
+        await execute_commands_recursive(client, more_commands, depth + 1, history)
\ No newline at end of file
@@ -0,0 +1,211 @@
+import os
+import sys
+import tempfile
+import time
+import weakref
+from settings import get_profile
+
+STREAM_CHUNK_CHARS = 64 * 1024
+RSS_DIVISOR = 1024 if sys.platform == "darwin" else 1  # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+
+def _spill(text):
+    """Write text to a temp file and return its path."""
+    fd, path = tempfile.mkstemp(prefix="lililia_output_", suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8", errors="replace") as f:
+        f.write(text)
+    return path
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+class CommandResult:
+    """The outcome of one command.
+
+    stdout and stderr longer than the profile's result_max_inline_chars keep
+    only their head and tail in memory; the full text is spilled to a temp file
+    (removed when the result is garbage collected) and read back by
+    full_stdout()/full_stderr().
+    CPU time and peak RSS are set from the process's rusage when it is known.
+    """
+
+    __slots__ = (
+        "command", "message", "returncode", "started", "duration_ms",
+        "stdout_bytes", "stderr_bytes", "stdout_truncated", "stderr_truncated",
+        "cpu_user_ms", "cpu_sys_ms", "peak_rss_kb",
+        "_stdout", "_stderr", "_stdout_path", "_stderr_path", "__weakref__",
+    )
+
+    def __init__(self, command="", stdout="", stderr="", returncode=None, message=""):
+        self.command = command
+        self.message = message
+        self.returncode = returncode
+        self.started = time.time()
+        self.duration_ms = None
+        self.cpu_user_ms = None
+        self.cpu_sys_ms = None
+        self.peak_rss_kb = None
+        self._stdout_path = None
+        self._stderr_path = None
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @classmethod
+    def error(cls, command, message, returncode=-1):
+        """Return a result for a command that could not be run."""
+        return cls(command, stderr=message, returncode=returncode, message=message)
+
+    def _store(self, name, text):
+        text = text or ""
+        if text.isascii():
+            size = len(text)
+        else:
+            size = len(text.encode("utf-8", "replace"))
+        setattr(self, f"{name}_bytes", size)
+        profile = get_profile()
+        truncated = len(text) > profile.result_max_inline_chars
+        setattr(self, f"{name}_truncated", truncated)
+        setattr(self, f"_{name}_path", None)
+        if truncated:
+            path = _spill(text)
+            setattr(self, f"_{name}_path", path)
+            weakref.finalize(self, _remove, path)
+            keep = profile.result_keep_chars
+            omitted = len(text) - 2 * keep
+            text = f"{text[:keep]}\n... [{omitted} characters truncated] ...\n{text[-keep:]}"
+        setattr(self, f"_{name}", text)
+
+    def _load(self, name):
+        path = getattr(self, f"_{name}_path")
+        if path is None:
+            return getattr(self, f"_{name}")
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _stream(self, name, chunk_size):
+        path = getattr(self, f"_{name}_path")
+        if path is None:
+            yield getattr(self, f"_{name}")
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    @property
+    def stdout(self):
+        return self._stdout
+
+    @stdout.setter
+    def stdout(self, text):
+        self._store("stdout", text)
+
+    @property
+    def stderr(self):
+        return self._stderr
+
+    @stderr.setter
+    def stderr(self, text):
+        self._store("stderr", text)
+
+    def full_stdout(self):
+        """Return the complete stdout, reading it back from disk if it was truncated."""
+        return self._load("stdout")
+
+    def full_stderr(self):
+        """Return the complete stderr, reading it back from disk if it was truncated."""
+        return self._load("stderr")
+
+    def stream_stdout(self, chunk_size=STREAM_CHUNK_CHARS):
+        """Yield the complete stdout in chunks without loading a spilled output at once."""
+        return self._stream("stdout", chunk_size)
+
+    def stream_stderr(self, chunk_size=STREAM_CHUNK_CHARS):
+        """Yield the complete stderr in chunks without loading a spilled output at once."""
+        return self._stream("stderr", chunk_size)
+
+    @property
+    def truncated(self):
+        return self.stdout_truncated or self.stderr_truncated
+
+    @property
+    def exit_status(self):
+        """The exit code, or 0/1 for commands that ran no process (success unless stderr is set)."""
+        if self.returncode is not None:
+            return self.returncode
+        return 1 if self._stderr else 0
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
+    @property
+    def output_bytes(self):
+        return self.stdout_bytes + self.stderr_bytes
+
+    def set_rusage(self, rusage):
+        """Take CPU time and peak RSS from a resource.struct_rusage (ignored if None)."""
+        if rusage is None:
+            return
+        self.cpu_user_ms = round(rusage.ru_utime * 1000, 1)
+        self.cpu_sys_ms = round(rusage.ru_stime * 1000, 1)
+        self.peak_rss_kb = rusage.ru_maxrss // RSS_DIVISOR
+
+    def usage(self):
+        """Return wall time, CPU time, peak RSS and output bytes as a dict."""
+        return {
+            "wall_ms": self.duration_ms,
+            "cpu_user_ms": self.cpu_user_ms,
+            "cpu_sys_ms": self.cpu_sys_ms,
+            "peak_rss_kb": self.peak_rss_kb,
+            "output_bytes": self.output_bytes,
+        }
+
+    def finish(self):
+        """Record the time elapsed since the command started."""
+        self.duration_ms = round((time.time() - self.started) * 1000, 1)
+        return self
+
+    def size(self):
+        """Return the in-memory size in characters of the text fields."""
+        return len(self.message) + len(self._stdout) + len(self._stderr)
+
+    def preview(self, limit=100):
+        """Return a one-line preview of the output."""
+        text = (self.message or self._stdout or self._stderr).strip()
+        if not text:
+            return "(no output)"
+        text = text.replace("\n", " ")
+        return text[:limit] + ("..." if len(text) > limit else "")
+
+    def to_dict(self):
+        """Return the result as a JSON-serializable dict."""
+        return {
+            "command": self.command,
+            "stdout": self._stdout,
+            "stderr": self._stderr,
+            "returncode": self.returncode,
+            "message": self.message,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "stdout_bytes": self.stdout_bytes,
+            "stderr_bytes": self.stderr_bytes,
+            "stdout_truncated": self.stdout_truncated,
+            "stderr_truncated": self.stderr_truncated,
+            "cpu_user_ms": self.cpu_user_ms,
+            "cpu_sys_ms": self.cpu_sys_ms,
+            "peak_rss_kb": self.peak_rss_kb,
+        }
+
+    def __repr__(self):
+        return f"CommandResult({self.command[:40]!r}, returncode={self.returncode!r}, {self.preview(40)!r})"
+
+def to_json(value):
+    """json.dumps default= hook that serializes CommandResult objects."""
+    if isinstance(value, CommandResult):
+        return value.to_dict()
+    return str(value)
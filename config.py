@@ -13,9 +13,14 @@ CHAT_CODE = "39ataiix8zcyz0n5mzp"
 # Image generation bot configuration
 IMAGE_BOT_NAME = "Lililia-image-gen"  # Correct bot name for image generation
 IMAGE_BOT_CHAT_CODE = "39asqtk2h4diwi37p03"  # Image generation bot chat code
+IMAGE_BOT_BATCHING = True  # The image bot answers several numbered prompts in one message
+IMAGE_BATCH_WINDOW = 1.5  # Seconds to wait for more prompts before sending a batch
+IMAGE_BATCH_MAX_PROMPTS = 4  # Prompts sent to the image bot in one message at most
 
 # Command pattern for extraction
 COMMAND_PATTERN = r'\[\[(.*?)\]\]'
+# PATCH commands span several lines; their body ends at the first ']]'
+PATCH_COMMAND_PATTERN = r'\[\[(PATCH:(?s:.*?))\]\]'
 
 # Command prefixes
 CMD_PREFIX_FILE = "FILE:"
@@ -23,4 +28,131 @@ CMD_PREFIX_DIR = "DIR:"
 CMD_PREFIX_RUN = "RUN:"
 CMD_PREFIX_GIT = "GIT:"
 CMD_PREFIX_INSTALL = "INSTALL:"
+CMD_PREFIX_SHELL = "SHELL:"
+CMD_PREFIX_PATCH = "PATCH:"
+CMD_PREFIX_TREE = "TREE:"
+CMD_PREFIX_GLOB = "GLOB:"
+CMD_PREFIX_GREP = "GREP:"
+CMD_PREFIX_SUMMARY = "SUMMARY:"
 
+
+
+# Context budget for outgoing messages
+MAX_MESSAGE_TOKENS = 12000  # Per-message budget; larger messages are trimmed
+CHARS_PER_TOKEN = 4  # Rough characters-per-token ratio used for estimates
+TRIM_KEEP_LINES = 40  # Lines kept at the head and tail of a trimmed output block
+
+# Headless server settings
+SERVER_HOST = "127.0.0.1"  # Only listen locally by default
+SERVER_PORT = 8765
+CLIENT_CONNECT_TIMEOUT = 60  # Seconds a message waits for the bot client to connect
+SERVER_TOKEN = None  # Secret clients send in X-Lililia-Token; LILILIA_SERVER_TOKEN overrides it
+SERVER_TOKEN_FILE = ".lililia_server_token"  # Holds a generated token when none is configured
+SERVER_MAX_JOBS = 256  # Command jobs kept for GET /results; the oldest finished ones are dropped
+
+# Session settings
+SESSION_CLIENT_POOL_SIZE = 2  # Poe connections shared by all sessions
+SESSION_EXECUTOR_WORKERS = 4  # Threads shared by all sessions for running commands
+
+# Batch mode settings
+BATCH_PARALLELISM = 4  # Independent prompts run at the same time (one Poe connection each)
+BATCH_MAX_ROUNDS = 4  # Command/review rounds per prompt before it is stopped
+BATCH_OUTPUT = "batch_results.jsonl"  # Results file; '-' writes to stdout
+
+# Tracing
+TRACE_FILE = None  # Path of a JSONL trace file; the LILILIA_TRACE environment variable overrides it
+
+# Persistent shell for RUN commands (not available on Windows)
+USE_PERSISTENT_SHELL = False  # Run successive RUN commands in one long-lived bash per conversation
+SHELL_COMMAND_TIMEOUT = 600  # Seconds before a command is abandoned and the shell restarted
+
+# File writes
+FILE_ENCODING = "utf-8"  # Encoding for files written by FILE: commands
+FSYNC_FILE_WRITES = False  # Sync written files and their directories to disk before returning
+
+# Workspace index for TREE:/GLOB:/GREP:/SUMMARY: queries
+WORKSPACE_IGNORE_DIRS = (".git", "__pycache__", "node_modules", ".venv", "venv", "command_outputs")
+WORKSPACE_REFRESH_INTERVAL = 2.0  # Seconds a scan stays fresh unless files were written in between
+WORKSPACE_MAX_FILE_BYTES = 1024 * 1024  # Larger files are listed but not searched or summarized
+WORKSPACE_MAX_RESULTS = 200  # Lines returned by a single query
+WORKSPACE_SNAPSHOT = False  # Append a compact file listing to outgoing messages when it changed
+WORKSPACE_SNAPSHOT_ENTRIES = 100  # Paths listed in a snapshot
+# Review transport: outputs are sent inline, as an attachment, or summarized with an attachment
+REVIEW_INLINE_MAX_CHARS = 8000  # Larger reviews are sent as a file attachment
+REVIEW_SUMMARY_MIN_CHARS = 200000  # Larger reviews also get a per-command summary in the message
+REVIEW_ATTACHMENT_DIR = None  # Where review attachments are written; None uses the system temp dir
+ATTACHMENT_COMPRESS_MIN_BYTES = 256 * 1024  # Larger attachments are compressed
+ATTACHMENT_COMPRESSION = "zip"  # "zip" or "gzip"
+ATTACHMENT_COMPRESS_LEVEL = 6
+ATTACHMENT_PART_BYTES = 8 * 1024 * 1024  # Larger attachments are split into parts of this many bytes (uncompressed)
+ATTACHMENT_MAX_PARTS = 10  # Output beyond this many parts is left out and noted in the manifest
+
+# Command results
+RESULT_MAX_INLINE_CHARS = 256 * 1024  # Longer stdout/stderr is spilled to a temp file
+RESULT_KEEP_CHARS = 32 * 1024  # Characters of a spilled output kept in memory at the head and tail
+
+# Scheduling of bot traffic in the GUI: interactive messages, command reviews, background image work
+SCHEDULER_LANE_LIMITS = {"interactive": 1, "review": 1, "background": 1}  # Concurrent jobs per lane
+SCHEDULER_MAX_RUNNING = 2  # Concurrent jobs across all lanes
+SCHEDULER_STARVATION_SECONDS = 30  # Jobs waiting longer than this go ahead of every lane
+SCHEDULER_MAX_PREEMPTIONS = 3  # Times a background job can be cancelled and restarted
+SCHEDULER_QUEUE_LIMITS = {"background": 16}  # Waiting jobs per lane before the oldest preemptible one is dropped
+
+# Bounded queues in the GUI
+RESPONSE_QUEUE_SIZE = 32  # Replies waiting to be displayed; the bot lanes block when it is full
+COMMAND_QUEUE_SIZE = 4  # Command batches waiting to run; further batches are merged into the newest one
+
+# Conversation history (SQLite)
+HISTORY_ENABLED = True  # Record messages and command results to the history database
+HISTORY_DB_PATH = "lililia_history.db"
+HISTORY_BATCH_SIZE = 200  # Writes committed per transaction at most
+HISTORY_FLUSH_INTERVAL = 0.2  # Seconds the writer waits to gather a batch
+HISTORY_PAGE_SIZE = 50  # Messages per page when browsing or restoring
+
+# Resource accounting: commands over any of these limits are flagged when they are run again
+USAGE_EXPENSIVE_WALL_MS = 60000
+USAGE_EXPENSIVE_CPU_MS = 30000  # User plus system CPU time
+USAGE_EXPENSIVE_RSS_KB = 1024 * 1024  # Peak resident memory
+USAGE_EXPENSIVE_OUTPUT_BYTES = 10 * 1024 * 1024
+USAGE_MAX_COMMANDS = 500  # Commands whose last usage is remembered
+USAGE_TOP_COMMANDS = 20  # Most expensive commands listed by GET /metrics
+
+# Command planner: independent commands of a reply run in parallel
+PLANNER_ENABLED = True
+PLANNER_MAX_WORKERS = 4  # Commands run at the same time at most
+
+# Speculative prefetch: likely follow-up commands run while a review is with the bot
+SPECULATION_ENABLED = False
+SPECULATION_RULES = [  # (regex matched against an executed command, follow-up commands to prefetch)
+    (r"^GIT:\s*(status|add|checkout|merge|pull|stash)\b", ["GIT: diff"]),
+    (r"^(INSTALL:|RUN:\s*pip3? install)", ["RUN: pip list"]),
+    (r"^(FILE|PATCH):\s*\S*test\S*\.py", ["RUN: python -m pytest -q"]),  # Runs only if allowed below
+]
+SPECULATION_ALLOW = ()  # Command prefixes prefetched even though they may not be read-only, e.g. "RUN: python -m pytest"
+SPECULATION_MIN_COUNT = 3  # Times a follow-up must have been seen before it is learned
+SPECULATION_MIN_PROBABILITY = 0.5  # Share of rounds a learned follow-up must have followed its command
+SPECULATION_MAX_COMMANDS = 4  # Follow-ups prefetched per round
+SPECULATION_MAX_DURATION_MS = 5000  # Follow-ups that usually take longer are not prefetched
+SPECULATION_WORKERS = 2
+SPECULATION_HISTORY_LIMIT = 5000  # Stored commands learned from at startup
+SPECULATION_ROUND_GAP = 2.0  # Seconds between stored commands that separate two rounds
+
+# Review deltas: outputs of rerun commands are sent as a diff against their previous run
+OUTPUT_DELTA_ENABLED = True
+OUTPUT_DELTA_MAX_COMMANDS = 64  # Previous outputs remembered per conversation
+OUTPUT_DELTA_MAX_CHARS = 500000  # Longer outputs are compared by hash only, never diffed
+OUTPUT_DELTA_CONTEXT_LINES = 3  # Unchanged lines shown around each change
+OUTPUT_DELTA_MAX_RATIO = 0.6  # A diff longer than this share of the output is replaced by the output
+
+# Execution profiles (settings.py). The profile's values start from the constants above, then
+# EXECUTION_PROFILES, then [profiles.default] and [profiles.<name>] in SETTINGS_FILE, then
+# LILILIA_<SETTING> environment variables (e.g. LILILIA_MAX_WORKERS=8).
+SETTINGS_FILE = "lililia.toml"  # The LILILIA_CONFIG environment variable overrides it
+EXECUTION_PROFILE = "default"  # `profile = "..."` in SETTINGS_FILE or LILILIA_PROFILE override it
+EXECUTION_PROFILES = {
+    "default": {},
+    "conservative": {"planner_enabled": False, "max_workers": 1, "command_timeout": 300},
+    "throughput": {"max_workers": 8, "result_max_inline_chars": 1024 * 1024},
+}
+COMMAND_TIMEOUT = 0  # Seconds before a RUN/GIT/INSTALL subprocess is killed; 0 waits forever
+SETTINGS_RELOAD_INTERVAL = 2.0  # Seconds between checks of SETTINGS_FILE for changes
@@ -0,0 +1,130 @@
+import math
+import re
+import threading
+from config import MAX_MESSAGE_TOKENS, CHARS_PER_TOKEN, TRIM_KEEP_LINES
+
+# Fenced code blocks are the parts of a message that grow with command output
+CODE_BLOCK_PATTERN = re.compile(r"```\n(.*?)```", re.DOTALL)
+TRIM_MARKER_PATTERN = re.compile(r"^\.\.\. \[(\d+) lines trimmed\] \.\.\.$")
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in text without a tokenizer."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _trim_block(body, keep_lines):
+    """Keep keep_lines lines at the head and tail of a block body and drop the middle.
+
+    A block trimmed before is trimmed again only if it keeps more lines than
+    that, and its marker then counts every dropped line. Returns None when
+    there is nothing to drop.
+    """
+    ending = "\n" if body.endswith("\n") else ""
+    lines = body[:len(body) - len(ending)].split("\n")
+    marker = next((i for i, line in enumerate(lines) if TRIM_MARKER_PATTERN.match(line)), None)
+    if marker is None:
+        if len(lines) <= keep_lines * 2 + 1:
+            return None
+        head, tail, dropped = lines[:keep_lines], lines[len(lines) - keep_lines:], len(lines) - keep_lines * 2
+    else:
+        head, tail = lines[:marker], lines[marker + 1:]
+        if len(head) <= keep_lines and len(tail) <= keep_lines:
+            return None
+        dropped = int(TRIM_MARKER_PATTERN.match(lines[marker]).group(1))
+        dropped += max(len(head) - keep_lines, 0) + max(len(tail) - keep_lines, 0)
+        head, tail = head[:keep_lines], tail[max(len(tail) - keep_lines, 0):]
+    return "\n".join(head + [f"... [{dropped} lines trimmed] ..."] + tail) + ending
+
+def _truncate_middle(text, max_chars):
+    """Cut the middle out of text so it fits in max_chars."""
+    if len(text) <= max_chars:
+        return text
+    marker = f"\n\n... [{len(text) - max_chars} characters trimmed] ...\n\n"
+    keep = max(max_chars - len(marker), 0)
+    head = keep * 2 // 3
+    tail = keep - head
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+class ContextBudgeter:
+    """Estimates tokens for outgoing messages and enforces a per-message budget."""
+
+    def __init__(self, max_message_tokens=MAX_MESSAGE_TOKENS, keep_lines=TRIM_KEEP_LINES):
+        self.max_message_tokens = max_message_tokens
+        self.keep_lines = keep_lines
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, key):
+        stats = self._usage.get(key)
+        if stats is None:
+            stats = {
+                "messages": 0,
+                "tokens_sent": 0,
+                "tokens_received": 0,
+                "tokens_trimmed": 0,
+                "trimmed_messages": 0,
+                "largest_message": 0,
+            }
+            self._usage[key] = stats
+        return stats
+
+    def fits(self, message):
+        """Return True if message is inside the per-message budget and will be sent as is."""
+        return not self.max_message_tokens or estimate_tokens(message) <= self.max_message_tokens
+
+    def fit(self, message):
+        """Return message trimmed to fit the per-message budget."""
+        if self.fits(message):
+            return message
+
+        # Shrink the largest code blocks first, keeping their head and tail. Every pass
+        # either lowers the estimate or halves keep_lines, so the loop always ends.
+        keep_lines = self.keep_lines
+        while keep_lines >= 1 and estimate_tokens(message) > self.max_message_tokens:
+            before = estimate_tokens(message)
+            blocks = sorted(CODE_BLOCK_PATTERN.finditer(message), key=lambda m: len(m.group(1)), reverse=True)
+            for match in blocks:
+                trimmed = _trim_block(match.group(1), keep_lines)
+                if trimmed is not None:
+                    message = message[:match.start(1)] + trimmed + message[match.end(1):]
+                    break
+            if estimate_tokens(message) >= before:
+                keep_lines //= 2
+
+        # Fall back to cutting the middle of the whole message
+        if estimate_tokens(message) > self.max_message_tokens:
+            message = _truncate_middle(message, self.max_message_tokens * CHARS_PER_TOKEN)
+        return message
+
+    def prepare(self, message, chat_key):
+        """Fit message to the budget and record its usage under chat_key."""
+        original_tokens = estimate_tokens(message)
+        fitted = self.fit(message)
+        tokens = estimate_tokens(fitted)
+        with self._lock:
+            stats = self._stats(chat_key)
+            stats["messages"] += 1
+            stats["tokens_sent"] += tokens
+            stats["largest_message"] = max(stats["largest_message"], tokens)
+            if fitted is not message:
+                stats["trimmed_messages"] += 1
+                stats["tokens_trimmed"] += original_tokens - tokens
+        if fitted is not message:
+            print(f"Trimmed outgoing message from ~{original_tokens} to ~{tokens} tokens")
+        return fitted
+
+    def record_response(self, response, chat_key):
+        """Record the size of a bot reply under chat_key."""
+        with self._lock:
+            self._stats(chat_key)["tokens_received"] += estimate_tokens(response)
+
+    def get_metrics(self, chat_key=None):
+        """Return a snapshot of token usage, for one chat or all of them."""
+        with self._lock:
+            if chat_key is not None:
+                return dict(self._stats(chat_key))
+            return {key: dict(stats) for key, stats in self._usage.items()}
+
+# Shared budgeter used by every client unless one is passed in
+budgeter = ContextBudgeter()
@@ -0,0 +1,81 @@
+"""Local stand-in for poe_api_wrapper.AsyncPoeApi.
+
+FakeAsyncPoeApi answers send_message with scripted replies streamed in chunks,
+with configurable latency, chunk cadence and error rate, so the pipeline can be
+exercised and measured offline:
+
+    api = FakeAsyncPoeApi(first_chunk_delay=0.05, chunk_interval=0.01)
+    client = await PoeClientWrapper(tokens={}, bot_name="bot", chat_code="c", api=api).initialize()
+"""
+import asyncio
+import itertools
+import random
+
+DEFAULT_SCRIPT = [
+    "Let me look at the workspace first.\n\n[[RUN: echo listing workspace]]\n[[DIR: fake_workspace/src]]",
+    "Creating the project layout.\n\n[[DIR: fake_workspace/tests]]\n[[RUN: echo setup done]]",
+    "Here is a picture to go with it.\n\nGenerate an image of: a small robot writing code",
+    "Everything looks good. No further commands are needed.",
+]
+
+class FakePoeError(Exception):
+    """Raised by the fake backend to simulate a failed request."""
+
+class FakeAsyncPoeApi:
+    """Async fake of the Poe API with scripted, chunked replies."""
+
+    def __init__(self, script=None, first_chunk_delay=0.0, chunk_interval=0.0,
+                 chunk_size=40, error_rate=0.0, seed=None):
+        """
+        Args:
+            script (list or callable, optional): Replies served in rotation, or a
+                function (bot_name, message) -> reply
+            first_chunk_delay (float): Seconds before the first chunk
+            chunk_interval (float): Seconds between chunks
+            chunk_size (int): Characters added per chunk
+            error_rate (float): Probability that a request fails
+            seed (int, optional): Seed for reproducible errors
+        """
+        self.script = script or DEFAULT_SCRIPT
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_interval = chunk_interval
+        self.chunk_size = max(1, chunk_size)
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._replies = itertools.cycle(self.script) if not callable(self.script) else None
+        self._chat_ids = itertools.count(1)
+        self.requests = []
+
+    async def create(self):
+        """Match AsyncPoeApi(...).create()."""
+        return self
+
+    def next_reply(self, bot_name, message):
+        """Return the reply for a message."""
+        if self._replies is None:
+            return self.script(bot_name, message)
+        return next(self._replies)
+
+    async def send_message(self, bot_name, message, chatCode=None, file_path=None, **kwargs):
+        """Yield reply chunks shaped like AsyncPoeApi's ({"text", "response", "chatCode"})."""
+        self.requests.append({
+            "bot": bot_name,
+            "chat_code": chatCode,
+            "message": message,
+            "file_path": file_path,
+        })
+        if self.first_chunk_delay:
+            await asyncio.sleep(self.first_chunk_delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise FakePoeError("Simulated backend error")
+
+        reply = self.next_reply(bot_name, message)
+        # Like Poe, a message without a chat code opens a new chat
+        chat_code = chatCode or f"fake-chat-{next(self._chat_ids)}"
+        text = ""
+        for start in range(0, len(reply), self.chunk_size):
+            if start and self.chunk_interval:
+                await asyncio.sleep(self.chunk_interval)
+            delta = reply[start:start + self.chunk_size]
+            text += delta
+            yield {"text": text, "response": delta, "chatCode": chat_code}
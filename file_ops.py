@@ -0,0 +1,194 @@
+import hashlib
+import os
+import secrets
+from config import CMD_PREFIX_FILE, CMD_PREFIX_DIR, FILE_ENCODING, FSYNC_FILE_WRITES
+from utils import expand_path
+from tracing import span
+from command_result import CommandResult
+
+# Temp files are created 0666 so the kernel applies the umask, like open() would
+TEMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
+def parse_file_command(cmd, cwd=None):
+    """Split a FILE: command into (path, content); returns None if malformed."""
+    parts = cmd.split("]]", 1)  # Split at the first ']]'
+    if len(parts) < 2:
+        return None
+    file_path = expand_path(parts[0][len(CMD_PREFIX_FILE):].strip(), cwd)
+    return file_path, parts[1].strip()
+
+def is_file_op(cmd):
+    """Return True for commands that write_files can batch."""
+    return cmd.startswith(CMD_PREFIX_FILE) or cmd.startswith(CMD_PREFIX_DIR)
+
+def group_file_ops(commands):
+    """Split commands into runs, grouping consecutive FILE:/DIR: commands.
+
+    Yields (is_file_batch, commands) in the original order.
+    """
+    batch = []
+    for cmd in commands:
+        if is_file_op(cmd):
+            batch.append(cmd)
+            continue
+        if batch:
+            yield True, batch
+            batch = []
+        yield False, [cmd]
+    if batch:
+        yield True, batch
+
+def file_digest(path):
+    """Return the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.digest()
+
+def is_unchanged(path, data):
+    """Return True if path already holds exactly data."""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        return file_digest(path) == hashlib.sha256(data).digest()
+    except OSError:
+        return False
+
+def _write_temp(path, data, fsync):
+    """Write data to a temp file next to path and return the temp path."""
+    directory = os.path.dirname(path) or "."
+    while True:
+        temp_path = os.path.join(directory, f".tmp_{secrets.token_hex(8)}")
+        try:
+            fd = os.open(temp_path, TEMP_FLAGS, 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        try:
+            # An existing file keeps its mode
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception:
+        os.unlink(temp_path)
+        raise
+    return temp_path
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform (e.g. Windows)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path, content, encoding=FILE_ENCODING, fsync=FSYNC_FILE_WRITES):
+    """Write content to path through a temp file and rename; returns False if unchanged."""
+    data = content.encode(encoding)
+    if is_unchanged(path, data):
+        return False
+    temp_path = _write_temp(path, data, fsync)
+    os.replace(temp_path, path)
+    if fsync:
+        _fsync_dir(os.path.dirname(path))
+    return True
+
+def write_files(commands, cwd=None, fsync=FSYNC_FILE_WRITES, encoding=FILE_ENCODING):
+    """Apply many FILE: and DIR: commands together.
+
+    Directories are created once, files are written to temp files and renamed
+    into place so readers never see half-written content, and files whose
+    content is unchanged are skipped. With fsync, all temp files are synced
+    before any rename and each directory is synced once at the end.
+
+    Returns a list of (command, CommandResult) pairs in command order.
+    """
+    results = []
+    directories = set()
+    dir_commands = []  # (index, path)
+    pending = []  # (index, path, data)
+
+    with span("file.batch", commands=len(commands)):
+        # Parse everything and collect the directories to create
+        for cmd in commands:
+            result = CommandResult(cmd)
+            results.append((cmd, result))
+            if cmd.startswith(CMD_PREFIX_DIR):
+                dir_path = expand_path(cmd[len(CMD_PREFIX_DIR):].strip(), cwd)
+                directories.add(dir_path)
+                dir_commands.append((len(results) - 1, dir_path))
+                result.message = f"Directory created: {dir_path}"
+                continue
+            parsed = parse_file_command(cmd, cwd)
+            if parsed is None:
+                result.message = "Error: Invalid FILE command format"
+                continue
+            file_path, content = parsed
+            if os.path.dirname(file_path):
+                directories.add(os.path.dirname(file_path))
+            pending.append((len(results) - 1, file_path, content.encode(encoding)))
+
+        failed_dirs = {}
+        for directory in sorted(directories):
+            if os.path.isdir(directory):
+                continue
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except Exception as e:
+                failed_dirs[directory] = str(e)
+
+        # Report directory failures on the commands that needed them
+        for index, dir_path in dir_commands:
+            if dir_path in failed_dirs:
+                result = results[index][1]
+                result.stderr = failed_dirs[dir_path]
+                result.message = f"Error creating directory: {failed_dirs[dir_path]}"
+
+        # Write temp files, then rename them all into place
+        renames = []
+        written = skipped = 0
+        for index, file_path, data in pending:
+            result = results[index][1]
+            directory = os.path.dirname(file_path)
+            if directory in failed_dirs:
+                result.stderr = failed_dirs[directory]
+                result.message = f"Error creating directory: {failed_dirs[directory]}"
+                continue
+            try:
+                if is_unchanged(file_path, data):
+                    result.message = f"File unchanged: {file_path}"
+                    skipped += 1
+                    continue
+                renames.append((index, file_path, _write_temp(file_path, data, fsync)))
+            except Exception as e:
+                result.stderr = str(e)
+                result.message = f"Error creating file: {e}"
+
+        synced_dirs = set()
+        for index, file_path, temp_path in renames:
+            result = results[index][1]
+            try:
+                os.replace(temp_path, file_path)
+                result.message = f"File created: {file_path}"
+                written += 1
+                synced_dirs.add(os.path.dirname(file_path))
+            except Exception as e:
+                os.unlink(temp_path)
+                result.stderr = str(e)
+                result.message = f"Error creating file: {e}"
+
+        if fsync:
+            for directory in synced_dirs:
+                _fsync_dir(directory)
+
+    print(f"File batch: {written} written, {skipped} unchanged, {len(directories)} directories")
+    return results
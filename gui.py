@@ -0,0 +1,828 @@
+import asyncio
+import sys
+import tkinter as tk
+from tkinter import scrolledtext, ttk
+import threading
+import queue
+import time
+from poe_client import PoeClientWrapper
+from utils import extract_commands, extract_image_prompt, extract_image_urls, write_command_output
+from command_executor import execute_command, execute_commands, ensure_git_credentials
+from command_result import CommandResult
+from file_ops import group_file_ops
+from tracing import span
+from shell_session import create_shell
+from scheduler import Scheduler, INTERACTIVE, REVIEW, BACKGROUND
+from planner import run_plan
+from history_store import get_store
+from workspace_index import with_snapshot
+from speculation import Speculator
+from bounded_queue import BoundedQueue, BLOCK, COALESCE
+from output_delta import OutputHistory
+from resource_usage import usage
+from settings import get_profile
+from config import WORKSPACE_SNAPSHOT, HISTORY_PAGE_SIZE, CLIENT_CONNECT_TIMEOUT
+from config import SPECULATION_ENABLED, RESPONSE_QUEUE_SIZE, COMMAND_QUEUE_SIZE
+from config import IMAGE_BOT_BATCHING, IMAGE_BATCH_WINDOW, IMAGE_BATCH_MAX_PROMPTS
+
+# Try importing configuration, with fallback for missing variables
+try:
+    from config import POE_TOKENS, BOT_NAME, CHAT_CODE, IMAGE_BOT_NAME, IMAGE_BOT_CHAT_CODE
+except ImportError as e:
+    print(f"Error importing configuration: {e}")
+    print("Please ensure config.py contains POE_TOKENS, BOT_NAME, CHAT_CODE, and IMAGE_BOT_CHAT_CODE.")
+    IMAGE_BOT_CHAT_CODE = "39asqtk2h4diwi37p03"  # Fallback to the provided code
+    sys.exit(1)
+
+# Global variables
+command_window = None
+chat_window = None
+response_queue = BoundedQueue(RESPONSE_QUEUE_SIZE, BLOCK, name="response")
+
+def merge_command_batches(queued, new):
+    """Fold a new (commands, response) batch into one that is still waiting to run."""
+    return queued[0] + new[0], new[1]
+
+def build_image_batch_prompt(prompts):
+    """Return the message asking the image bot for one image per prompt."""
+    if len(prompts) == 1:
+        return prompts[0]
+    numbered = "\n".join(f"{i}. {prompt}" for i, prompt in enumerate(prompts, 1))
+    return f"Generate one image for each of these {len(prompts)} prompts, in this order:\n\n{numbered}"
+
+def build_image_confirmation(outcomes):
+    """Return one message telling the main bot about each (prompts, image response, urls) outcome."""
+    sections = []
+    for prompts, image_response, image_urls in outcomes:
+        about = "your prompt" if len(prompts) == 1 else "your prompts"
+        if len(outcomes) > 1 or len(prompts) > 1:
+            about += " (" + "; ".join(prompt[:80] for prompt in prompts) + ")"
+        if image_urls and len(prompts) > 1:
+            sections.append(f"Here are the generated images based on {about}:\n\n{image_response}")
+        elif image_urls:
+            sections.append(f"Here's the generated image based on {about}:\n\n{image_response}")
+        else:
+            sections.append(f"I tried to generate an image for {about}, but couldn't detect any image URLs in the response.")
+    return "\n\n".join(sections)
+
+class CommandDisplay(tk.Toplevel):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Command Output Display")
+        self.geometry("800x600")
+        
+        # Configure the grid
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=0)  # Header
+        self.rowconfigure(1, weight=1)  # Command output
+        
+        # Header
+        header_frame = ttk.Frame(self)
+        header_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=5)
+        
+        ttk.Label(header_frame, text="Command Output Display", font=("Arial", 14, "bold")).pack(side=tk.LEFT)
+        
+        # Clear button
+        clear_button = ttk.Button(header_frame, text="Clear", command=self.clear_output)
+        clear_button.pack(side=tk.RIGHT, padx=10)
+        
+        # Command output area
+        self.output_text = scrolledtext.ScrolledText(self, wrap=tk.WORD, font=("Consolas", 10))
+        self.output_text.grid(row=1, column=0, sticky="nsew", padx=10, pady=5)
+        
+        # Configure text tags
+        self.output_text.tag_configure("command", foreground="blue", font=("Consolas", 10, "bold"))
+        self.output_text.tag_configure("output", foreground="black")
+        self.output_text.tag_configure("success", foreground="green", font=("Consolas", 10, "bold"))
+        self.output_text.tag_configure("error", foreground="red", font=("Consolas", 10, "bold"))
+        
+        # Keep window open even when main program exits
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def clear_output(self):
+        """Clear the output text area"""
+        self.output_text.delete(1.0, tk.END)
+    
+    def on_close(self):
+        """Hide the window instead of closing it"""
+        self.withdraw()
+    
+    def display_command(self, command):
+        """Display a command that's about to be executed"""
+        self.deiconify()  # Make window visible if it was hidden
+        self.output_text.insert(tk.END, f"\n\n[COMMAND] {command}\n", "command")
+        self.output_text.see(tk.END)
+        self.update()
+    
+    def display_output(self, output, is_error=False):
+        """Display command output"""
+        tag = "error" if is_error else "output"
+        with span("ui.render", widget="command_output", chars=len(output)):
+            self.output_text.insert(tk.END, f"{output}\n", tag)
+            self.output_text.see(tk.END)
+            self.update()
+    
+    def display_result(self, exit_code):
+        """Display command result"""
+        if exit_code == 0:
+            self.output_text.insert(tk.END, f"\n[SUCCESS] Command completed successfully (exit code: {exit_code})\n", "success")
+        else:
+            self.output_text.insert(tk.END, f"\n[ERROR] Command failed with exit code: {exit_code}\n", "error")
+        self.output_text.see(tk.END)
+        self.update()
+
+class ChatInterface(tk.Tk):
+    def __init__(self, server_address=None, api=None):
+        super().__init__()
+        self.title(f"Chat with {BOT_NAME}")
+        self.geometry("900x700")
+        
+        # Configure the grid
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)  # Chat history
+        self.rowconfigure(1, weight=0)  # Input area
+        
+        # Chat history area
+        self.chat_frame = ttk.Frame(self)
+        self.chat_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=5)
+        
+        self.chat_frame.columnconfigure(0, weight=1)
+        self.chat_frame.rowconfigure(0, weight=1)
+        
+        self.chat_display = scrolledtext.ScrolledText(self.chat_frame, wrap=tk.WORD, font=("Arial", 11))
+        self.chat_display.grid(row=0, column=0, sticky="nsew")
+        self.chat_display.config(state=tk.DISABLED)
+        
+        # Configure tags
+        self.chat_display.tag_configure("user", foreground="blue", font=("Arial", 11, "bold"))
+        self.chat_display.tag_configure("bot", foreground="green", font=("Arial", 11))
+        self.chat_display.tag_configure("system", foreground="gray", font=("Arial", 10, "italic"))
+        self.chat_display.tag_configure("command", foreground="purple", font=("Arial", 11, "italic"))
+        
+        # Input area
+        self.input_frame = ttk.Frame(self)
+        self.input_frame.grid(row=1, column=0, sticky="ew", padx=10, pady=10)
+        
+        self.input_frame.columnconfigure(0, weight=1)
+        self.input_frame.columnconfigure(1, weight=0)
+        
+        self.message_input = scrolledtext.ScrolledText(self.input_frame, wrap=tk.WORD, height=4, font=("Arial", 11))
+        self.message_input.grid(row=0, column=0, sticky="ew")
+        self.message_input.bind("<Shift-Return>", self.on_shift_enter)
+        self.message_input.bind("<Return>", self.on_enter)
+        
+        self.send_button = ttk.Button(self.input_frame, text="Send", command=self.send_message)
+        self.send_button.grid(row=0, column=1, padx=5)
+        
+        self.earlier_button = ttk.Button(self.input_frame, text="Earlier", command=self.load_earlier_history)
+        self.earlier_button.grid(row=0, column=2, padx=5)
+        
+        # Status bar
+        self.status_var = tk.StringVar()
+        self.status_var.set("Ready")
+        self.status_bar = ttk.Label(self, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        self.status_bar.grid(row=2, column=0, sticky="ew", padx=10, pady=5)
+        
+        # Queue depths, refreshed with each response check
+        self.queue_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.queue_var, anchor=tk.E, foreground="gray").grid(row=3, column=0, sticky="ew", padx=10)
+        
+        # Create the command window
+        self.create_command_window()
+        
+        # Set up running flag for the async loop
+        self.running = True
+        self.client = None
+        self.client_error = None
+        self.image_client = None
+        
+        # Image prompts wait briefly so prompts close together reach the image bot as one batch,
+        # and image confirmations waiting for the main chat are merged into one message
+        self.image_prompts = []
+        self.image_batch_pending = False
+        self.image_confirmations = []
+        self.image_confirmation_pending = False
+        
+        # Optional (host, port) or socket path of a headless server to use instead of Poe directly
+        self.server_address = server_address
+        
+        # Optional API object to use instead of the live Poe API (e.g. a replay)
+        self.api = api
+        
+        # Processing flags
+        self.is_processing = False
+        self.processing_lock = threading.Lock()
+        
+        # Long-lived shell for RUN commands when enabled in config
+        self.shell = create_shell()
+        
+        # Stored main event loop
+        self.main_loop = None
+        
+        # Conversation history persisted across restarts
+        self.history = get_store()
+        self.conversation_id = f"gui-{CHAT_CODE}"
+        self.oldest_history_id = None
+        if self.history:
+            self.history.record_conversation(self.conversation_id, CHAT_CODE)
+        
+        # Outputs of rerun commands are reviewed as diffs against their previous run
+        self.output_history = OutputHistory()
+        
+        # Likely follow-up commands are prefetched while a review is with the bot
+        self.speculator = Speculator(shell=self.shell, store=self.history) if SPECULATION_ENABLED else None
+        
+        # Bot traffic runs through prioritized lanes so user messages never wait behind reviews or images
+        self.scheduler = Scheduler()
+        self.stop_requested = False
+        
+        # Configure Git credentials in the background so the window is usable right away
+        threading.Thread(target=ensure_git_credentials, daemon=True).start()
+        
+        # Start the async loop in a separate thread
+        self.loop_thread = threading.Thread(target=self.run_async_loop)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        
+        # Command batches from replies run one at a time on a single worker thread
+        self.command_queue = BoundedQueue(COMMAND_QUEUE_SIZE, COALESCE, merge=merge_command_batches, name="command")
+        self.command_thread = threading.Thread(target=self.command_worker, daemon=True)
+        self.command_thread.start()
+        
+        # Check for new responses periodically
+        self.after(100, self.check_for_response)
+        
+        # Set focus to input box
+        self.message_input.focus_set()
+        
+        # Show the end of the stored conversation, then the start message
+        self.load_earlier_history()
+        self.add_message(f"Starting chat with {BOT_NAME}...", "system")
+    
+    def create_command_window(self):
+        """Create the command display window"""
+        global command_window
+        command_window = CommandDisplay(self)
+        command_window.withdraw()  # Hide initially
+    
+    def on_enter(self, event):
+        """Handle Enter key to send message"""
+        if not event.state & 0x1:  # Check if Shift key is not pressed
+            self.send_message()
+            return "break"  # Prevent default Enter behavior
+    
+    def on_shift_enter(self, event):
+        """Handle Shift+Enter to add newline"""
+        # Let default behavior happen
+        return
+    
+    def send_message(self):
+        """Send the current message"""
+        message = self.message_input.get(1.0, tk.END).strip()
+        if not message:
+            return
+        
+        # Keep the text in the input box if the message cannot be sent
+        if self.client_error is not None:
+            self.status_var.set(f"Not connected: {self.client_error}")
+            return
+        if self.main_loop is None or self.main_loop.is_closed():
+            self.status_var.set("Not connected yet, please try again")
+            return
+        
+        # Add user message to display
+        self.add_message(message, "user")
+        
+        # Clear input
+        self.message_input.delete(1.0, tk.END)
+        
+        # Schedule the message ahead of reviews and background work
+        self.scheduler.submit_threadsafe(self.main_loop, INTERACTIVE, lambda: self.send_to_bot(message, "user"),
+                                         key="main", name="user message")
+        print(f"Scheduled message: {message[:30]}...")
+        
+        # Update status
+        self.status_var.set("Sending message...")
+        self.send_button.config(state=tk.DISABLED)
+    
+    def add_message(self, message, sender):
+        """Add a message to the chat display"""
+        with span("ui.render", widget="chat", sender=sender, chars=len(message)):
+            self.chat_display.config(state=tk.NORMAL)
+            
+            # Add sender label
+            if sender == "user":
+                self.chat_display.insert(tk.END, "\n\nYou: ", "user")
+            elif sender == "bot":
+                self.chat_display.insert(tk.END, f"\n\n{BOT_NAME}: ", "bot")
+            elif sender == "system":
+                self.chat_display.insert(tk.END, f"\n[SYSTEM] ", "system")
+            elif sender == "command":
+                self.chat_display.insert(tk.END, f"\n[COMMAND] ", "command")
+            
+            # Add message
+            self.chat_display.insert(tk.END, message)
+            
+            # Scroll to bottom
+            self.chat_display.see(tk.END)
+            self.chat_display.config(state=tk.DISABLED)
+    
+    def load_earlier_history(self):
+        """Insert the previous page of stored messages at the top of the chat display"""
+        if not self.history:
+            self.earlier_button.config(state=tk.DISABLED)
+            return
+        # Reads use their own connection, so wait for queued writes to be committed
+        self.history.flush()
+        rows = self.history.get_messages(self.conversation_id, self.oldest_history_id)
+        if len(rows) < HISTORY_PAGE_SIZE:
+            self.earlier_button.config(state=tk.DISABLED)
+        if not rows:
+            return
+        self.oldest_history_id = rows[0]["id"]
+        labels = {"user": ("\n\nYou: ", "user"), "bot": (f"\n\n{BOT_NAME}: ", "bot"),
+                  "review": ("\n[COMMAND] ", "command")}
+        with span("ui.render", widget="chat", sender="history", chars=sum(len(r["text"]) for r in rows)):
+            self.chat_display.config(state=tk.NORMAL)
+            # Insert bottom-up at the start so the page keeps its order
+            for row in reversed(rows):
+                label, tag = labels.get(row["role"], ("\n[SYSTEM] ", "system"))
+                self.chat_display.insert("1.0", row["text"])
+                self.chat_display.insert("1.0", label, tag)
+            self.chat_display.config(state=tk.DISABLED)
+    
+    def check_for_response(self):
+        """Check if there's a new response to display"""
+        try:
+            # Try to get response without blocking
+            response = None
+            try:
+                response = response_queue.get_nowait()
+                print(f"Got response from queue: {response[:30] if response else 'None'}...")
+            except queue.Empty:
+                pass
+            
+            if response:
+                # Add bot response to chat
+                print("Adding bot response to chat display")
+                self.add_message(response, "bot")
+                
+                # Check for commands in the response
+                commands = extract_commands(response)
+                if commands:
+                    print(f"Found {len(commands)} commands in response")
+                    # Queue the commands for the worker without waiting for user input
+                    with self.processing_lock:
+                        self.is_processing = True
+                    self.status_var.set(f"Found {len(commands)} commands. Processing...")
+                    self.command_queue.put((commands, response))
+                else:
+                    # Update status and re-enable send button only if not processing commands
+                    if not self.is_processing:
+                        self.status_var.set("Ready")
+                        self.send_button.config(state=tk.NORMAL)
+                        print("UI updated, ready for next message")
+            
+        except Exception as e:
+            print(f"Error checking for response: {e}")
+            import traceback
+            traceback.print_exc()
+            self.status_var.set(f"Error: {str(e)}")
+            with self.processing_lock:
+                self.is_processing = False
+            self.send_button.config(state=tk.NORMAL)
+        
+        self.queue_var.set(self.format_queue_stats())
+        
+        # Schedule next check
+        if self.running:
+            self.after(100, self.check_for_response)
+    
+    def get_queue_stats(self):
+        """Return depth and counters of the response and command queues and the scheduler lanes"""
+        return {
+            "response": response_queue.get_stats(),
+            "command": self.command_queue.get_stats(),
+            "scheduler": self.scheduler.get_stats(),
+        }
+    
+    def format_queue_stats(self):
+        """One-line summary of queue depths for the window"""
+        lanes = self.scheduler.get_stats()
+        jobs = " ".join(f"{lane} {stats['queued']}+{stats['running']}" for lane, stats in lanes.items())
+        return (f"Replies {response_queue.qsize()}/{response_queue.maxsize} | "
+                f"Command batches {self.command_queue.qsize()}/{self.command_queue.maxsize} | Jobs {jobs}")
+    
+    def command_worker(self):
+        """Run queued command batches one at a time so a burst of replies cannot start a thread each"""
+        # This thread keeps its own event loop for the command coroutines
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            while self.running:
+                try:
+                    commands, original_response = self.command_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                with self.processing_lock:
+                    self.is_processing = True
+                self.after(0, lambda n=len(commands): self.add_message(f"Executing {n} commands...", "system"))
+                try:
+                    loop.run_until_complete(self.execute_commands(commands, original_response))
+                except Exception as e:
+                    print(f"Error in command_worker: {e}")
+                    import traceback
+                    traceback.print_exc()
+                    with self.processing_lock:
+                        self.is_processing = False
+                    self.after(0, lambda e=e: self.status_var.set(f"Error executing commands: {str(e)}"))
+                    self.after(0, lambda: self.send_button.config(state=tk.NORMAL))
+        finally:
+            loop.close()
+    
+    async def execute_commands(self, commands, original_response):
+        """Execute commands and process results"""
+        try:
+            # Take results prefetched during the last review, then execute the rest
+            prefetched = {}
+            if self.speculator:
+                prefetched = await asyncio.to_thread(self.speculator.claim, commands)
+            for index, result in prefetched.items():
+                self.after(0, lambda c=result.command: self.add_message(f"Executing: {c} (prefetched)", "command"))
+                self.after(0, lambda r=result: display_command_result(r, show_command=True))
+            remaining = [cmd for index, cmd in enumerate(commands) if index not in prefetched]
+            if not remaining:
+                executed = []
+            elif get_profile().planner_enabled:
+                executed = await self.execute_planned_commands(remaining)
+            else:
+                executed = await self.execute_sequential_commands(remaining)
+            executed = iter(executed)
+            results = [prefetched[index] if index in prefetched else next(executed) for index in range(len(commands))]
+            
+            if self.speculator:
+                self.speculator.speculate(results)
+            
+            for result in results:
+                usage.record_session(self.conversation_id, result)
+            if self.history:
+                for result in results:
+                    self.history.record_command(self.conversation_id, result)
+            
+            # Build review message
+            parts = ["I executed the commands found in your response. Here are the results:\n\n"]
+            encoded = await asyncio.to_thread(self.output_history.encode_results, results)
+            for cmd, output in encoded:
+                write_command_output(parts.append, cmd, output)
+            review_message = "".join(parts)
+            
+            # Get a reference to the main event loop that has the client
+            sent_in_full = False
+            try:
+                # Send results to bot in the review lane
+                print("Scheduling command results to send to bot")
+                review = self.scheduler.submit_threadsafe(self.main_loop, REVIEW,
+                                                          lambda: self.send_to_bot(review_message, "review"),
+                                                          key="main", name="command review")
+                
+                # Wait for the reply so at most one review is in flight; its commands are queued like any other
+                sent_in_full = await asyncio.wrap_future(review)
+                
+            except asyncio.CancelledError:
+                print("Command review was cancelled")
+            except Exception as e:
+                print(f"Error sending command results to bot: {e}")
+                import traceback
+                traceback.print_exc()
+                self.after(0, lambda: self.add_message(f"Error sending command results to bot: {str(e)}", "system"))
+            finally:
+                # Diff the next run against these outputs only if the bot saw all of them
+                self.output_history.commit(sent_in_full)
+            
+        except Exception as e:
+            print(f"Error executing commands: {e}")
+            import traceback
+            traceback.print_exc()
+            # Notify user of error
+            self.after(0, lambda: self.add_message(f"Error executing commands: {str(e)}", "system"))
+        finally:
+            # Reset processing state
+            with self.processing_lock:
+                self.is_processing = False
+            self.after(0, lambda: self.status_var.set("Ready"))
+            self.after(0, lambda: self.send_button.config(state=tk.NORMAL))
+    
+    async def execute_sequential_commands(self, commands):
+        """Run commands one after another, writing file runs in one batch"""
+        results = []
+        for is_file_batch, batch in group_file_ops(commands):
+            self.after(0, lambda i=len(results)+1, total=len(commands): 
+                       self.status_var.set(f"Executing command {i}/{total}..."))
+            
+            # Add commands to chat display
+            for cmd in batch:
+                self.after(0, lambda c=cmd: self.add_message(f"Executing: {c}", "command"))
+            
+            # Execute the commands using our command_executor, writing file runs in one batch
+            if is_file_batch and len(batch) > 1:
+                results.extend(await execute_system_file_batch(batch))
+            else:
+                results.append(await execute_system_command(batch[0], shell=self.shell))
+        return results
+    
+    async def execute_planned_commands(self, commands):
+        """Run commands through the planner, in parallel where safe, showing each result as it finishes"""
+        for cmd in commands:
+            self.after(0, lambda c=cmd: self.add_message(f"Executing: {c}", "command"))
+        
+        finished = []
+        def on_result(cmd, result):
+            finished.append(cmd)
+            self.after(0, lambda i=len(finished), total=len(commands):
+                       self.status_var.set(f"Finished command {i}/{total}..."))
+            self.after(0, lambda r=result: display_command_result(r, show_command=True))
+        
+        pairs = await asyncio.to_thread(run_plan, commands, None, self.shell, None, on_result)
+        return [result for _, result in pairs]
+    
+    def run_async_loop(self):
+        """Run the asyncio event loop in a separate thread"""
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        loop = asyncio.get_event_loop()
+        self.main_loop = loop
+        try:
+            print("Starting async loop...")
+            loop.run_until_complete(self.async_main())
+            print("Async loop completed normally")
+        except Exception as e:
+            print(f"Error in async loop: {e}")
+            import traceback
+            traceback.print_exc()
+            # Update status in GUI thread
+            self.after(0, lambda: self.status_var.set(f"Error: {str(e)}"))
+        finally:
+            loop.close()
+            print("Async loop closed")
+    
+    async def async_main(self):
+        """Main async function that handles the bot conversation"""
+        # Initialize clients
+        print(f"Initializing connection to {BOT_NAME}...")
+        try:
+            if self.server_address:
+                # Only needed when attaching to a headless server
+                from server import AgentClient
+            if isinstance(self.server_address, tuple):
+                self.client = await AgentClient(*self.server_address).initialize()
+            elif self.server_address:
+                self.client = await AgentClient(socket_path=self.server_address).initialize()
+            else:
+                self.client = await PoeClientWrapper(
+                    tokens=POE_TOKENS,
+                    bot_name=BOT_NAME,
+                    chat_code=CHAT_CODE,
+                    api=self.api
+                ).initialize()
+            
+            # Update status in GUI thread
+            self.after(0, lambda: self.status_var.set("Connected"))
+            print("Bot client initialized successfully")
+            
+        except Exception as e:
+            error_msg = f"Failed to initialize Poe client: {e}"
+            print(error_msg)
+            self.client_error = e
+            # Update status in GUI thread
+            self.after(0, lambda: self.status_var.set(error_msg))
+        
+        # Jobs are run by the scheduler (and fail in wait_for_client if the connection failed);
+        # wait here until the window closes or 'exit' is sent
+        while self.running and not self.stop_requested:
+            await asyncio.sleep(0.1)
+        await self.scheduler.close()
+        if self.speculator:
+            await asyncio.to_thread(self.speculator.close)
+    
+    async def wait_for_client(self):
+        """Wait until the bot client has connected; raises if it failed or takes too long"""
+        deadline = time.monotonic() + CLIENT_CONNECT_TIMEOUT
+        while self.client is None:
+            if not self.running:
+                raise RuntimeError("Chat window closed")
+            if self.client_error is not None:
+                raise RuntimeError(f"Could not connect to the bot: {self.client_error}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Bot client did not connect within {CLIENT_CONNECT_TIMEOUT} s")
+            await asyncio.sleep(0.1)
+    
+    def schedule(self, lane, factory, **kwargs):
+        """Submit a job from the event loop without waiting for it, logging failures"""
+        def log_failure(future):
+            if not future.cancelled() and future.exception():
+                print(f"Error in {kwargs.get('name', lane)} job: {future.exception()}")
+        future = self.scheduler.submit(lane, factory, **kwargs)
+        future.add_done_callback(log_failure)
+        return future
+    
+    async def queue_response(self, text):
+        """Queue a reply for display, waiting while the window is behind"""
+        while self.running:
+            try:
+                await asyncio.to_thread(response_queue.put, text, 1.0)
+                return
+            except queue.Full:
+                continue
+    
+    async def send_to_bot(self, message, role="user"):
+        """Send a user message or command review to the main bot and queue the reply for display.
+        
+        Returns True if the bot got the message without the budgeter trimming it.
+        """
+        try:
+            await self.wait_for_client()
+        except RuntimeError as e:
+            await self.queue_response(f"Error communicating with bot: {e}")
+            return False
+        print(f"Got message to send: {message[:30]}...")
+        
+        if message.lower() == 'exit':
+            print("Exit command received")
+            self.stop_requested = True
+            return False
+        
+        # Send message to bot
+        print(f"Sending message to bot: {message[:30]}...")
+        try:
+            if self.history:
+                self.history.record_message(self.conversation_id, role, message)
+            if WORKSPACE_SNAPSHOT:
+                message = await asyncio.to_thread(with_snapshot, message)
+            start = time.perf_counter()
+            # Checked here rather than on the client, which other lanes may be sending through
+            sent_in_full = self.client.budgeter.fits(message)
+            response = await self.client.send_message(message, use_chat_code=True)
+            print(f"Received response from bot: {response[:30]}...")
+            if self.history:
+                self.history.record_message(self.conversation_id, "bot", response,
+                                            round((time.perf_counter() - start) * 1000, 1))
+            
+            # Add response to queue to be displayed
+            await self.queue_response(response)
+            print("Added response to queue")
+            
+            # Generate images in the background lane so the next message is not held up
+            image_prompts = extract_image_prompt(response)
+            if image_prompts:
+                self.process_image_prompts(image_prompts)
+            return sent_in_full
+            
+        except Exception as e:
+            print(f"Error sending message to bot: {e}")
+            import traceback
+            traceback.print_exc()
+            await self.queue_response(f"Error communicating with bot: {str(e)}")
+            return False
+    
+    async def get_image_client(self):
+        """Connect to the image generation bot on first use"""
+        if self.image_client is None:
+            print("Initializing connection to image generation bot...")
+            self.image_client = await PoeClientWrapper(
+                tokens=POE_TOKENS,
+                bot_name=IMAGE_BOT_NAME,
+                chat_code=IMAGE_BOT_CHAT_CODE,
+                api=self.api
+            ).initialize()
+        return self.image_client
+    
+    def process_image_prompts(self, image_prompts):
+        """Queue prompts for the image bot; prompts arriving within IMAGE_BATCH_WINDOW go out together"""
+        self.image_prompts.extend(image_prompts)
+        if not self.image_batch_pending:
+            self.image_batch_pending = True
+            asyncio.get_running_loop().call_later(IMAGE_BATCH_WINDOW, self.schedule_image_batch)
+    
+    def schedule_image_batch(self):
+        """Run the waiting image prompts as a preemptible background job"""
+        self.image_batch_pending = False
+        self.schedule(BACKGROUND, self.generate_images, key="image", name="image generation")
+    
+    async def generate_images(self):
+        """Send waiting prompts to the image bot and tell the main bot about the results in one message"""
+        prompts = self.image_prompts[:IMAGE_BATCH_MAX_PROMPTS]
+        del self.image_prompts[:IMAGE_BATCH_MAX_PROMPTS]
+        if self.image_prompts:
+            self.schedule_image_batch()
+        if not prompts:
+            return
+        try:
+            image_client = await self.get_image_client()
+            self.after(0, lambda n=len(prompts): self.status_var.set(f"Generating {n} image(s)..."))
+            for prompt in prompts:
+                self.after(0, lambda p=prompt: self.add_message(f"Generating image for prompt: {p}", "system"))
+            
+            # One request per batch when the image bot answers numbered prompts, else one per prompt
+            groups = [prompts] if IMAGE_BOT_BATCHING else [[prompt] for prompt in prompts]
+            outcomes = []
+            for group in groups:
+                try:
+                    if len(group) > 1:
+                        print(f"Sending {len(group)} image prompts to the image bot in one message")
+                    image_response = await image_client.send_message(build_image_batch_prompt(group), use_chat_code=True)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Error generating image: {e}")
+                    await self.queue_response(f"Failed to generate image: {str(e)}")
+                    continue
+                image_urls = extract_image_urls(image_response)
+                if image_urls:
+                    # Open images in browser
+                    import webbrowser
+                    for url in image_urls:
+                        webbrowser.open(url)
+                outcomes.append((group, image_response, image_urls))
+            
+            generated = sum(len(group) for group, _, urls in outcomes if urls)
+            if generated:
+                await self.queue_response(f"I've generated {generated} image(s) based on your prompts. "
+                                          f"They should open in your browser.")
+            if generated < sum(len(group) for group, _, _ in outcomes):
+                await self.queue_response("I tried to generate an image but couldn't get a valid result.")
+            if outcomes:
+                self.queue_image_confirmation(outcomes)
+        except asyncio.CancelledError:
+            # Preempted: the prompts go back to the front so the restarted job picks them up
+            self.image_prompts[:0] = prompts
+            raise
+        except Exception as e:
+            print(f"Error in generate_images: {e}")
+            import traceback
+            traceback.print_exc()
+    
+    def queue_image_confirmation(self, outcomes):
+        """Tell the main bot about generated images once the main chat is free, merged into one message"""
+        self.image_confirmations.extend(outcomes)
+        if not self.image_confirmation_pending:
+            self.image_confirmation_pending = True
+            self.schedule(BACKGROUND, self.send_image_confirmation, key="main",
+                          preemptible=False, name="image confirmation")
+    
+    async def send_image_confirmation(self):
+        """Send every image outcome gathered while waiting for the main chat"""
+        outcomes, self.image_confirmations = self.image_confirmations, []
+        self.image_confirmation_pending = False
+        if outcomes:
+            await self.client.send_message(build_image_confirmation(outcomes))
+
+def display_command_result(result, show_command=False):
+    """Show a CommandResult in the command window."""
+    if not command_window:
+        return
+    try:
+        if show_command:
+            command_window.display_command(result.command)
+        if result.stdout:
+            command_window.display_output(f"STDOUT:\n{result.stdout}")
+        elif result.message and not result.stderr:
+            command_window.display_output(result.message)
+        if result.stderr:
+            command_window.display_output(f"STDERR:\n{result.stderr}", is_error=True)
+        command_window.display_result(result.exit_status)
+    except Exception as e:
+        print(f"Error displaying command output: {e}")
+
+async def execute_system_command(command, display=True, shell=None):
+    """Execute a command and return its CommandResult"""
+    global command_window
+    if display and command_window:
+        try:
+            command_window.display_command(command)
+        except Exception as e:
+            print(f"Error displaying command: {e}")
+    
+    try:
+        # Use our command_executor's execute_command function
+        result = execute_command(command, shell=shell)
+    except Exception as e:
+        print(f"Error executing command: {e}")
+        result = CommandResult.error(command, f"Error executing command: {str(e)}")
+    
+    # Display output if requested
+    if display:
+        display_command_result(result)
+    return result
+
+async def execute_system_file_batch(commands, display=True):
+    """Write a run of FILE:/DIR: commands in one batch and return their CommandResults"""
+    try:
+        outputs = execute_commands(commands)
+    except Exception as e:
+        print(f"Error executing file batch: {e}")
+        outputs = [(cmd, CommandResult.error(cmd, f"Error executing command: {str(e)}")) for cmd in commands]
+    
+    results = [result for _, result in outputs]
+    if display:
+        for result in results:
+            display_command_result(result, show_command=True)
+    return results
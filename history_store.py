@@ -0,0 +1,299 @@
+"""Persistent conversation history in SQLite.
+
+Messages, executed commands and their results are stored per conversation
+(a GUI chat or a server session) in a WAL-mode database with full-text
+indexes. Writes are queued and committed in batches by a background thread,
+so recording never waits on the disk. Reads use their own connections and
+page by id, newest first.
+
+    python history_store.py list
+    python history_store.py search "ModuleNotFoundError" [--conversation ID]
+    python history_store.py show ID [--before MESSAGE_ID]
+"""
+import argparse
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from config import HISTORY_ENABLED, HISTORY_DB_PATH, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL
+from config import HISTORY_PAGE_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    chat_code TEXT,
+    working_dir TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation TEXT NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    time REAL NOT NULL,
+    duration_ms REAL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation, id);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    conversation TEXT NOT NULL,
+    command TEXT NOT NULL,
+    returncode INTEGER,
+    message TEXT,
+    stdout TEXT,
+    stderr TEXT,
+    time REAL NOT NULL,
+    duration_ms REAL,
+    stdout_bytes INTEGER,
+    stderr_bytes INTEGER,
+    truncated INTEGER
+);
+CREATE INDEX IF NOT EXISTS commands_by_conversation ON commands (conversation, id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS commands_fts USING fts5(command, stdout, stderr, content='commands', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS commands_fts_insert AFTER INSERT ON commands BEGIN
+    INSERT INTO commands_fts (rowid, command, stdout, stderr) VALUES (new.id, new.command, new.stdout, new.stderr);
+END;
+"""
+
+def _fts_query(text):
+    """Quote each word so user input is never parsed as FTS syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+class HistoryStore:
+    """Conversation history in a SQLite database with batched background writes."""
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search falls back to LIKE
+            self.fts = False
+        connection.commit()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # Writes
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + HISTORY_FLUSH_INTERVAL
+            while len(batch) < HISTORY_BATCH_SIZE:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # Stop after this batch
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            try:
+                with connection:
+                    for sql, params in batch:
+                        connection.execute(sql, params)
+            except Exception as e:
+                print(f"Error writing history: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _enqueue(self, sql, params):
+        self._queue.put((sql, params))
+
+    def record_conversation(self, conversation, chat_code=None, working_dir=None):
+        """Create or touch a conversation."""
+        now = time.time()
+        self._enqueue(
+            "INSERT INTO conversations (id, chat_code, working_dir, created, updated) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET updated = excluded.updated, "
+            "chat_code = COALESCE(excluded.chat_code, chat_code), "
+            "working_dir = COALESCE(excluded.working_dir, working_dir)",
+            (conversation, chat_code, working_dir, now, now),
+        )
+
+    def record_message(self, conversation, role, text, duration_ms=None, timestamp=None):
+        """Queue a message for storage."""
+        self._enqueue(
+            "INSERT INTO messages (conversation, role, text, time, duration_ms) VALUES (?, ?, ?, ?, ?)",
+            (conversation, role, text or "", timestamp or time.time(), duration_ms),
+        )
+
+    def record_command(self, conversation, result):
+        """Queue a CommandResult for storage."""
+        self._enqueue(
+            "INSERT INTO commands (conversation, command, returncode, message, stdout, stderr, time, "
+            "duration_ms, stdout_bytes, stderr_bytes, truncated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (conversation, result.command, result.returncode, result.message, result.stdout, result.stderr,
+             result.started, result.duration_ms, result.stdout_bytes, result.stderr_bytes, int(result.truncated)),
+        )
+
+    def flush(self):
+        """Wait until every queued write is committed."""
+        self._queue.join()
+
+    def close(self):
+        """Commit pending writes and stop the writer."""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    # Reads
+
+    def _rows(self, sql, params=()):
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def get_conversation(self, conversation):
+        """Return a conversation's chat code and working directory, or None."""
+        rows = self._rows("SELECT * FROM conversations WHERE id = ?", (conversation,))
+        return rows[0] if rows else None
+
+    def list_conversations(self, limit=HISTORY_PAGE_SIZE, before=None):
+        """Return conversations, most recently active first; page with before=<updated time>."""
+        if before is None:
+            return self._rows("SELECT * FROM conversations ORDER BY updated DESC LIMIT ?", (limit,))
+        return self._rows("SELECT * FROM conversations WHERE updated < ? ORDER BY updated DESC LIMIT ?",
+                          (before, limit))
+
+    def get_messages(self, conversation, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """Return up to limit messages older than before_id, oldest first."""
+        if before_id is None:
+            rows = self._rows("SELECT * FROM messages WHERE conversation = ? ORDER BY id DESC LIMIT ?",
+                              (conversation, limit))
+        else:
+            rows = self._rows("SELECT * FROM messages WHERE conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                              (conversation, before_id, limit))
+        rows.reverse()
+        return rows
+
+    def get_commands(self, conversation, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """Return up to limit command results older than before_id, oldest first."""
+        if before_id is None:
+            rows = self._rows("SELECT * FROM commands WHERE conversation = ? ORDER BY id DESC LIMIT ?",
+                              (conversation, limit))
+        else:
+            rows = self._rows("SELECT * FROM commands WHERE conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                              (conversation, before_id, limit))
+        rows.reverse()
+        return rows
+
+    def get_recent_commands(self, limit=HISTORY_PAGE_SIZE):
+        """Return the command, time and duration of the latest commands across conversations, oldest first."""
+        rows = self._rows("SELECT id, conversation, command, time, duration_ms FROM commands ORDER BY id DESC LIMIT ?",
+                          (limit,))
+        rows.reverse()
+        return rows
+
+    def search(self, text, conversation=None, limit=HISTORY_PAGE_SIZE, offset=0):
+        """Search messages and commands; returns {"messages": [...], "commands": [...]} best matches first."""
+        if not text.strip():
+            return {"messages": [], "commands": []}
+        where, params = "", []
+        if conversation:
+            where, params = " AND m.conversation = ?", [conversation]
+        if self.fts:
+            query = _fts_query(text)
+            messages = self._rows(
+                "SELECT m.id, m.conversation, m.role, m.time, "
+                "snippet(messages_fts, 0, '[', ']', '...', 16) AS snippet "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                f"WHERE messages_fts MATCH ?{where} ORDER BY bm25(messages_fts) LIMIT ? OFFSET ?",
+                [query] + params + [limit, offset])
+            commands = self._rows(
+                "SELECT m.id, m.conversation, m.command, m.returncode, m.time, "
+                "snippet(commands_fts, -1, '[', ']', '...', 16) AS snippet "
+                "FROM commands_fts JOIN commands m ON m.id = commands_fts.rowid "
+                f"WHERE commands_fts MATCH ?{where} ORDER BY bm25(commands_fts) LIMIT ? OFFSET ?",
+                [query] + params + [limit, offset])
+        else:
+            pattern = f"%{text}%"
+            messages = self._rows(
+                "SELECT m.id, m.conversation, m.role, m.time, substr(m.text, 1, 200) AS snippet "
+                f"FROM messages m WHERE m.text LIKE ?{where} ORDER BY m.id DESC LIMIT ? OFFSET ?",
+                [pattern] + params + [limit, offset])
+            commands = self._rows(
+                "SELECT m.id, m.conversation, m.command, m.returncode, m.time, substr(m.stdout, 1, 200) AS snippet "
+                f"FROM commands m WHERE (m.command LIKE ? OR m.stdout LIKE ? OR m.stderr LIKE ?){where} "
+                "ORDER BY m.id DESC LIMIT ? OFFSET ?",
+                [pattern] * 3 + params + [limit, offset])
+        return {"messages": messages, "commands": commands}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the shared history store, or None if history is disabled."""
+    global _store
+    if not HISTORY_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore()
+            atexit.register(_store.close)
+        return _store
+
+def main():
+    parser = argparse.ArgumentParser(description="Browse and search the conversation history")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("list", help="List conversations")
+    search = sub.add_parser("search", help="Full-text search over messages and command outputs")
+    search.add_argument("query")
+    search.add_argument("--conversation")
+    search.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE)
+    show = sub.add_parser("show", help="Show a page of a conversation")
+    show.add_argument("conversation")
+    show.add_argument("--before", type=int, help="Show messages older than this message id")
+    show.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE)
+    args = parser.parse_args()
+
+    store = HistoryStore()
+    if args.action == "list":
+        for row in store.list_conversations():
+            print(f"{row['id']}\t{time.ctime(row['updated'])}\t{row['chat_code'] or ''}\t{row['working_dir'] or ''}")
+    elif args.action == "search":
+        results = store.search(args.query, args.conversation, args.limit)
+        for row in results["messages"]:
+            print(f"[message {row['id']}] {row['conversation']} {row['role']}: {row['snippet']}")
+        for row in results["commands"]:
+            print(f"[command {row['id']}] {row['conversation']} {row['command'][:60]}: {row['snippet']}")
+    else:
+        for row in store.get_messages(args.conversation, args.before, args.limit):
+            print(f"--- {row['id']} {row['role']} {time.ctime(row['time'])}\n{row['text']}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Load generator: many concurrent synthetic sessions against the fake backend.
+
+Usage:
+    python loadgen.py --sessions 50 --rate 10 --messages 5 --mix chat=0.5,commands=0.4,image=0.1
+
+Sessions arrive as a Poisson process at --rate per second. Each one sends
+--messages messages through SessionManager; replies are drawn from --mix, and
+any commands in a reply are run and sent back for review like the GUI does.
+Reports throughput, p50/p95/p99 latency per stage and CPU/memory usage.
+Each stage's CPU is the process CPU spent while it ran; stages of concurrent
+sessions overlap, so these are exact only for one session at a time. The
+commands stage also sums its subprocesses' own CPU from their rusage.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+from bench_pipeline import percentile
+from context_budget import ContextBudgeter
+from fake_poe import FakeAsyncPoeApi
+from poe_client import PoeClientWrapper
+from session_manager import SessionManager
+from command_result import RSS_DIVISOR
+from utils import extract_commands
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def parse_mix(text):
+    """Parse 'chat=0.5,commands=0.4' into normalized weights."""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"chat", "commands", "image"}
+    if unknown:
+        raise ValueError(f"Unknown message kinds in mix: {', '.join(sorted(unknown))}")
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+def make_script(mix, commands_per_reply, seed):
+    """Return a fake-backend script that draws replies from the mix."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+
+    def script(bot_name, message):
+        if message.startswith("I've executed the commands"):
+            return "Thanks, that looks right."
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "commands":
+            lines = [f"[[RUN: echo step {i}]]" if i % 2 else f"[[DIR: work/step_{i}]]"
+                     for i in range(commands_per_reply)]
+            return "Running the next steps.\n\n" + "\n".join(lines)
+        if kind == "image":
+            return "Here you go.\n\nGenerate an image of: a lighthouse at dusk"
+        return "Sure, here is an explanation without any commands. " * 4
+
+    return script
+
+class StageStats:
+    """Collects latency samples per pipeline stage."""
+
+    def __init__(self):
+        self.samples = {}
+        self.cpu = {}
+        self.errors = 0
+
+    def add(self, stage, seconds, cpu=None):
+        """Add a latency sample and the (user, system, subprocess) CPU seconds spent in it."""
+        self.samples.setdefault(stage, []).append(seconds * 1000)
+        if cpu is not None:
+            totals = self.cpu.setdefault(stage, [0.0, 0.0, 0.0])
+            for i, value in enumerate(cpu):
+                totals[i] += value
+
+    def report(self, wall_seconds):
+        report = {}
+        for stage, values in self.samples.items():
+            report[stage] = {
+                "count": len(values),
+                "throughput_per_s": round(len(values) / wall_seconds, 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(max(values), 2),
+            }
+            if stage in self.cpu:
+                user, system, subprocess_cpu = self.cpu[stage]
+                report[stage].update(user_cpu_s=round(user, 3), sys_cpu_s=round(system, 3),
+                                     subprocess_cpu_s=round(subprocess_cpu, 3))
+        return report
+
+class StageTimer:
+    """Measures a stage's wall time and process CPU from creation until stop()."""
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.start = time.perf_counter()
+        self.times = os.times()
+
+    def stop(self, subprocess_cpu=0.0):
+        times = os.times()
+        self.stats.add(self.stage, time.perf_counter() - self.start,
+                       (times.user - self.times.user, times.system - self.times.system, subprocess_cpu))
+
+def results_cpu(results):
+    """Sum the user and system CPU seconds of CommandResults whose rusage is known."""
+    return sum(((r.cpu_user_ms or 0) + (r.cpu_sys_ms or 0)) / 1000 for r in results)
+
+async def run_session(manager, stats, index, messages, workdir):
+    """Drive one synthetic session through its messages."""
+    session = manager.create_session(
+        chat_code=f"load-{index}",
+        working_dir=os.path.join(workdir, f"session_{index}")
+    )
+    try:
+        for i in range(messages):
+            round_timer = StageTimer(stats, "round_trip")
+            timer = StageTimer(stats, "bot")
+            reply = await manager.send_message(session.id, f"Message {i} from session {index}")
+            timer.stop()
+
+            commands = extract_commands(reply)
+            subprocess_cpu = 0.0
+            if commands:
+                timer = StageTimer(stats, "commands")
+                outcome = await manager.run_commands(session.id, commands)
+                subprocess_cpu = results_cpu(outcome["results"].values())
+                timer.stop(subprocess_cpu)
+
+                timer = StageTimer(stats, "review")
+                await manager.send_message(session.id, f"I've executed the commands: {len(outcome['results'])} results")
+                timer.stop()
+            round_timer.stop(subprocess_cpu)
+    except Exception as e:
+        stats.errors += 1
+        print(f"Session {index} failed: {e}")
+    finally:
+        await manager.close_session(session.id)
+
+def peak_rss_kb():
+    """Peak RSS of this process in KB, or None where resource is unavailable."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // RSS_DIVISOR
+async def run_load(args):
+    mix = parse_mix(args.mix)
+    api = FakeAsyncPoeApi(
+        script=make_script(mix, args.commands_per_reply, args.seed),
+        first_chunk_delay=args.latency,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    budgeter = ContextBudgeter()
+    clients = [
+        await PoeClientWrapper({}, "load-bot", None, budgeter=budgeter, api=api).initialize()
+        for _ in range(args.pool_size)
+    ]
+    manager = SessionManager(clients, max_workers=args.workers)
+    stats = StageStats()
+    workdir = tempfile.mkdtemp(prefix="lililia_load_")
+    rng = random.Random(args.seed)
+
+    before = os.times()
+    start = time.perf_counter()
+    tasks = []
+    for index in range(args.sessions):
+        tasks.append(asyncio.create_task(run_session(manager, stats, index, args.messages, workdir)))
+        if args.rate > 0:
+            await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - start
+    after = os.times()
+    await manager.close()
+
+    return {
+        "config": {
+            "sessions": args.sessions,
+            "rate_per_s": args.rate,
+            "messages_per_session": args.messages,
+            "mix": mix,
+            "pool_size": args.pool_size,
+            "workers": args.workers,
+        },
+        "wall_seconds": round(wall, 3),
+        "stages": stats.report(wall),
+        "failed_sessions": stats.errors,
+        "resources": {
+            # The bot and review stages run in this process; command subprocesses are children
+            "process_user_cpu_s": round(after.user - before.user, 3),
+            "process_sys_cpu_s": round(after.system - before.system, 3),
+            "subprocess_user_cpu_s": round(after.children_user - before.children_user, 3),
+            "subprocess_sys_cpu_s": round(after.children_system - before.children_system, 3),
+            "peak_rss_kb": peak_rss_kb(),
+        },
+        "tokens": budgeter.get_metrics(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent synthetic sessions against the fake backend")
+    parser.add_argument("--sessions", type=int, default=20, help="Synthetic sessions to start")
+    parser.add_argument("--rate", type=float, default=5.0, help="Session arrivals per second (0 = all at once)")
+    parser.add_argument("--messages", type=int, default=3, help="Messages per session")
+    parser.add_argument("--mix", default="chat=0.5,commands=0.4,image=0.1", help="Reply kind weights")
+    parser.add_argument("--commands-per-reply", type=int, default=4, help="Commands in a command reply")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake first-chunk delay in seconds")
+    parser.add_argument("--chunk-interval", type=float, default=0.005, help="Fake delay between chunks in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake requests that fail")
+    parser.add_argument("--pool-size", type=int, default=2, help="Shared bot connections")
+    parser.add_argument("--workers", type=int, default=4, help="Shared command executor threads")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline logging")
+    args = parser.parse_args()
+
+    if args.verbose:
+        report = asyncio.run(run_load(args))
+    else:
+        # Discard the logging rather than buffer it, which would inflate the peak RSS
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = asyncio.run(run_load(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Send only what changed when a command is run again.
+
+An OutputHistory remembers the last output of each command in one
+conversation. Encoding a new output returns the full text the first time,
+a one-line marker with its hash when it is unchanged, and a unified diff
+against the previous run when that is much shorter than the output itself.
+The bot has seen every earlier round, so it can rebuild the current output.
+Outputs longer than OUTPUT_DELTA_MAX_CHARS are hashed as they stream from
+their spill files and passed through as they are, never read into memory.
+Encoded outputs only become the "previous run" once commit() is called
+after their review was sent in full.
+"""
+import collections
+import difflib
+import hashlib
+import threading
+from config import OUTPUT_DELTA_ENABLED, OUTPUT_DELTA_MAX_CHARS
+from config import OUTPUT_DELTA_CONTEXT_LINES, OUTPUT_DELTA_MAX_RATIO
+from utils import write_output_body, output_size
+from tracing import span
+from settings import get_profile
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()[:12]
+
+def _stream_digest(output, full):
+    """Return the digest of output's formatted text, hashing it chunk by chunk."""
+    sha = hashlib.sha1()
+    last = ""
+
+    def write(chunk):
+        nonlocal last
+        if chunk:
+            sha.update(chunk.encode("utf-8", "replace"))
+            last = chunk
+
+    write_output_body(write, output, full)
+    if not last.endswith("\n"):
+        sha.update(b"\n")
+    return sha.hexdigest()[:12]
+
+class OutputHistory:
+    """Previous outputs of each command in one conversation, least recently run dropped first."""
+
+    def __init__(self, max_commands=None):
+        self.max_commands = max_commands or get_profile().output_delta_max_commands
+        self._outputs = collections.OrderedDict()  # command -> (digest, text or None if too long to diff)
+        self._pending = {}  # Encoded but not yet committed, same shape as _outputs
+        self._lock = threading.Lock()
+        self.stats = {"full": 0, "unchanged": 0, "diff": 0, "chars_in": 0, "chars_out": 0}
+
+    def encode(self, cmd, output, full=False):
+        """Return what to send for output: the output itself, an unchanged marker or a diff.
+
+        An output too long to diff is returned as it was given, so attachments
+        can stream it from its spill file.
+        """
+        size = output_size(output, full)
+        if size > OUTPUT_DELTA_MAX_CHARS:
+            text, digest = None, _stream_digest(output, full)
+        else:
+            parts = []
+            write_output_body(parts.append, output, full)
+            text = "".join(parts)
+            if not text.endswith("\n"):
+                text += "\n"  # Keeps the last line intact in diffs
+            digest, size = _digest(text), len(text)
+            if size > OUTPUT_DELTA_MAX_CHARS:
+                text = None
+        with self._lock:
+            # A command repeated in the same review is compared with its earlier output there
+            previous = self._pending.get(cmd) or self._outputs.get(cmd)
+            self._pending[cmd] = (digest, text)
+        encoded, kind = (output if text is None else text.rstrip("\n")), "full"
+        if previous is not None and previous[0] == digest:
+            encoded, kind = f"(unchanged since the previous run, sha1 {digest})", "unchanged"
+        elif previous is not None and previous[1] is not None and text is not None:
+            with span("delta.diff", chars=len(text)):
+                diff = "".join(difflib.unified_diff(
+                    previous[1].splitlines(keepends=True), text.splitlines(keepends=True),
+                    "previous", "current", n=OUTPUT_DELTA_CONTEXT_LINES))
+            if len(diff) <= len(text) * OUTPUT_DELTA_MAX_RATIO:
+                encoded = (f"(changed since the previous run, sha1 {previous[0]} -> {digest}; "
+                           f"unified diff against it)\n{diff.rstrip()}")
+                kind = "diff"
+        with self._lock:
+            self.stats[kind] += 1
+            self.stats["chars_in"] += size
+            self.stats["chars_out"] += size if encoded is output else len(encoded)
+        return encoded
+
+    def encode_all(self, command_outputs, full=False):
+        """Return {command: text or output} for a dict of outputs; unchanged if deltas are disabled."""
+        if not OUTPUT_DELTA_ENABLED:
+            return command_outputs
+        return {cmd: self.encode(cmd, output, full) for cmd, output in command_outputs.items()}
+
+    def encode_results(self, results, full=False):
+        """Return (command, text or result) pairs for a list of CommandResults, keeping repeated commands."""
+        if not OUTPUT_DELTA_ENABLED:
+            return [(result.command, result) for result in results]
+        return [(result.command, self.encode(result.command, result, full)) for result in results]
+
+    def commit(self, seen=True):
+        """Settle the outputs encoded since the last commit once their review was sent.
+
+        Pass seen=False when the send failed or the budgeter trimmed the
+        message: those commands are forgotten so their next output is sent in full.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for cmd, entry in pending.items():
+                self._outputs.pop(cmd, None)
+                if seen:
+                    self._outputs[cmd] = entry
+            while len(self._outputs) > self.max_commands:
+                self._outputs.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, commands=len(self._outputs))
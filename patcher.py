@@ -0,0 +1,276 @@
+"""Apply PATCH: commands to files without rewriting them through the bot.
+
+A PATCH command names a file on its first line and carries either a unified
+diff or search/replace blocks:
+
+    [[PATCH: src/app.py
+    @@ -10,3 +10,3 @@
+     def main():
+    -    run(debug=True)
+    +    run(debug=False)
+    ]]
+
+    [[PATCH: src/app.py
+    <<<<<<< SEARCH
+        run(debug=True)
+    =======
+        run(debug=False)
+    >>>>>>> REPLACE
+    ]]
+
+The target is memory-mapped, each hunk is located and its context verified,
+and the result is streamed to a temp file that atomically replaces the
+original, so large files are never loaded whole into memory.
+"""
+import mmap
+import os
+import re
+from config import CMD_PREFIX_PATCH, FILE_ENCODING, FSYNC_FILE_WRITES
+from file_ops import _write_temp, _fsync_dir
+from utils import expand_path
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+COPY_BLOCK = 1024 * 1024
+
+class PatchError(Exception):
+    """Raised when a patch cannot be applied; the message says which hunk and why."""
+
+class Hunk:
+    """One replacement: old text expected in the file and the new text for it."""
+
+    __slots__ = ("number", "old", "new", "line")
+
+    def __init__(self, number, old, new, line=None):
+        self.number = number
+        self.old = old
+        self.new = new
+        self.line = line  # 1-based line where old starts, if the patch says
+
+def parse_patch_command(cmd, cwd=None):
+    """Split a PATCH: command into (path, body)."""
+    text = cmd[len(CMD_PREFIX_PATCH):]
+    first_line, _, body = text.partition("\n")
+    path = first_line.strip()
+    if not path:
+        raise PatchError("PATCH command needs a file path on its first line")
+    return expand_path(path, cwd), body
+
+def parse_search_replace(body):
+    """Parse <<<<<<< SEARCH / ======= / >>>>>>> REPLACE blocks into hunks."""
+    hunks = []
+    state = None
+    old, new = [], []
+    for line in body.splitlines(keepends=True):
+        marker = line.rstrip("\r\n")
+        if marker == SEARCH_MARKER and state is None:
+            state, old, new = "search", [], []
+        elif marker == DIVIDER_MARKER and state == "search":
+            state = "replace"
+        elif marker == REPLACE_MARKER and state == "replace":
+            hunks.append(Hunk(len(hunks) + 1, "".join(old), "".join(new)))
+            state = None
+        elif state == "search":
+            old.append(line)
+        elif state == "replace":
+            new.append(line)
+    if state is not None:
+        raise PatchError(f"Search/replace block {len(hunks) + 1} is not terminated with {REPLACE_MARKER}")
+    return hunks
+
+def parse_unified_diff(body):
+    """Parse unified diff hunks; file headers (---/+++) are ignored.
+
+    The @@ line counts say how many lines a hunk still owes, so content lines
+    such as "-- comment" are only taken for headers once the hunk is complete.
+    """
+    hunks = []
+    current = None
+    for line in body.splitlines(keepends=True):
+        header = HUNK_HEADER.match(line)
+        if header:
+            current = {"line": int(header.group(1)), "count": header.group(2), "old": [], "new": [],
+                       "old_left": int(header.group(2) or 1), "new_left": int(header.group(4) or 1)}
+            hunks.append(current)
+            continue
+        if current is None:
+            continue
+        complete = current["old_left"] <= 0 and current["new_left"] <= 0
+        if complete and line.startswith(("--- ", "+++ ")):
+            continue
+        if line.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line
+            target = current.get("last")
+            if target and target[-1].endswith("\n"):
+                target[-1] = target[-1][:-1]
+            continue
+        if line in ("\n", "\r\n"):
+            # Context line whose leading space was lost
+            tag, text = " ", "\n"
+        else:
+            tag, text = line[:1], line[1:]
+        if not text.endswith("\n"):
+            text += "\n"
+        if tag == " ":
+            current["old"].append(text)
+            current["new"].append(text)
+            current["last"] = current["new"]
+            current["old_left"] -= 1
+            current["new_left"] -= 1
+        elif tag == "-":
+            current["old"].append(text)
+            current["last"] = current["old"]
+            current["old_left"] -= 1
+        elif tag == "+":
+            current["new"].append(text)
+            current["last"] = current["new"]
+            current["new_left"] -= 1
+
+    result = []
+    for number, hunk in enumerate(hunks, 1):
+        line = hunk["line"]
+        if hunk["count"] == "0":
+            line += 1  # Pure insertions are placed after the given line
+        result.append(Hunk(number, "".join(hunk["old"]), "".join(hunk["new"]), max(line, 1)))
+    return result
+
+def parse_patch(body):
+    """Return the hunks of a patch body in either supported format."""
+    if SEARCH_MARKER in body:
+        hunks = parse_search_replace(body)
+    else:
+        hunks = parse_unified_diff(body)
+    if not hunks:
+        raise PatchError("Patch contains no hunks")
+    return hunks
+
+def line_offset(mm, line):
+    """Return the byte offset where 1-based line starts, or None past the end."""
+    offset = 0
+    for _ in range(line - 1):
+        newline = mm.find(b"\n", offset)
+        if newline == -1:
+            return None
+        offset = newline + 1
+    return offset
+
+def _describe_mismatch(mm, offset, old, hunk):
+    """Explain where the expected text first differs from the file."""
+    expected_lines = old.split(b"\n")
+    line = hunk.line
+    for expected in expected_lines:
+        end = mm.find(b"\n", offset)
+        actual = mm[offset:end if end != -1 else len(mm)]
+        if actual.rstrip(b"\r") != expected.rstrip(b"\r"):
+            return (f"Hunk {hunk.number} failed at line {line}: expected "
+                    f"{expected.decode(FILE_ENCODING, 'replace')!r}, found "
+                    f"{actual.decode(FILE_ENCODING, 'replace')!r}")
+        if end == -1:
+            break
+        offset = end + 1
+        line += 1
+    return f"Hunk {hunk.number} failed at line {hunk.line}: context does not match"
+
+def locate(mm, hunk, old):
+    """Return the byte offset of hunk's old text in the file."""
+    if hunk.line is not None:
+        offset = line_offset(mm, hunk.line)
+        if offset is not None and mm[offset:offset + len(old)] == old:
+            return offset
+        if not old:
+            if offset is None:
+                raise PatchError(f"Hunk {hunk.number} inserts after line {hunk.line - 1}, past the end of the file")
+            return offset
+
+    if not old:
+        raise PatchError(f"Hunk {hunk.number} has no text to search for")
+
+    # Line numbers are off (or absent): fall back to a unique match of the text
+    first = mm.find(old)
+    if first == -1:
+        if hunk.line is not None and offset is not None:
+            raise PatchError(_describe_mismatch(mm, offset, old, hunk))
+        preview = old.decode(FILE_ENCODING, "replace").splitlines()[0]
+        raise PatchError(f"Hunk {hunk.number} failed: text not found (first line {preview!r})")
+    if mm.find(old, first + 1) != -1:
+        line = mm[:first].count(b"\n") + 1
+        raise PatchError(f"Hunk {hunk.number} is ambiguous: its text appears more than once (first at line {line})")
+    return first
+
+def apply_patch(path, body, encoding=FILE_ENCODING, fsync=FSYNC_FILE_WRITES):
+    """Apply a patch body to path; returns a summary string or raises PatchError."""
+    hunks = parse_patch(body)
+
+    if not os.path.exists(path):
+        if any(h.old for h in hunks):
+            raise PatchError(f"File not found: {path}")
+        # Patch against /dev/null: create the file from the added text
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.replace(_write_temp(path, "".join(h.new for h in hunks).encode(encoding), fsync), path)
+        return f"Created {path} from {len(hunks)} hunk(s)"
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            crlf = b"\r\n" in mm[:COPY_BLOCK]
+            edits = []
+            for hunk in hunks:
+                old, new = hunk.old, hunk.new
+                if crlf:
+                    old, new = old.replace("\n", "\r\n"), new.replace("\n", "\r\n")
+                old, new = old.encode(encoding), new.encode(encoding)
+                try:
+                    start = locate(mm, hunk, old)
+                except PatchError as error:
+                    # The block may sit at the end of a file without a final newline
+                    if not old.endswith(b"\n"):
+                        raise
+                    old = old[:-2] if old.endswith(b"\r\n") else old[:-1]
+                    if new.endswith(b"\n"):
+                        new = new[:-2] if new.endswith(b"\r\n") else new[:-1]
+                    try:
+                        start = locate(mm, hunk, old)
+                    except PatchError:
+                        raise error from None
+                    if start + len(old) != size:
+                        # The first attempt says best where the hunk went wrong
+                        raise error
+                edits.append((start, start + len(old), new, hunk))
+
+            edits.sort(key=lambda e: e[0])
+            for previous, following in zip(edits, edits[1:]):
+                if following[0] < previous[1]:
+                    raise PatchError(f"Hunks {previous[3].number} and {following[3].number} overlap")
+
+            # Stream unchanged ranges and replacements into a temp file
+            directory = os.path.dirname(path) or "."
+            temp_path = _write_temp(path, b"", False)
+            try:
+                with open(temp_path, "wb") as out:
+                    position = 0
+                    for start, end, new, _ in edits:
+                        for block in range(position, start, COPY_BLOCK):
+                            out.write(mm[block:min(block + COPY_BLOCK, start)])
+                        out.write(new)
+                        position = end
+                    for block in range(position, size, COPY_BLOCK):
+                        out.write(mm[block:min(block + COPY_BLOCK, size)])
+                    if fsync:
+                        out.flush()
+                        os.fsync(out.fileno())
+            except Exception:
+                os.unlink(temp_path)
+                raise
+        finally:
+            if size:
+                mm.close()
+
+    os.replace(temp_path, path)
+    if fsync:
+        _fsync_dir(directory)
+    return f"Applied {len(hunks)} hunk(s) to {path}"
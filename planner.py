@@ -0,0 +1,286 @@
+"""Run the commands of a reply in parallel where it is safe.
+
+Each command (or run of FILE:/DIR: commands, which are written as one batch)
+becomes a node with the paths it reads and writes. A node depends on every
+earlier node it conflicts with: one writes a path the other reads or writes
+(a directory conflicts with everything under it), both use the same git
+repository, or either has effects that cannot be known. Commands with
+unknown effects - arbitrary RUN: programs, INSTALL:, SHELL:, anything run in
+a persistent shell - are barriers that run alone, in their original order.
+So are commands whose kind is not in the profile's parallel_kinds.
+"""
+import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import CMD_PREFIX_FILE, CMD_PREFIX_DIR, CMD_PREFIX_RUN, CMD_PREFIX_GIT, CMD_PREFIX_PATCH
+from config import CMD_PREFIX_INSTALL, CMD_PREFIX_SHELL
+from config import CMD_PREFIX_TREE, CMD_PREFIX_GLOB, CMD_PREFIX_GREP, CMD_PREFIX_SUMMARY
+from command_executor import execute_commands
+from command_result import CommandResult
+from file_ops import group_file_ops, parse_file_command
+from utils import expand_path, command_kind
+from settings import get_profile
+from tracing import span
+
+# Programs that only read the paths they are given (or the working directory)
+READ_ONLY_PROGRAMS = {"ls", "cat", "head", "tail", "wc", "grep", "rg", "find", "stat", "du",
+                      "file", "tree", "diff", "md5sum", "sha256sum", "sort"}
+# Programs that touch no files at all
+NO_FILE_PROGRAMS = {"echo", "pwd", "whoami", "date", "printenv", "uname", "which", "true"}
+# Options that make an otherwise read-only program write files or run other programs
+UNSAFE_OPTIONS = {"tree": ("-o",), "rg": ("--pre",), "file": ("-C", "--compile"),
+                  "sort": ("-o", "--output", "--compress-program")}
+# Everything find accepts that neither writes files nor runs programs: tests, options,
+# operators and the actions that only print. Any other expression (-exec, -delete, -fprint...) is a barrier.
+FIND_SAFE_OPTIONS = {
+    "-H", "-L", "-P", "-D", "-O",
+    "-a", "-and", "-o", "-or", "-not", "-d", "-depth", "-maxdepth", "-mindepth", "-mount", "-xdev",
+    "-noleaf", "-ignore_readdir_race", "-noignore_readdir_race", "-regextype", "-warn", "-nowarn",
+    "-follow", "-daystart",
+    "-amin", "-anewer", "-atime", "-cmin", "-cnewer", "-ctime", "-empty", "-executable", "-false",
+    "-fstype", "-gid", "-group", "-ilname", "-iname", "-inum", "-ipath", "-iregex", "-iwholename",
+    "-links", "-lname", "-mmin", "-mtime", "-name", "-newer", "-nogroup", "-nouser", "-path", "-perm",
+    "-readable", "-regex", "-samefile", "-size", "-true", "-type", "-uid", "-used", "-user",
+    "-wholename", "-writable", "-xtype", "-context",
+    "-print", "-print0", "-printf", "-ls", "-prune", "-quit",
+}
+FIND_NEWER_PATTERN = re.compile(r"^-newer[aBcmt][aBcmt]$")
+# find expressions followed by an argument, which may itself start with '-' (-size -10k)
+FIND_ARG_OPTIONS = {
+    "-D", "-maxdepth", "-mindepth", "-regextype", "-amin", "-anewer", "-atime", "-cmin", "-cnewer",
+    "-ctime", "-fstype", "-gid", "-group", "-ilname", "-iname", "-inum", "-ipath", "-iregex",
+    "-iwholename", "-links", "-lname", "-mmin", "-mtime", "-name", "-newer", "-path", "-perm", "-regex",
+    "-samefile", "-size", "-type", "-uid", "-used", "-user", "-wholename", "-xtype", "-context", "-printf",
+}
+READ_ONLY_GIT = {"status", "log", "diff", "show", "ls-files", "rev-parse", "blame", "shortlog", "describe"}
+READ_ONLY_PIP = {"list", "show", "freeze", "check"}
+SHELL_OPERATORS = set("|&;<>$`%")  # Anything that could run through a shell is a barrier
+
+class Effects:
+    """Paths a command reads and writes, shared resources, and whether it is a barrier."""
+
+    __slots__ = ("reads", "writes", "resources", "barrier")
+
+    def __init__(self, reads=(), writes=(), resources=(), barrier=False):
+        self.reads = set(reads)
+        self.writes = set(writes)
+        self.resources = set(resources)
+        self.barrier = barrier
+
+    def update(self, other):
+        self.reads |= other.reads
+        self.writes |= other.writes
+        self.resources |= other.resources
+        self.barrier = self.barrier or other.barrier
+
+class PlanNode:
+    __slots__ = ("index", "commands", "effects", "deps")
+
+    def __init__(self, index, commands, effects):
+        self.index = index
+        self.commands = commands
+        self.effects = effects
+        self.deps = set()
+
+def _path(path, cwd):
+    return os.path.normpath(os.path.abspath(expand_path(path.strip() or ".", cwd or os.getcwd())))
+
+def _env_command(args):
+    """Return the command env runs (empty if it only prints), or None if its options are not understood."""
+    rest = list(args)
+    while rest:
+        if rest[0] in ("-i", "--ignore-environment", "-0", "--null", "-"):
+            rest.pop(0)
+        elif rest[0] in ("-u", "--unset") and len(rest) > 1:
+            del rest[:2]
+        elif rest[0].startswith("--unset="):
+            rest.pop(0)
+        elif rest[0].startswith("-"):
+            return None  # -C changes directory, -S splits a command string, ...
+        elif "=" in rest[0]:
+            rest.pop(0)
+        else:
+            break
+    return rest
+
+def _git_command(args, cwd):
+    """Return (subcommand args, directory) after git's -C and -c options, or None for other global options."""
+    rest = list(args)
+    while rest and rest[0].startswith("-"):
+        if rest[0] == "-C" and len(rest) > 1:
+            cwd = _path(rest[1], cwd)  # Each -C is relative to the previous one
+            del rest[:2]
+        elif rest[0] == "-c" and len(rest) > 1:
+            del rest[:2]
+        else:
+            return None  # --git-dir, --work-tree, ... point somewhere we do not track
+    return rest, cwd
+
+def _is_safe_find(rest):
+    """Return True if a find expression only tests and prints."""
+    args = iter(rest)
+    for arg in args:
+        if not arg.startswith("-") or arg == "-":
+            continue
+        if arg in FIND_ARG_OPTIONS or FIND_NEWER_PATTERN.match(arg):
+            next(args, None)
+        elif arg not in FIND_SAFE_OPTIONS and not arg.startswith("-O"):
+            return False
+    return True
+
+def _has_option(arg, option):
+    """Return True if arg sets option, including in a cluster of short options like -ro."""
+    if option.startswith("--"):
+        return arg == option or arg.startswith(option + "=")
+    return arg.startswith("-") and not arg.startswith("--") and option[1] in arg[1:]
+
+def _program_effects(command_line, cwd):
+    """Effects of a plain program invocation; a barrier unless it is known to be read-only."""
+    if any(c in SHELL_OPERATORS for c in command_line):
+        return Effects(barrier=True)
+    try:
+        args = shlex.split(command_line)
+    except ValueError:
+        return Effects(barrier=True)
+    if args and os.path.basename(args[0]) == "env":
+        # env runs the command after its assignments, so that command decides the effects
+        args = _env_command(args[1:])
+        if args is None:
+            return Effects(barrier=True)
+    if not args:
+        return Effects()
+    program, rest = os.path.basename(args[0]), args[1:]
+    if program == "env":
+        return _program_effects(shlex.join(args), cwd)
+    if program in NO_FILE_PROGRAMS:
+        return Effects()
+    if program in ("pip", "pip3") and rest and rest[0] in READ_ONLY_PIP:
+        return Effects()
+    if program not in READ_ONLY_PROGRAMS:
+        return Effects(barrier=True)
+    if program == "find" and not _is_safe_find(rest):
+        return Effects(barrier=True)
+    if any(_has_option(arg, option) for arg in rest for option in UNSAFE_OPTIONS.get(program, ())):
+        return Effects(barrier=True)
+    # Every non-option argument is treated as a path, which can only add dependencies
+    paths = [arg for arg in rest if not arg.startswith("-")]
+    return Effects(reads=[_path(p, cwd) for p in paths] or [_path(".", cwd)])
+
+def analyze(cmd, cwd=None, shell=None):
+    """Return the Effects of one command."""
+    if cmd.startswith(CMD_PREFIX_DIR):
+        return Effects(writes=[_path(cmd[len(CMD_PREFIX_DIR):], cwd)])
+    if cmd.startswith(CMD_PREFIX_FILE):
+        parsed = parse_file_command(cmd, cwd)
+        if parsed is None:
+            return Effects()
+        return Effects(writes=[_path(parsed[0], cwd)])
+    if cmd.startswith(CMD_PREFIX_PATCH):
+        path = _path(cmd[len(CMD_PREFIX_PATCH):].partition("\n")[0], cwd)
+        return Effects(reads=[path], writes=[path])
+    if cmd.startswith((CMD_PREFIX_TREE, CMD_PREFIX_SUMMARY)):
+        args = cmd.split(":", 1)[1].split()
+        return Effects(reads=[_path(args[0] if args else ".", cwd)])
+    if cmd.startswith((CMD_PREFIX_GLOB, CMD_PREFIX_GREP)):
+        return Effects(reads=[_path(".", cwd)])
+    if cmd.startswith(CMD_PREFIX_GIT):
+        # One repository at a time (git holds index.lock); mutating commands touch the whole tree
+        try:
+            parsed = _git_command(shlex.split(cmd[len(CMD_PREFIX_GIT):]), cwd)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            return Effects(barrier=True)
+        args, directory = parsed
+        repo = _path(".", directory)
+        if args and args[0] in READ_ONLY_GIT:
+            return Effects(reads=[repo], resources=[f"git:{repo}"])
+        return Effects(writes=[repo], resources=[f"git:{repo}"])
+    if cmd.startswith(CMD_PREFIX_RUN):
+        if shell is not None:
+            return Effects(barrier=True)  # Commands share the shell's state
+        return _program_effects(cmd[len(CMD_PREFIX_RUN):].strip(), cwd)
+    if cmd.startswith((CMD_PREFIX_INSTALL, CMD_PREFIX_SHELL)):
+        return Effects(barrier=True)
+    return _program_effects(cmd.strip(), cwd)
+
+def _overlap(paths, others):
+    for a in paths:
+        for b in others:
+            if a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep):
+                return True
+    return False
+
+def conflicts(first, second):
+    """Return True if second must wait for first."""
+    if first.barrier or second.barrier:
+        return True
+    if first.resources & second.resources:
+        return True
+    return (_overlap(first.writes, second.reads | second.writes)
+            or _overlap(first.reads, second.writes))
+
+def build_plan(commands, cwd=None, shell=None):
+    """Group commands into nodes and link each node to the earlier nodes it depends on."""
+    parallel_kinds = get_profile().parallel_kinds
+    nodes = []
+    for is_file_batch, batch in group_file_ops(commands):
+        effects = Effects()
+        for cmd in batch:
+            effects.update(analyze(cmd, cwd, shell))
+            if command_kind(cmd) not in parallel_kinds:
+                effects.barrier = True
+        node = PlanNode(len(nodes), batch, effects)
+        for earlier in nodes:
+            if conflicts(earlier.effects, effects):
+                node.deps.add(earlier.index)
+        nodes.append(node)
+    return nodes
+
+def run_plan(commands, cwd=None, shell=None, max_workers=None, on_result=None):
+    """Run commands with as much parallelism as their dependencies allow.
+
+    max_workers defaults to the profile's. on_result(cmd, result) is called
+    from worker threads as commands finish. Returns a list of
+    (command, CommandResult) pairs in the original order.
+    """
+    max_workers = max_workers or get_profile().max_workers
+    nodes = build_plan(commands, cwd, shell)
+    if not nodes:
+        return []
+    results = {}
+    done = set()
+    with span("plan.run", commands=len(commands), nodes=len(nodes)):
+        if max_workers <= 1 or all(node.deps == set(range(node.index)) for node in nodes):
+            # Nothing can overlap; run in order without the thread pool
+            for node in nodes:
+                results[node.index] = _run_node(node, cwd, shell, on_result)
+        else:
+            print(f"Running {len(commands)} commands as {len(nodes)} steps, up to {max_workers} at a time")
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan") as pool:
+                running = {}
+                pending = list(nodes)
+                while pending or running:
+                    for node in [n for n in pending if n.deps <= done]:
+                        pending.remove(node)
+                        running[pool.submit(_run_node, node, cwd, shell, on_result)] = node
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        node = running.pop(future)
+                        results[node.index] = future.result()
+                        done.add(node.index)
+    ordered = []
+    for node in nodes:
+        ordered.extend(results[node.index])
+    return ordered
+
+def _run_node(node, cwd, shell, on_result):
+    try:
+        pairs = execute_commands(node.commands, cwd, shell)
+    except Exception as e:
+        pairs = [(cmd, CommandResult.error(cmd, f"Error executing command: {str(e)}")) for cmd in node.commands]
+    if on_result:
+        for cmd, result in pairs:
+            on_result(cmd, result)
+    return pairs
@@ -1,18 +1,88 @@
-from poe_api_wrapper import AsyncPoeApi
-from utils import format_command_output
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from utils import write_command_output, output_size
+from attachments import build_attachments
+from config import REVIEW_ATTACHMENT_DIR
+from settings import get_profile
+from context_budget import budgeter as default_budgeter
+from tracing import tracer, span
+from replay import recorder, RecordingPoeApi
 
 class PoeClientWrapper:
-    def __init__(self, tokens, bot_name, chat_code=None):
+    def __init__(self, tokens, bot_name, chat_code=None, budgeter=None, api=None):
         self.tokens = tokens
         self.bot_name = bot_name
         self.chat_code = chat_code
         self.client = None
+        self.budgeter = budgeter or default_budgeter
+        self.last_trimmed = False  # Whether the budgeter trimmed the last message sent
+        # Optional API object to use instead of connecting to Poe (e.g. fake_poe.FakeAsyncPoeApi)
+        self.api = api
     
     async def initialize(self):
         """Initialize the Poe API client."""
-        self.client = await AsyncPoeApi(tokens=self.tokens).create()
+        if self.api is not None:
+            self.client = await self.api.create()
+        else:
+            # Imported here because the wrapper is slow to import and not every entry point needs it
+            from poe_api_wrapper import AsyncPoeApi
+            self.client = await AsyncPoeApi(tokens=self.tokens).create()
+        if recorder.enabled:
+            self.client = RecordingPoeApi(self.client, recorder)
         return self
     
+    def for_chat(self, chat_code):
+        """Return a wrapper for another chat that shares this client's connection."""
+        bound = PoeClientWrapper(self.tokens, self.bot_name, chat_code, self.budgeter, self.api)
+        bound.client = self.client
+        return bound
+    
+    async def stream_message(self, message, use_chat_code=True, file_path=None):
+        """
+        Send a message to the bot and yield the reply text as it grows.
+        
+        Args:
+            message (str): The message to send to the bot
+            use_chat_code (bool): Whether to use chat code in the request
+            file_path (list, optional): List of file paths to attach to the message
+        
+        Yields:
+            str: The bot's response so far
+        """
+        if not self.client:
+            raise ValueError("Client not initialized. Call initialize() first.")
+        
+        # Keep the message inside the token budget and account for it
+        chat_key = self.chat_code if use_chat_code and self.chat_code else self.bot_name
+        self.last_trimmed = not self.budgeter.fits(message)
+        message = self.budgeter.prepare(message, chat_key)
+        
+        kwargs = {}
+        if use_chat_code and self.chat_code:
+            kwargs["chatCode"] = self.chat_code
+        if file_path:
+            kwargs["file_path"] = file_path
+        
+        response = ""
+        with span("bot.send", bot=self.bot_name, chat=chat_key, message_chars=len(message)) as send_span:
+            start = time.perf_counter_ns()
+            first_chunk = True
+            async for chunk in self.client.send_message(self.bot_name, message, **kwargs):
+                if first_chunk:
+                    tracer.record("bot.first_chunk", start, time.perf_counter_ns(), bot=self.bot_name)
+                    first_chunk = False
+                response = chunk["text"]
+                if use_chat_code and not self.chat_code and chunk.get("chatCode"):
+                    # Without a chat code Poe opens a new chat; keep using it
+                    self.chat_code = chunk["chatCode"]
+                yield response
+            send_span.set(reply_chars=len(response))
+        
+        self.budgeter.record_response(response, chat_key)
+    
     async def send_message(self, message, use_chat_code=True, file_path=None):
         """
         Send a message to the bot and return the response.
@@ -25,47 +95,13 @@ class PoeClientWrapper:
         Returns:
             str: The bot's response
         """
-        if not self.client:
-            raise ValueError("Client not initialized. Call initialize() first.")
-        
         response = ""
         print(f"Bot is thinking...", end="", flush=True)
         
         try:
-            if use_chat_code and self.chat_code:
-                if file_path:
-                    async for chunk in self.client.send_message(
-                        self.bot_name, 
-                        message, 
-                        chatCode=self.chat_code,
-                        file_path=file_path
-                    ):
-                        print(".", end="", flush=True)
-                        response = chunk["text"]
-                else:
-                    async for chunk in self.client.send_message(
-                        self.bot_name, 
-                        message, 
-                        chatCode=self.chat_code
-                    ):
-                        print(".", end="", flush=True)
-                        response = chunk["text"]
-            else:
-                if file_path:
-                    async for chunk in self.client.send_message(
-                        self.bot_name, 
-                        message,
-                        file_path=file_path
-                    ):
-                        print(".", end="", flush=True)
-                        response = chunk["text"]
-                else:
-                    async for chunk in self.client.send_message(
-                        self.bot_name, 
-                        message
-                    ):
-                        print(".", end="", flush=True)
-                        response = chunk["text"]
+            async for text in self.stream_message(message, use_chat_code, file_path):
+                print(".", end="", flush=True)
+                response = text
             
             print("\n")
             return response
@@ -77,6 +113,11 @@ class PoeClientWrapper:
         """
         Send command outputs back to the bot for review.
         
+        The transport depends on the payload size: small outputs go inline in the
+        message, medium ones as a file attachment, and large ones as a per-command
+        summary plus the attachment. The attachment is built in a worker thread
+        while the summary is built, compressed or split into parts by size.
+        
         Args:
             command_outputs (dict): Dictionary of command outputs
             output_file (str, optional): Path to file containing command outputs
@@ -88,33 +129,85 @@ class PoeClientWrapper:
             print("No command outputs to review.")
             return None
         
+        command_outputs = command_outputs or {}
+        size = sum(len(cmd) + output_size(output, full=True) for cmd, output in command_outputs.items())
         if output_file:
-            # Send the file as an attachment
+            size = max(size, os.path.getsize(output_file)) if os.path.exists(output_file) else size
+        
+        profile = get_profile()
+        if size <= profile.review_inline_max_chars and command_outputs:
+            print(f"\nSending outputs to bot for review in message body ({size} chars)...")
+            return await self._send_review_inline(command_outputs)
+        
+        # Build the attachment in the background while the message is prepared
+        attachments = []
+        if output_file:
+            write_task = None
+        else:
+            if REVIEW_ATTACHMENT_DIR:
+                os.makedirs(REVIEW_ATTACHMENT_DIR, exist_ok=True)
+            directory = tempfile.mkdtemp(prefix="review_", dir=REVIEW_ATTACHMENT_DIR)
+            write_task = asyncio.create_task(asyncio.to_thread(build_attachments, command_outputs, directory))
+        
+        try:
+            message = "I've executed the commands. Here are the results:"
+            if size > profile.review_summary_min_chars and command_outputs:
+                message = build_review_summary(command_outputs)
+            
+            if write_task is not None:
+                attachments = await write_task
+            file_paths = [output_file] if output_file else attachments
             try:
-                print(f"Sending output file as attachment: {output_file}")
-                message = "I've executed the commands. Here are the results:"
-                response = await self.send_message(
-                    message=message,
-                    file_path=[output_file]
-                )
-                return response
+                print(f"Sending outputs as attachment: {', '.join(file_paths)} ({size} chars)")
+                return await self.send_message(message=message, file_path=file_paths)
             except Exception as e:
                 print(f"Error sending file attachment: {e}")
+                if not command_outputs:
+                    return None
                 print("Falling back to sending outputs in message body...")
-                # Fall through to the text-based approach
-        
-        # Text-based approach (fallback or if no file)
-        review_message = "I've executed the commands and here are the results:\n\n"
-        
+                return await self._send_review_inline(command_outputs)
+        finally:
+            if write_task is not None:
+                # Let the builder finish before removing its files
+                await asyncio.gather(write_task, return_exceptions=True)
+                shutil.rmtree(directory, ignore_errors=True)
+    
+    async def _send_review_inline(self, command_outputs):
+        """Send the outputs in the message body (the budgeter trims oversized blocks)."""
+        parts = ["I've executed the commands and here are the results:\n\n"]
         for cmd, output in command_outputs.items():
-            review_message += format_command_output(cmd, output)
+            write_command_output(parts.append, cmd, output)
+        parts.append("Please review these outputs and provide feedback or next steps.")
         
-        review_message += "Please review these outputs and provide feedback or next steps."
-        
-        print("\nSending outputs to bot for review in message body...")
         try:
-            response = await self.send_message(review_message)
+            response = await self.send_message("".join(parts))
             return response
         except Exception as e:
             print(f"\nError sending outputs for review: {e}")
-            return None
\ No newline at end of file
+            return None
+    
+    def get_token_metrics(self):
+        """Return token usage for this client's chat."""
+        return self.budgeter.get_metrics(self.chat_code or self.bot_name)
+
+def build_review_summary(command_outputs):
+    """Return a short message listing each command with its status and output size."""
+    lines = [f"I've executed {len(command_outputs)} commands. The full outputs are attached; summary:", ""]
+    for cmd, output in command_outputs.items():
+        first_line = cmd.splitlines()[0][:120] if cmd else ""
+        if isinstance(output, str):
+            text = output.strip()
+            lines.append(f"- [[{first_line}]]: {text.splitlines()[0][:200] if text else ''}")
+            continue
+        status = "ok" if output.ok else f"exit {output.exit_status}"
+        lines.append(f"- [[{first_line}]]: {status}, {output.stdout_bytes} stdout bytes, "
+                     f"{output.stderr_bytes} stderr bytes" + (" (truncated)" if output.truncated else ""))
+        if output.message.strip():
+            lines.append(f"  {output.message.strip().splitlines()[-1][:200]}")
+        stderr = output.stderr.rstrip()
+        if stderr and not output.ok:
+            # The tail of stderr usually holds the error
+            lines.extend(f"  | {line[:200]}" for line in stderr.splitlines()[-5:])
+    lines.append("")
+    lines.append("Please review these outputs and provide feedback or next steps.")
+    return "\n".join(lines)
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Record bot conversations and replay them without the live API.
+
+While recording, every message sent through PoeClientWrapper is written to a
+JSONL trace with the reply chunks and their timing, and every executed command
+is written with its result. ReplayPoeApi serves a trace's replies in place of
+AsyncPoeApi, at the recorded pace, faster or as fast as possible. Commands in
+replayed replies run for real; their recorded results are only for reading.
+
+    python main.py --record session.jsonl
+    python main.py --replay session.jsonl --replay-speed 0
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+class TraceRecorder:
+    """Appends exchanges and command results to a JSONL trace file."""
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def enable(self, path):
+        """Start recording to path (appending)."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self.path = path
+            self._file = open(path, "a", encoding="utf-8")
+            self.enabled = True
+        print(f"Recording conversation trace to {path}")
+
+    def disable(self):
+        """Stop recording and close the trace file."""
+        with self._lock:
+            self.enabled = False
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=str, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._file.flush()
+
+    def record_exchange(self, bot_name, chat_code, message, chunks, file_path=None, error=None):
+        """Record one message and its reply chunks as [offset_ms, delta] pairs."""
+        if not self.enabled:
+            return
+        entry = {
+            "type": "exchange",
+            "time": time.time(),
+            "bot": bot_name,
+            "chat_code": chat_code,
+            "message": message,
+            "chunks": chunks,
+        }
+        if file_path:
+            entry["file_path"] = file_path
+        if error:
+            entry["error"] = error
+        self._write(entry)
+
+    def record_command(self, command, result):
+        """Record an executed command and its CommandResult."""
+        if not self.enabled:
+            return
+        self._write({
+            "type": "command",
+            "time": time.time(),
+            "command": command,
+            "result": result.to_dict(),
+            "duration_ms": result.duration_ms,
+        })
+
+class RecordingPoeApi:
+    """Wraps an AsyncPoeApi-like object and records every exchange."""
+
+    def __init__(self, api, recorder):
+        self.api = api
+        self.recorder = recorder
+
+    async def create(self):
+        return self
+
+    async def send_message(self, bot_name, message, chatCode=None, file_path=None, **kwargs):
+        if chatCode is not None:
+            kwargs["chatCode"] = chatCode
+        if file_path:
+            kwargs["file_path"] = file_path
+        chunks = []
+        text = ""
+        start = time.perf_counter()
+        try:
+            async for chunk in self.api.send_message(bot_name, message, **kwargs):
+                new_text = chunk["text"]
+                delta = new_text[len(text):] if new_text.startswith(text) else new_text
+                chunks.append([round((time.perf_counter() - start) * 1000, 1), delta])
+                text = new_text
+                yield chunk
+        except Exception as e:
+            self.recorder.record_exchange(bot_name, chatCode, message, chunks, file_path, error=str(e))
+            raise
+        self.recorder.record_exchange(bot_name, chatCode, message, chunks, file_path)
+
+class ReplayMismatch(Exception):
+    """Raised when a replayed trace has no reply left for a bot."""
+
+class ReplayPoeApi:
+    """Serves recorded replies in place of AsyncPoeApi.
+
+    Replies are served per bot in recorded order. speed is the pace relative
+    to the recording (1.0 = original pace, 2.0 = twice as fast, 0 = as fast as
+    possible).
+    """
+
+    def __init__(self, trace_path, speed=1.0, strict=False):
+        self.trace_path = trace_path
+        self.speed = speed
+        self.strict = strict
+        self.exchanges = defaultdict(deque)
+        with open(trace_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if entry.get("type") == "exchange":
+                    self.exchanges[entry["bot"]].append(entry)
+        total = sum(len(q) for q in self.exchanges.values())
+        print(f"Loaded {total} exchanges from {trace_path}")
+
+    async def create(self):
+        return self
+
+    async def send_message(self, bot_name, message, chatCode=None, file_path=None, **kwargs):
+        queue = self.exchanges.get(bot_name)
+        if not queue:
+            raise ReplayMismatch(f"No recorded replies left for bot {bot_name}")
+        entry = queue.popleft()
+        if entry["message"] != message:
+            note = f"Replayed message differs from the recording for bot {bot_name}"
+            if self.strict:
+                raise ReplayMismatch(note)
+            print(note)
+
+        text = ""
+        elapsed = 0.0
+        for offset_ms, delta in entry["chunks"]:
+            if self.speed:
+                wait = (offset_ms / 1000 - elapsed) / self.speed
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                elapsed = offset_ms / 1000
+            text += delta
+            yield {"text": text, "response": delta, "chatCode": chatCode}
+        if entry.get("error"):
+            raise RuntimeError(entry["error"])
+
+# Shared recorder; enabled by --record
+recorder = TraceRecorder()
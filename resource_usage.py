@@ -0,0 +1,161 @@
+"""Resource accounting for executed commands.
+
+run_measured() runs a subprocess like subprocess.run, reads its output until
+EOF and then reaps it itself with os.wait4, which returns the child's own
+user/system CPU time and peak RSS.
+The shared `usage` tracker aggregates wall time, CPU, peak memory and output
+bytes per command kind and per session, and remembers the last run of each
+command so one that was expensive can be flagged before it is run again.
+Persistent-shell commands are not a child of this process, so only their wall
+time and output are known.
+"""
+import collections
+import os
+import subprocess
+import threading
+import time
+from config import USAGE_EXPENSIVE_WALL_MS, USAGE_EXPENSIVE_CPU_MS, USAGE_EXPENSIVE_RSS_KB
+from config import USAGE_EXPENSIVE_OUTPUT_BYTES, USAGE_MAX_COMMANDS, USAGE_TOP_COMMANDS
+from utils import command_kind
+
+def _read(stream, outputs, name):
+    try:
+        outputs[name] = stream.read()
+    except (OSError, ValueError):
+        pass  # The pipe was closed after a timeout
+
+def _reap(process, deadline, timeout):
+    """Wait for process with os.wait4, set its returncode and return its rusage."""
+    delay = 0.0005
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        except ChildProcessError:
+            # Reaped elsewhere: let Popen settle the returncode, the usage is lost
+            process.wait()
+            return None
+        if pid == process.pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return rusage
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+
+def _communicate_measured(process, timeout):
+    """Read the process's output to EOF and reap it; returns (stdout, stderr, rusage)."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if process.stdin:
+        process.stdin.close()
+    outputs = {}
+    readers = []
+    for name in ("stdout", "stderr"):
+        stream = getattr(process, name)
+        if stream is not None:
+            reader = threading.Thread(target=_read, args=(stream, outputs, name), daemon=True)
+            reader.start()
+            readers.append(reader)
+    for reader in readers:
+        reader.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        if reader.is_alive():
+            raise subprocess.TimeoutExpired(process.args, timeout)
+    rusage = _reap(process, deadline, timeout)
+    return outputs.get("stdout"), outputs.get("stderr"), rusage
+
+def run_measured(args, timeout=None, capture_output=False, **kwargs):
+    """Run a process like subprocess.run; the result has a .rusage attribute (None if unavailable)."""
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+    rusage = None
+    with subprocess.Popen(args, **kwargs) as process:
+        try:
+            if hasattr(os, "wait4"):
+                stdout, stderr, rusage = _communicate_measured(process, timeout)
+            else:
+                stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise
+        except BaseException:
+            process.kill()
+            raise
+    completed = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    completed.rusage = rusage
+    return completed
+
+def _new_totals():
+    return {"count": 0, "wall_ms": 0.0, "cpu_user_ms": 0.0, "cpu_sys_ms": 0.0,
+            "max_rss_kb": 0, "output_bytes": 0, "expensive": 0}
+
+class UsageTracker:
+    """Aggregates CommandResult resource usage per kind and per session."""
+
+    def __init__(self, max_commands=USAGE_MAX_COMMANDS):
+        self.max_commands = max_commands
+        self.kinds = collections.defaultdict(_new_totals)
+        self.sessions = collections.defaultdict(_new_totals)
+        self._last = collections.OrderedDict()  # command -> usage dict of its last run
+        self._lock = threading.Lock()
+
+    def expense(self, result):
+        """Return the reasons a result counts as expensive (empty if it does not)."""
+        reasons = []
+        if (result.duration_ms or 0) > USAGE_EXPENSIVE_WALL_MS:
+            reasons.append(f"{result.duration_ms / 1000:.1f} s wall")
+        cpu_ms = (result.cpu_user_ms or 0) + (result.cpu_sys_ms or 0)
+        if cpu_ms > USAGE_EXPENSIVE_CPU_MS:
+            reasons.append(f"{cpu_ms / 1000:.1f} s CPU")
+        if (result.peak_rss_kb or 0) > USAGE_EXPENSIVE_RSS_KB:
+            reasons.append(f"{result.peak_rss_kb // 1024} MB peak RSS")
+        if result.output_bytes > USAGE_EXPENSIVE_OUTPUT_BYTES:
+            reasons.append(f"{result.output_bytes // 1024} KB of output")
+        return reasons
+
+    @staticmethod
+    def _add(totals, usage):
+        totals["count"] += 1
+        for key in ("wall_ms", "cpu_user_ms", "cpu_sys_ms"):
+            totals[key] = round(totals[key] + (usage[key] or 0), 1)
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], usage["peak_rss_kb"] or 0)
+        totals["output_bytes"] += usage["output_bytes"]
+        totals["expensive"] += bool(usage["expensive"])
+
+    def record(self, result):
+        """Add a finished CommandResult to the per-kind totals and remember its usage."""
+        usage = result.usage()
+        usage["expensive"] = self.expense(result)
+        with self._lock:
+            self._add(self.kinds[command_kind(result.command)], usage)
+            self._last.pop(result.command, None)
+            self._last[result.command] = usage
+            while len(self._last) > self.max_commands:
+                self._last.popitem(last=False)
+
+    def record_session(self, session, result):
+        """Add a CommandResult to a session's totals."""
+        usage = result.usage()
+        usage["expensive"] = self.expense(result)
+        with self._lock:
+            self._add(self.sessions[session], usage)
+
+    def check(self, cmd):
+        """Return a warning if the last run of cmd was expensive, else None."""
+        with self._lock:
+            usage = self._last.get(cmd)
+        if not usage or not usage["expensive"]:
+            return None
+        return f"Note: the last run of this command was expensive ({', '.join(usage['expensive'])})"
+
+    def get_metrics(self):
+        """Return totals per kind and per session plus the most expensive recent commands."""
+        with self._lock:
+            recent = [dict(usage, command=cmd[:200]) for cmd, usage in self._last.items()]
+            kinds = {kind: dict(totals) for kind, totals in self.kinds.items()}
+            sessions = {session: dict(totals) for session, totals in self.sessions.items()}
+        recent.sort(key=lambda u: ((u["cpu_user_ms"] or 0) + (u["cpu_sys_ms"] or 0), u["wall_ms"] or 0), reverse=True)
+        return {"kinds": kinds, "sessions": sessions, "top_commands": recent[:USAGE_TOP_COMMANDS]}
+
+usage = UsageTracker()
@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import itertools
+import time
+from config import SCHEDULER_LANE_LIMITS, SCHEDULER_MAX_RUNNING, SCHEDULER_STARVATION_SECONDS
+from config import SCHEDULER_MAX_PREEMPTIONS, SCHEDULER_QUEUE_LIMITS
+from tracing import span
+
+# Lanes in priority order
+INTERACTIVE = "interactive"
+REVIEW = "review"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, REVIEW, BACKGROUND)
+
+class Job:
+    __slots__ = ("id", "lane", "factory", "key", "preemptible", "name",
+                 "submitted", "started", "future", "task", "preemptions")
+
+    def __init__(self, job_id, lane, factory, key, preemptible, name):
+        self.id = job_id
+        self.lane = lane
+        self.factory = factory
+        self.key = key
+        self.preemptible = preemptible
+        self.name = name
+        self.submitted = time.monotonic()
+        self.started = None
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        self.preemptions = 0
+
+class Scheduler:
+    """Runs async jobs from prioritized lanes on the current event loop.
+
+    Jobs are coroutine factories so a preempted job can be started again.
+    The highest-priority waiting job runs first, subject to a per-lane limit,
+    a total limit and its key: jobs with the same key (e.g. one chat) never
+    run at the same time, which keeps each conversation in order. When an
+    interactive job cannot start, a running preemptible job from a lower lane
+    is cancelled and put back at the front of its lane. A job that has waited
+    longer than starvation_seconds goes ahead of every lane, and a job is
+    preempted at most max_preemptions times, so background work always finishes.
+    A lane with a queue limit drops its oldest waiting preemptible job (its
+    future is cancelled) when a new job would exceed the limit.
+    """
+
+    def __init__(self, lane_limits=None, max_running=SCHEDULER_MAX_RUNNING,
+                 starvation_seconds=SCHEDULER_STARVATION_SECONDS,
+                 max_preemptions=SCHEDULER_MAX_PREEMPTIONS, queue_limits=None):
+        self.lane_limits = dict(SCHEDULER_LANE_LIMITS, **(lane_limits or {}))
+        self.queue_limits = dict(SCHEDULER_QUEUE_LIMITS, **(queue_limits or {}))
+        self.max_running = max_running
+        self.starvation_seconds = starvation_seconds
+        self.max_preemptions = max_preemptions
+        self.queues = {lane: collections.deque() for lane in LANES}
+        self.running = set()
+        self._ids = itertools.count(1)
+        self.stats = {lane: {"completed": 0, "failed": 0, "preempted": 0, "dropped": 0, "max_wait_ms": 0.0,
+                             "max_queued": 0}
+                      for lane in LANES}
+
+    def submit(self, lane, factory, key=None, preemptible=None, name=None):
+        """Queue factory() to run in lane; returns a future for its result.
+
+        Must be called on the event loop. Background jobs are preemptible
+        unless preemptible=False is given.
+        """
+        if lane not in self.queues:
+            raise ValueError(f"Unknown lane: {lane}")
+        if preemptible is None:
+            preemptible = lane == BACKGROUND
+        job = Job(next(self._ids), lane, factory, key, preemptible, name or lane)
+        self.queues[lane].append(job)
+        self._enforce_limit(lane)
+        self.stats[lane]["max_queued"] = max(self.stats[lane]["max_queued"], len(self.queues[lane]))
+        self._dispatch()
+        return job.future
+
+    def _enforce_limit(self, lane):
+        limit = self.queue_limits.get(lane)
+        queue = self.queues[lane]
+        if not limit or len(queue) <= limit:
+            return
+        oldest = next((job for job in queue if job.preemptible), None)
+        if oldest is None:
+            return  # Only jobs that must run are waiting
+        print(f"{lane} lane full; dropping {oldest.name} job {oldest.id}")
+        queue.remove(oldest)
+        self.stats[lane]["dropped"] += 1
+        oldest.future.cancel()
+
+    def submit_threadsafe(self, loop, lane, factory, **kwargs):
+        """Queue a job from another thread; returns a concurrent.futures.Future."""
+        async def submit_and_wait():
+            return await self.submit(lane, factory, **kwargs)
+        return asyncio.run_coroutine_threadsafe(submit_and_wait(), loop)
+
+    def _running_in(self, lane):
+        return sum(1 for job in self.running if job.lane == lane)
+
+    def _busy_keys(self):
+        return {job.key for job in self.running if job.key is not None}
+
+    def _next_job(self):
+        """Return the job that should start next, or None."""
+        busy = self._busy_keys()
+        now = time.monotonic()
+        candidates = []
+        for priority, lane in enumerate(LANES):
+            if self._running_in(lane) >= self.lane_limits.get(lane, 1):
+                continue
+            for job in self.queues[lane]:
+                if job.key is None or job.key not in busy:
+                    starved = now - job.submitted >= self.starvation_seconds
+                    candidates.append((not starved, priority, job.submitted, job))
+                    break
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: c[:3])[3]
+
+    def _preempt_for(self, job):
+        """Cancel a lower-priority preemptible job so job can start; returns True if one was cancelled."""
+        busy = self._busy_keys()
+        blocked_by_key = job.key is not None and job.key in busy
+        if not blocked_by_key and len(self.running) < self.max_running:
+            return False
+        priority = LANES.index(job.lane)
+        victims = [r for r in self.running
+                   if r.preemptible and r.preemptions < self.max_preemptions
+                   and LANES.index(r.lane) > priority
+                   and (not blocked_by_key or r.key == job.key)]
+        if blocked_by_key and len([r for r in self.running if r.key == job.key]) > len(victims):
+            return False  # The key is also held by a job that cannot be preempted
+        if not victims:
+            return False
+        victim = max(victims, key=lambda r: r.started)  # Least work lost
+        print(f"Preempting {victim.name} job {victim.id} for {job.name} job {job.id}")
+        victim.preemptions += 1
+        self.stats[victim.lane]["preempted"] += 1
+        self.running.discard(victim)
+        victim.task.cancel()
+        victim.task = None
+        self.queues[victim.lane].appendleft(victim)
+        return True
+
+    def _dispatch(self):
+        # Make room for waiting interactive work first
+        for job in list(self.queues[INTERACTIVE])[:1]:
+            if self._running_in(INTERACTIVE) < self.lane_limits.get(INTERACTIVE, 1):
+                self._preempt_for(job)
+        while len(self.running) < self.max_running:
+            job = self._next_job()
+            if job is None:
+                return
+            self.queues[job.lane].remove(job)
+            self._start(job)
+
+    def _start(self, job):
+        job.started = time.monotonic()
+        wait_ms = (job.started - job.submitted) * 1000
+        stats = self.stats[job.lane]
+        stats["max_wait_ms"] = max(stats["max_wait_ms"], round(wait_ms, 1))
+        self.running.add(job)
+        job.task = asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job):
+        try:
+            with span("scheduler.job", lane=job.lane, job=job.name):
+                result = await job.factory()
+            error = None
+        except asyncio.CancelledError:
+            if job.task is not asyncio.current_task():
+                return  # Preempted; the job is queued again
+            self.running.discard(job)
+            if not job.future.done():
+                job.future.cancel()
+            self._dispatch()
+            raise
+        except Exception as e:
+            error = e
+        if job.task is not asyncio.current_task():
+            return  # Preempted but finished anyway; the queued copy will run again
+        self.running.discard(job)
+        if error is not None:
+            self.stats[job.lane]["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.stats[job.lane]["completed"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        self._dispatch()
+
+    async def close(self):
+        """Cancel running and queued jobs."""
+        for queue in self.queues.values():
+            for job in queue:
+                job.future.cancel()
+            queue.clear()
+        tasks = [job.task for job in self.running if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self):
+        """Return queued and running counts plus per-lane totals."""
+        return {
+            lane: dict(self.stats[lane], queued=len(self.queues[lane]), running=self._running_in(lane))
+            for lane in LANES
+        }
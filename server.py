@@ -0,0 +1,483 @@
+import asyncio
+import hmac
+import itertools
+import json
+import os
+import secrets
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from session_manager import SessionManager
+from utils import extract_commands
+from command_result import to_json
+from history_store import get_store
+from resource_usage import usage
+from settings import get_profile
+from config import SERVER_HOST, SERVER_PORT, HISTORY_PAGE_SIZE
+from config import SERVER_TOKEN, SERVER_TOKEN_FILE, SERVER_MAX_JOBS
+
+STATUS_TEXT = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error",
+}
+
+TOKEN_HEADER = "x-lililia-token"
+
+def server_token(create=False):
+    """Return the API token from the environment, config.py or SERVER_TOKEN_FILE.
+
+    With create=True a random token is generated and saved (readable only by
+    this user) when none exists, so local clients can read it from the file.
+    """
+    token = os.environ.get("LILILIA_SERVER_TOKEN") or SERVER_TOKEN
+    if token:
+        return token
+    try:
+        with open(SERVER_TOKEN_FILE, "r", encoding="utf-8") as f:
+            token = f.read().strip()
+    except OSError:
+        token = None
+    if token or not create:
+        return token
+    token = secrets.token_urlsafe(32)
+    fd = os.open(SERVER_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    print(f"Generated an API token in {SERVER_TOKEN_FILE}")
+    return token
+
+def check_request(headers, has_body, path, token):
+    """Return (status, error) if a request must be refused, else None.
+
+    Browsers add an Origin header to cross-site requests and can send "simple"
+    POSTs with form or text bodies, so both are refused; every route but
+    /health also needs the token.
+    """
+    if "origin" in headers:
+        return 403, "Cross-origin requests are not allowed"
+    content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+    if (has_body or content_type) and content_type != "application/json":
+        return 415, "Request bodies must be application/json"
+    if path != "/health" and not hmac.compare_digest(headers.get(TOKEN_HEADER, "").encode(), token.encode()):
+        return 401, "Missing or wrong X-Lililia-Token header"
+    return None
+
+def read_payload(query, body):
+    """Merge query-string fields and a JSON object body into one dict; raises ValueError otherwise."""
+    payload = dict(parse_qsl(query))
+    if body:
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object")
+        payload.update(data)
+    return payload
+
+async def read_http_message(reader):
+    """Read a start line, headers and body from an HTTP/1.1 stream."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None, {}, b""
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        # Streaming bodies are consumed by the caller chunk by chunk
+        return start_line.decode("latin-1").strip(), headers, None
+
+    length = int(headers.get("content-length") or 0)
+    body = await reader.readexactly(length) if length else b""
+    return start_line.decode("latin-1").strip(), headers, body
+
+async def iter_chunks(reader):
+    """Yield the decoded chunks of a chunked HTTP body."""
+    while True:
+        size_line = await reader.readline()
+        size = int(size_line.split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            await reader.readline()
+            return
+        data = await reader.readexactly(size)
+        await reader.readline()
+        yield data
+
+class AgentServer:
+    """Serves the bot and the command executor over a small local HTTP API.
+
+    Routes:
+        GET  /health              liveness check
+        POST /message             send a message and return the full reply
+        POST /message/stream      send a message and stream the reply as NDJSON
+        POST /commands            run commands in the background, returns a job id
+        GET  /results/<job_id>    fetch the status and outputs of a command job
+        GET  /metrics             token usage, command resource usage per kind and session,
+                                  and the active execution profile
+        GET  /sessions            list sessions
+        POST /sessions            create a session with its own chat code and directory
+        GET  /sessions/<id>       session summary and history
+        GET  /history/<id>        stored messages of a conversation, ?before=<message id>&limit=N
+        GET  /search?q=...        full-text search of stored messages and command outputs
+        DELETE /sessions/<id>     close a session (not "default"); its queued requests fail
+
+    Message and command requests take an optional "session" id and otherwise
+    go to the default session. Every route but /health needs the API token in
+    an X-Lililia-Token header (see server_token()); requests with an Origin
+    header or a body that is not application/json are refused.
+    """
+
+    def __init__(self, clients):
+        if not isinstance(clients, (list, tuple)):
+            clients = [clients]
+        self.client = clients[0]
+        self.sessions = SessionManager(clients)
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+        self._server = None
+        self.token = server_token(create=True)
+
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+        """Start listening on a TCP port or a Unix socket."""
+        if "default" not in self.sessions.sessions:
+            self.sessions.create_session(chat_code=self.client.chat_code, session_id="default")
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f"Headless server listening on unix:{socket_path}")
+        else:
+            self._server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Headless server listening on http://{host}:{port}")
+        return self._server
+
+    async def serve_forever(self):
+        """Serve requests until cancelled."""
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            await self.sessions.close()
+
+    async def handle_connection(self, reader, writer):
+        """Handle a single request on a connection."""
+        try:
+            start_line, headers, body = await read_http_message(reader)
+            if not start_line:
+                return
+            method, target, _ = start_line.split(" ", 2)
+            url = urlsplit(target)
+            path = url.path.rstrip("/") or "/"
+            refusal = check_request(headers, body is None or bool(body), path, self.token)
+            if refusal:
+                await self.send_json(writer, refusal[0], {"error": refusal[1]})
+                return
+            payload = read_payload(url.query, body)
+            await self.dispatch(method.upper(), path, payload, writer)
+        except (ValueError, KeyError) as e:
+            await self.send_json(writer, 400, {"error": str(e)})
+        except Exception as e:
+            print(f"Error handling request: {e}")
+            await self.send_json(writer, 500, {"error": str(e)})
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def dispatch(self, method, path, payload, writer):
+        """Route a request to its handler."""
+        if path == "/health":
+            await self.send_json(writer, 200, {"status": "ok"})
+        elif path == "/message" and method == "POST":
+            await self.send_json(writer, 200, await self.handle_message(payload))
+        elif path == "/message/stream" and method == "POST":
+            await self.handle_stream(payload, writer)
+        elif path == "/commands" and method == "POST":
+            await self.send_json(writer, 202, self.handle_commands(payload))
+        elif path.startswith("/results/") and method == "GET":
+            job = self.jobs.get(path[len("/results/"):])
+            if job is None:
+                await self.send_json(writer, 404, {"error": "Unknown job"})
+            else:
+                await self.send_json(writer, 200, job)
+        elif path == "/metrics" and method == "GET":
+            await self.send_json(writer, 200, {"tokens": self.client.budgeter.get_metrics(),
+                                               "commands": usage.get_metrics(),
+                                               "profile": get_profile().to_dict()})
+        elif path == "/sessions" and method == "GET":
+            await self.send_json(writer, 200, [s.info() for s in self.sessions.sessions.values()])
+        elif path == "/sessions" and method == "POST":
+            session = self.sessions.create_session(
+                chat_code=payload.get("chat_code"),
+                working_dir=payload.get("working_dir"),
+                session_id=payload.get("id")
+            )
+            await self.send_json(writer, 200, session.info())
+        elif path.startswith("/sessions/") and method == "GET":
+            session = self.sessions.get_session(path[len("/sessions/"):])
+            await self.send_json(writer, 200, dict(session.info(), history=session.history))
+        elif path.startswith("/history/") and method == "GET":
+            await self.send_json(writer, 200, self.handle_history(path[len("/history/"):], payload))
+        elif path == "/search" and method == "GET":
+            await self.send_json(writer, 200, self.handle_search(payload))
+        elif path.startswith("/sessions/") and method == "DELETE":
+            session_id = path[len("/sessions/"):]
+            if session_id == "default":
+                raise ValueError("The default session cannot be closed")
+            await self.sessions.close_session(session_id)
+            await self.send_json(writer, 200, {"status": "closed"})
+        elif path in ("/message", "/message/stream", "/commands", "/metrics", "/sessions"):
+            await self.send_json(writer, 405, {"error": f"{method} not allowed on {path}"})
+        else:
+            await self.send_json(writer, 404, {"error": f"No route for {path}"})
+
+    def handle_history(self, conversation, payload):
+        """Return a page of a stored conversation, oldest first."""
+        store = get_store()
+        if store is None:
+            raise ValueError("History is disabled")
+        before = payload.get("before")
+        limit = int(payload.get("limit", HISTORY_PAGE_SIZE))
+        messages = store.get_messages(conversation, int(before) if before else None, limit)
+        return {
+            "conversation": store.get_conversation(conversation),
+            "messages": messages,
+            "next_before": messages[0]["id"] if len(messages) == limit else None,
+        }
+
+    def handle_search(self, payload):
+        """Search stored messages and command outputs."""
+        store = get_store()
+        if store is None:
+            raise ValueError("History is disabled")
+        return store.search(
+            payload["q"],
+            conversation=payload.get("session"),
+            limit=int(payload.get("limit", HISTORY_PAGE_SIZE)),
+            offset=int(payload.get("offset", 0))
+        )
+
+    async def handle_message(self, payload):
+        """Send a message to the bot and return the reply with its commands."""
+        response = await self.sessions.send_message(
+            payload.get("session", "default"),
+            payload["message"],
+            file_path=payload.get("file_path")
+        )
+        return {"response": response, "commands": extract_commands(response)}
+
+    async def handle_stream(self, payload, writer):
+        """Stream the bot's reply as newline-delimited JSON deltas."""
+        session_id = payload.get("session", "default")
+        self.sessions.get_session(session_id)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        response = ""
+        try:
+            async for text in self.sessions.stream_message(
+                session_id,
+                payload["message"],
+                file_path=payload.get("file_path")
+            ):
+                delta = text[len(response):] if text.startswith(response) else text
+                response = text
+                if delta:
+                    await self.write_chunk(writer, {"delta": delta})
+            final = {"done": True, "response": response, "commands": extract_commands(response)}
+        except Exception as e:
+            print(f"Error streaming message: {e}")
+            final = {"done": True, "error": str(e), "response": response}
+        await self.write_chunk(writer, final)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def handle_commands(self, payload):
+        """Start a background job that runs the given commands."""
+        commands = payload.get("commands")
+        if commands is None and payload.get("text"):
+            commands = extract_commands(payload["text"])
+        if not commands:
+            raise ValueError("No commands given")
+
+        session_id = payload.get("session", "default")
+        self.sessions.get_session(session_id)
+        self._prune_jobs()
+        job_id = str(next(self._job_ids))
+        self.jobs[job_id] = {
+            "id": job_id,
+            "session": session_id,
+            "status": "running",
+            "commands": commands,
+            "results": None,
+            "review": None,
+        }
+        asyncio.get_running_loop().create_task(
+            self.run_job(job_id, session_id, commands, payload.get("review", False))
+        )
+        return {"job_id": job_id}
+
+    def _prune_jobs(self):
+        """Drop the oldest finished jobs so at most SERVER_MAX_JOBS - 1 remain."""
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] != "running"]
+        while len(self.jobs) >= SERVER_MAX_JOBS:
+            if not finished:
+                raise ValueError(f"{len(self.jobs)} jobs are still running; try again later")
+            del self.jobs[finished.pop(0)]
+
+    async def run_job(self, job_id, session_id, commands, review):
+        """Run a command job on the session's queue and optionally send it for review."""
+        job = self.jobs[job_id]
+        try:
+            outcome = await self.sessions.run_commands(session_id, commands, review)
+            job["results"] = outcome["results"]
+            job["review"] = outcome["review"]
+            job["status"] = "done"
+        except Exception as e:
+            print(f"Error running job {job_id}: {e}")
+            job["status"] = "error"
+            job["error"] = str(e)
+
+    async def send_json(self, writer, status, data):
+        """Write a complete JSON response."""
+        body = json.dumps(data, default=to_json).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def write_chunk(self, writer, data):
+        """Write one NDJSON line as an HTTP chunk."""
+        line = (json.dumps(data, default=to_json) + "\n").encode("utf-8")
+        writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+        await writer.drain()
+
+class AgentClient:
+    """Client for a running AgentServer with the same interface as PoeClientWrapper."""
+
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, socket_path=None, session=None):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.session = session or "default"
+        self.token = server_token()
+
+    async def initialize(self):
+        """Check that the server is reachable."""
+        await self._request("GET", "/health")
+        return self
+
+    async def _open(self):
+        if self.socket_path:
+            return await asyncio.open_unix_connection(self.socket_path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _send(self, method, path, payload=None):
+        reader, writer = await self._open()
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"X-Lililia-Token: {self.token or ''}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+        return reader, writer
+
+    async def _request(self, method, path, payload=None):
+        reader, writer = await self._send(method, path, payload)
+        try:
+            start_line, _, body = await read_http_message(reader)
+            status = int(start_line.split(" ", 2)[1])
+            data = json.loads(body) if body else {}
+            if status >= 400:
+                raise RuntimeError(f"Server error {status}: {data.get('error')}")
+            return data
+        finally:
+            writer.close()
+
+    async def stream_message(self, message, use_chat_code=True, file_path=None):
+        """Send a message and yield the reply text as it grows."""
+        reader, writer = await self._send("POST", "/message/stream", {
+            "message": message,
+            "session": self.session,
+            "file_path": file_path,
+        })
+        try:
+            await read_http_message(reader)
+            response = ""
+            async for chunk in iter_chunks(reader):
+                data = json.loads(chunk)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if data.get("done"):
+                    break
+                response += data["delta"]
+                yield response
+        finally:
+            writer.close()
+
+    async def send_message(self, message, use_chat_code=True, file_path=None):
+        """Send a message and return the bot's full reply."""
+        data = await self._request("POST", "/message", {
+            "message": message,
+            "session": self.session,
+            "file_path": file_path,
+        })
+        return data["response"]
+
+    async def run_commands(self, commands, review=False):
+        """Start a command job on the server and return its id."""
+        data = await self._request("POST", "/commands", {
+            "commands": commands,
+            "review": review,
+            "session": self.session,
+        })
+        return data["job_id"]
+
+    async def get_result(self, job_id):
+        """Return the status and outputs of a command job."""
+        return await self._request("GET", f"/results/{job_id}")
+
+    async def get_history(self, before=None, limit=HISTORY_PAGE_SIZE):
+        """Return a page of this client's stored conversation."""
+        query = urlencode({k: v for k, v in {"before": before, "limit": limit}.items() if v is not None})
+        return await self._request("GET", f"/history/{self.session}?{query}")
+
+    async def search_history(self, query, limit=HISTORY_PAGE_SIZE, offset=0):
+        """Search stored messages and command outputs across conversations."""
+        return await self._request("GET", "/search?" + urlencode({"q": query, "limit": limit, "offset": offset}))
+
+    async def create_session(self, chat_code=None, working_dir=None):
+        """Create a session on the server and use it for later requests."""
+        data = await self._request("POST", "/sessions", {"chat_code": chat_code, "working_dir": working_dir})
+        self.session = data["id"]
+        return data
+
+    def get_token_metrics(self):
+        """Token usage is tracked by the server; see GET /metrics."""
+        return {}
+
+async def serve(clients, host=SERVER_HOST, port=SERVER_PORT, socket_path=None):
+    """Run the headless server over initialized clients until cancelled."""
+    server = AgentServer(clients)
+    await server.start(host, port, socket_path)
+    await server.serve_forever()
@@ -0,0 +1,251 @@
+import asyncio
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from command_executor import execute_commands
+from command_result import CommandResult
+from shell_session import create_shell
+from file_ops import group_file_ops
+from workspace_index import with_snapshot
+from history_store import get_store
+from output_delta import OutputHistory
+from resource_usage import usage
+from config import SESSION_EXECUTOR_WORKERS, WORKSPACE_SNAPSHOT
+
+class Session:
+    """One conversation with its own chat code, working directory, queue and history."""
+
+    def __init__(self, session_id, chat_code=None, working_dir=None, store=None):
+        self.id = session_id
+        self.chat_code = chat_code
+        self.working_dir = os.path.abspath(working_dir) if working_dir else os.getcwd()
+        self.queue = asyncio.Queue()
+        self.history = []
+        self.worker = None
+        self.shell = create_shell(self.working_dir)
+        self.store = store
+        self.outputs = OutputHistory()  # Previous outputs, so reruns are reviewed as diffs
+        if store:
+            store.record_conversation(session_id, chat_code, self.working_dir)
+
+    def restore(self):
+        """Load the latest page of a stored conversation into the in-memory history."""
+        if self.store:
+            for row in self.store.get_messages(self.id):
+                self.history.append({"role": row["role"], "text": row["text"], "time": row["time"]})
+
+    def record(self, role, text, **extra):
+        """Append an entry to the session history and queue it for the history store."""
+        entry = {"role": role, "text": text, "time": time.time()}
+        entry.update(extra)
+        self.history.append(entry)
+        if role == "command":
+            usage.record_session(self.id, extra["output"])
+        if self.store:
+            if role == "command":
+                self.store.record_command(self.id, extra["output"])
+            else:
+                self.store.record_message(self.id, role, text, extra.get("duration_ms"), entry["time"])
+
+    def info(self):
+        """Return a summary of the session."""
+        return {
+            "id": self.id,
+            "chat_code": self.chat_code,
+            "working_dir": self.working_dir,
+            "pending": self.queue.qsize(),
+            "history": len(self.history),
+        }
+
+class SessionManager:
+    """Runs many sessions concurrently over a shared client pool and executor.
+
+    Each session works through its own queue in order, one item at a time.
+    Bot calls borrow a connection from the pool and commands run on the shared
+    executor; both hand out capacity first come first served, so a session
+    with a long backlog never holds more than one slot and cannot starve others.
+    """
+
+    def __init__(self, clients, max_workers=SESSION_EXECUTOR_WORKERS):
+        self.sessions = {}
+        self._session_ids = itertools.count(1)
+        self._clients = list(clients)
+        self._pool = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session-cmd")
+
+    def _get_pool(self):
+        # Created lazily so it binds to the running event loop
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+            for client in self._clients:
+                self._pool.put_nowait(client)
+        return self._pool
+
+    def create_session(self, chat_code=None, working_dir=None, session_id=None):
+        """Create a session and start its worker."""
+        session_id = session_id or str(next(self._session_ids))
+        if session_id in self.sessions:
+            raise ValueError(f"Session {session_id} already exists")
+        # A known id resumes the stored conversation in the same chat and directory
+        store = get_store()
+        stored = store.get_conversation(session_id) if store else None
+        if stored:
+            chat_code = chat_code or stored["chat_code"]
+            working_dir = working_dir or stored["working_dir"]
+        if working_dir:
+            os.makedirs(working_dir, exist_ok=True)
+        # Without a chat code the session's first message opens its own chat (see _adopt_chat)
+        session = Session(session_id, chat_code, working_dir, store)
+        if stored:
+            session.restore()
+        session.worker = asyncio.get_running_loop().create_task(self._run_session(session))
+        self.sessions[session_id] = session
+        print(f"{'Restored' if stored else 'Created'} session {session_id} "
+              f"(chat {chat_code or 'new'}, cwd {session.working_dir})")
+        return session
+
+    def get_session(self, session_id):
+        """Return a session by id."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Unknown session: {session_id}")
+        return session
+
+    async def close_session(self, session_id):
+        """Stop a session's worker, fail its queued requests and forget it."""
+        session = self.sessions.pop(session_id, None)
+        if session and session.worker:
+            session.worker.cancel()
+            try:
+                await session.worker
+            except asyncio.CancelledError:
+                pass
+        while session and not session.queue.empty():
+            _, _, future = session.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError(f"Session {session_id} was closed"))
+        if session and session.shell:
+            session.shell.close()
+
+    async def close(self):
+        """Close every session and shut down the executor."""
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        self.executor.shutdown(wait=False)
+
+    def _submit(self, session_id, kind, payload):
+        session = self.get_session(session_id)
+        future = asyncio.get_running_loop().create_future()
+        session.queue.put_nowait((kind, payload, future))
+        return future
+
+    async def send_message(self, session_id, message, file_path=None):
+        """Queue a message for a session and return the bot's reply."""
+        return await self._submit(session_id, "message", {"message": message, "file_path": file_path})
+
+    async def stream_message(self, session_id, message, file_path=None):
+        """Queue a message for a session and yield the reply text as it grows."""
+        updates = asyncio.Queue()
+        future = self._submit(session_id, "message", {
+            "message": message,
+            "file_path": file_path,
+            "updates": updates,
+        })
+        while True:
+            getter = asyncio.ensure_future(updates.get())
+            done, _ = await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            # Drain anything that arrived before the reply completed
+            while not updates.empty():
+                yield updates.get_nowait()
+            future.result()
+            return
+
+    async def run_commands(self, session_id, commands, review=False):
+        """Queue commands for a session and return their outputs (and review)."""
+        return await self._submit(session_id, "commands", {"commands": commands, "review": review})
+
+    async def _run_session(self, session):
+        while True:
+            kind, payload, future = await session.queue.get()
+            try:
+                if kind == "message":
+                    result = await self._handle_message(session, payload)
+                else:
+                    result = await self._handle_commands(session, payload)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                print(f"Error in session {session.id}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+
+    def _adopt_chat(self, session, client):
+        """Remember the chat Poe opened for a session that had none."""
+        if session.chat_code is None and client.chat_code:
+            session.chat_code = client.chat_code
+            if session.store:
+                session.store.record_conversation(session.id, session.chat_code)
+
+    async def _handle_message(self, session, payload):
+        session.record("user", payload["message"])
+        message = payload["message"]
+        if WORKSPACE_SNAPSHOT:
+            message = await asyncio.get_running_loop().run_in_executor(
+                self.executor, with_snapshot, message, session.working_dir
+            )
+        pool = self._get_pool()
+        start = time.perf_counter()
+        base = await pool.get()
+        client = base.for_chat(session.chat_code)
+        try:
+            response = ""
+            async for text in client.stream_message(message, file_path=payload.get("file_path")):
+                response = text
+                if payload.get("updates") is not None:
+                    payload["updates"].put_nowait(text)
+        finally:
+            pool.put_nowait(base)
+            self._adopt_chat(session, client)
+        session.record("bot", response, duration_ms=round((time.perf_counter() - start) * 1000, 1))
+        return response
+
+    async def _handle_commands(self, session, payload):
+        loop = asyncio.get_running_loop()
+        outputs = {}
+        for _, batch in group_file_ops(payload["commands"]):
+            # Submit one command (or one file batch) at a time so sessions interleave on the executor
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, execute_commands, batch, session.working_dir, session.shell
+                )
+            except Exception as e:
+                results = [(cmd, CommandResult.error(cmd, f"Error executing command: {str(e)}")) for cmd in batch]
+            for cmd, output in results:
+                outputs[cmd] = output
+                session.record("command", cmd, output=output)
+
+        review = None
+        if payload.get("review"):
+            # Same complete outputs as the GUI review, so attachments never carry truncated text
+            encoded = await loop.run_in_executor(self.executor, session.outputs.encode_all, outputs, True)
+            pool = self._get_pool()
+            base = await pool.get()
+            client = base.for_chat(session.chat_code)
+            try:
+                review = await client.send_outputs_for_review(encoded)
+            finally:
+                pool.put_nowait(base)
+                self._adopt_chat(session, client)
+                # None means the review was not sent; a trimmed one left out part of the outputs
+                session.outputs.commit(review is not None and not client.last_trimmed)
+            session.record("bot", review or "")
+        return {"results": outputs, "review": review}
@@ -0,0 +1,206 @@
+"""Execution profiles: validated, cached and hot-reloaded tuning settings.
+
+A profile holds the settings the executor, planner, Poe client and GUI read
+at run time (concurrency, timeouts, output caps, cache sizes and which
+command kinds may run in parallel). Its values are layered: defaults from
+config.py, EXECUTION_PROFILES, then lililia.toml, then LILILIA_<SETTING>
+environment variables. For example:
+
+    profile = "ci"
+
+    [profiles.default]
+    command_timeout = 900
+
+    [profiles.ci]
+    max_workers = 8
+    parallel_kinds = ["FILE", "DIR", "GREP", "GLOB"]
+
+The result is parsed once and cached. get_profile() checks the TOML file's
+mtime at most every SETTINGS_RELOAD_INTERVAL seconds and reloads it when it
+changed; an invalid edit is reported and the previous profile kept.
+
+    python settings.py    print the active profile
+"""
+import json
+import os
+import threading
+import time
+from config import EXECUTION_PROFILE, EXECUTION_PROFILES, SETTINGS_FILE, SETTINGS_RELOAD_INTERVAL
+from config import PLANNER_ENABLED, PLANNER_MAX_WORKERS, COMMAND_TIMEOUT, SHELL_COMMAND_TIMEOUT
+from config import RESULT_MAX_INLINE_CHARS, RESULT_KEEP_CHARS, REVIEW_INLINE_MAX_CHARS, REVIEW_SUMMARY_MIN_CHARS
+from config import OUTPUT_DELTA_MAX_COMMANDS, WORKSPACE_MAX_RESULTS
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+COMMAND_KINDS = ("FILE", "DIR", "PATCH", "RUN", "GIT", "INSTALL", "SHELL", "TREE", "GLOB", "GREP", "SUMMARY",
+                 "generic")
+
+# name: (type, default, minimum)
+FIELDS = {
+    "planner_enabled": (bool, PLANNER_ENABLED, None),
+    "max_workers": (int, PLANNER_MAX_WORKERS, 1),
+    "parallel_kinds": (tuple, COMMAND_KINDS, None),
+    "command_timeout": (float, COMMAND_TIMEOUT, 0),
+    "shell_timeout": (float, SHELL_COMMAND_TIMEOUT, 1),
+    "result_max_inline_chars": (int, RESULT_MAX_INLINE_CHARS, 1024),
+    "result_keep_chars": (int, RESULT_KEEP_CHARS, 256),
+    "review_inline_max_chars": (int, REVIEW_INLINE_MAX_CHARS, 0),
+    "review_summary_min_chars": (int, REVIEW_SUMMARY_MIN_CHARS, 0),
+    "output_delta_max_commands": (int, OUTPUT_DELTA_MAX_COMMANDS, 1),
+    "workspace_max_results": (int, WORKSPACE_MAX_RESULTS, 1),
+}
+
+class SettingsError(ValueError):
+    pass
+
+class Profile:
+    """The settings of one execution profile; read-only once built."""
+
+    __slots__ = ("name",) + tuple(FIELDS)
+
+    def __init__(self, name, values):
+        self.name = name
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+def _coerce(field, value, source):
+    """Return value converted to the field's type, or raise SettingsError."""
+    if field not in FIELDS:
+        raise SettingsError(f"{source}: unknown setting {field!r} (known: {', '.join(FIELDS)})")
+    kind, _, minimum = FIELDS[field]
+    try:
+        if kind is bool:
+            if isinstance(value, str):
+                if value.strip().lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+                    raise ValueError(value)
+                value = value.strip().lower() in ("1", "true", "yes", "on")
+            elif not isinstance(value, bool):
+                raise ValueError(value)
+        elif kind is tuple:
+            if isinstance(value, str):
+                value = [item.strip() for item in value.split(",") if item.strip()]
+            unknown = [item for item in value if item not in COMMAND_KINDS]
+            if unknown:
+                raise SettingsError(f"{source}: {field} has unknown command kinds {unknown} "
+                                    f"(known: {', '.join(COMMAND_KINDS)})")
+            value = tuple(value)
+        else:
+            if isinstance(value, bool):
+                raise ValueError(value)
+            value = kind(value)
+    except SettingsError:
+        raise
+    except (TypeError, ValueError):
+        raise SettingsError(f"{source}: {field} must be {kind.__name__}, got {value!r}") from None
+    if minimum is not None and value < minimum:
+        raise SettingsError(f"{source}: {field} must be at least {minimum}, got {value}")
+    return value
+
+def settings_path():
+    return os.environ.get("LILILIA_CONFIG") or SETTINGS_FILE
+
+def _read_file(path):
+    if not os.path.exists(path):
+        return {}
+    if tomllib is None:
+        print(f"Ignoring {path}: reading TOML needs Python 3.11 or the tomli package")
+        return {}
+    try:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise SettingsError(f"{path}: {e}") from None
+
+def load_profile(path=None):
+    """Build the active profile from every layer; raises SettingsError if any value is invalid."""
+    path = path or settings_path()
+    data = _read_file(path)
+    file_profiles = data.get("profiles", {})
+    unknown = set(data) - {"profile", "profiles"}
+    if unknown:
+        raise SettingsError(f"{path}: unknown top-level keys {sorted(unknown)}")
+    name = os.environ.get("LILILIA_PROFILE") or data.get("profile") or EXECUTION_PROFILE
+    if name not in EXECUTION_PROFILES and name not in file_profiles:
+        known = sorted(set(EXECUTION_PROFILES) | set(file_profiles))
+        raise SettingsError(f"Unknown execution profile {name!r} (known: {', '.join(known)})")
+
+    # Check every profile in the file, not only the active one, so a typo shows up right away
+    for profile_name, layer in file_profiles.items():
+        if not isinstance(layer, dict):
+            raise SettingsError(f"{path}: profiles.{profile_name} must be a table")
+        for field, value in layer.items():
+            _coerce(field, value, f"{path} [profiles.{profile_name}]")
+
+    values = {field: _coerce(field, default, "config.py") for field, (_, default, _) in FIELDS.items()}
+    layers = [
+        ("config.EXECUTION_PROFILES[default]", EXECUTION_PROFILES.get("default", {})),
+        (f"config.EXECUTION_PROFILES[{name}]", EXECUTION_PROFILES.get(name, {})),
+        (f"{path} [profiles.default]", file_profiles.get("default", {})),
+        (f"{path} [profiles.{name}]", file_profiles.get(name, {})),
+    ]
+    for source, layer in layers:
+        for field, value in layer.items():
+            values[field] = _coerce(field, value, source)
+    for field in FIELDS:
+        env = os.environ.get(f"LILILIA_{field.upper()}")
+        if env is not None:
+            values[field] = _coerce(field, env, f"LILILIA_{field.upper()}")
+    if values["result_keep_chars"] * 2 > values["result_max_inline_chars"]:
+        raise SettingsError("result_keep_chars must be at most half of result_max_inline_chars")
+    return Profile(name, values)
+
+_profile = None
+_mtime = None
+_checked = 0.0
+_lock = threading.Lock()
+
+def _file_mtime():
+    try:
+        return os.stat(settings_path()).st_mtime_ns
+    except OSError:
+        return None
+
+def get_profile():
+    """Return the active profile, reloading it if the settings file changed."""
+    global _profile, _mtime, _checked
+    if _profile is not None and time.monotonic() - _checked < SETTINGS_RELOAD_INTERVAL:
+        return _profile
+    with _lock:
+        if _profile is not None and time.monotonic() - _checked < SETTINGS_RELOAD_INTERVAL:
+            return _profile
+        _checked = time.monotonic()
+        mtime = _file_mtime()
+        if _profile is None or mtime != _mtime:
+            try:
+                profile = load_profile()
+            except SettingsError as e:
+                if _profile is None:
+                    raise
+                print(f"Keeping the current settings; {e}")
+            else:
+                if _profile is not None:
+                    print(f"Reloaded settings from {settings_path()} (profile {profile.name})")
+                _profile = profile
+            _mtime = mtime
+        return _profile
+
+def reload():
+    """Reload the settings now; returns the new profile or raises SettingsError."""
+    global _profile, _mtime, _checked
+    with _lock:
+        _profile = load_profile()
+        _mtime = _file_mtime()
+        _checked = time.monotonic()
+        return _profile
+
+if __name__ == "__main__":
+    print(json.dumps(get_profile().to_dict(), indent=2))
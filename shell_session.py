@@ -0,0 +1,136 @@
+import os
+import queue
+import subprocess
+import threading
+import uuid
+from tracing import span
+from config import USE_PERSISTENT_SHELL
+
+class ShellTimeout(Exception):
+    """Raised when a command in a persistent shell does not finish in time."""
+
+class PersistentShell:
+    """A long-lived bash process that runs successive RUN commands.
+
+    Commands share the shell's state (working directory, exported variables,
+    activated virtualenvs). Each command is followed by a unique sentinel line
+    on stdout and stderr, which marks the end of its output and carries its
+    exit code. Commands read stdin from /dev/null so they cannot swallow the
+    commands that follow them.
+    """
+
+    def __init__(self, cwd=None, executable="bash"):
+        self.cwd = cwd
+        self.executable = executable
+        self.process = None
+        self._sentinel = None
+        self._stdout = None
+        self._stderr = None
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Start the shell process."""
+        self._sentinel = f"__LILILIA_DONE_{uuid.uuid4().hex}__"
+        self.process = subprocess.Popen(
+            [self.executable, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.cwd,
+            text=True,
+            bufsize=1,
+            env=dict(os.environ, PS1="", PS2="")
+        )
+        self._stdout = self._start_reader(self.process.stdout)
+        self._stderr = self._start_reader(self.process.stderr)
+        print(f"Started persistent shell (pid {self.process.pid})")
+
+    def _start_reader(self, stream):
+        lines = queue.Queue()
+
+        def pump():
+            for line in iter(stream.readline, ""):
+                lines.put(line)
+            lines.put(None)  # EOF
+
+        threading.Thread(target=pump, daemon=True).start()
+        return lines
+
+    def close(self):
+        """Terminate the shell process."""
+        if self.process is None:
+            return
+        try:
+            if self.alive:
+                self.process.stdin.write("exit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=2)
+        except Exception:
+            pass
+        if self.alive:
+            self.process.kill()
+        self.process = None
+
+    def restart(self):
+        """Replace the shell with a fresh one, dropping all of its state."""
+        with self._lock:
+            self.close()
+            self.start()
+
+    def _read_until_sentinel(self, lines, timeout):
+        """Collect lines up to the sentinel; returns (text, sentinel_line or None on EOF)."""
+        collected = []
+        while True:
+            try:
+                line = lines.get(timeout=timeout)
+            except queue.Empty:
+                raise ShellTimeout(f"Command did not finish within {timeout} seconds")
+            if line is None:
+                return "".join(collected), None
+            if line.startswith(self._sentinel):
+                return "".join(collected), line
+            collected.append(line)
+
+    def run(self, command, timeout=None):
+        """Run a command in the shell and return (stdout, stderr, returncode)."""
+        with self._lock:
+            if not self.alive:
+                self.start()
+            script = (
+                f"{{ {command}\n}} < /dev/null\n"
+                f"__lililia_rc=$?\n"
+                f"printf '\\n{self._sentinel} %d\\n' \"$__lililia_rc\"\n"
+                f"printf '\\n{self._sentinel}\\n' >&2\n"
+            )
+            with span("shell.run", command=command[:80]):
+                try:
+                    self.process.stdin.write(script)
+                    self.process.stdin.flush()
+                    stdout, marker = self._read_until_sentinel(self._stdout, timeout)
+                    stderr, _ = self._read_until_sentinel(self._stderr, timeout)
+                except ShellTimeout:
+                    # The shell is stuck on the command; its state cannot be trusted any more
+                    self.close()
+                    raise
+                except (BrokenPipeError, OSError):
+                    self.close()
+                    raise RuntimeError("Persistent shell exited unexpectedly")
+
+            if marker is None:
+                # The command ended the shell (e.g. `exit`); report its exit status
+                returncode = self.process.wait()
+                self.close()
+                return stdout, stderr, returncode
+
+            # Drop the newline printed in front of each sentinel
+            return stdout[:-1], stderr[:-1], int(marker.split()[1])
+
+def create_shell(cwd=None):
+    """Return a PersistentShell if enabled in config and supported here, else None."""
+    if not USE_PERSISTENT_SHELL or os.name == 'nt':
+        return None
+    return PersistentShell(cwd=cwd)
@@ -0,0 +1,161 @@
+"""Speculative prefetch of likely follow-up commands.
+
+After a round of commands the bot often asks for the same next step: a diff
+after `GIT: status`, `pip list` after an install. While the review is with the
+bot, a Speculator runs the predicted follow-ups in the background. Predictions
+come from SPECULATION_RULES and from follow-ups learned from the history
+database, and only commands the planner can show to be read-only (or that are
+listed in SPECULATION_ALLOW) are run. When the next reply asks for a
+prefetched command and no earlier command of that reply could change its
+result, the prefetched result is used; everything else is discarded.
+"""
+import collections
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import CMD_PREFIX_RUN, SPECULATION_RULES, SPECULATION_ALLOW, SPECULATION_MIN_COUNT
+from config import SPECULATION_MIN_PROBABILITY, SPECULATION_MAX_COMMANDS, SPECULATION_MAX_DURATION_MS
+from config import SPECULATION_WORKERS, SPECULATION_HISTORY_LIMIT, SPECULATION_ROUND_GAP
+from command_executor import execute_command
+from planner import analyze, conflicts
+from replay import recorder
+
+class Speculator:
+    """Predicts, prefetches and hands out the follow-up commands of one conversation."""
+
+    def __init__(self, cwd=None, shell=None, store=None, rules=SPECULATION_RULES):
+        self.cwd = cwd
+        self.shell = shell
+        self.rules = [(re.compile(pattern), list(follow_ups)) for pattern, follow_ups in rules]
+        self.follows = collections.defaultdict(collections.Counter)  # command -> commands of the next round
+        self.rounds = collections.Counter()  # command -> rounds it was followed by another round
+        self.durations = {}  # command -> last duration in ms
+        self.previous = None  # Commands of the last round
+        self.pending = {}  # command -> Future of its prefetched result
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="speculate")
+        self.stats = {"started": 0, "hits": 0, "discarded": 0, "saved_ms": 0.0}
+        if store is not None:
+            self.learn(store)
+
+    def learn(self, store):
+        """Count follow-ups in the stored history; commands further apart than SPECULATION_ROUND_GAP are separate rounds."""
+        rows = store.get_recent_commands(SPECULATION_HISTORY_LIMIT)
+        rows.sort(key=lambda row: (row["conversation"], row["id"]))
+        rounds = []
+        for row in rows:
+            duration_ms = row["duration_ms"] or 0
+            if (not rounds or rounds[-1][0] != row["conversation"]
+                    or row["time"] - rounds[-1][1] > SPECULATION_ROUND_GAP):
+                rounds.append([row["conversation"], 0, []])
+            current = rounds[-1]
+            current[1] = max(current[1], row["time"] + duration_ms / 1000)
+            current[2].append(row["command"])
+            self.durations[row["command"]] = duration_ms
+        for (conversation, _, commands), (next_conversation, _, next_commands) in zip(rounds, rounds[1:]):
+            if conversation == next_conversation:
+                self._count(commands, next_commands)
+        if rounds:
+            print(f"Learned follow-ups from {len(rows)} stored commands in {len(rounds)} rounds")
+
+    def _count(self, commands, next_commands):
+        for cmd in set(commands):
+            self.rounds[cmd] += 1
+            self.follows[cmd].update(set(next_commands))
+
+    def _safe(self, cmd):
+        """Return True if cmd can run ahead of time without changing anything."""
+        if self.durations.get(cmd, 0) > SPECULATION_MAX_DURATION_MS:
+            return False
+        if cmd.startswith(CMD_PREFIX_RUN) and self.shell is not None:
+            return False  # Its result depends on the shell's state
+        if SPECULATION_ALLOW and cmd.startswith(tuple(SPECULATION_ALLOW)):
+            return True
+        effects = analyze(cmd, self.cwd)
+        return not effects.barrier and not effects.writes
+
+    def predict(self, commands):
+        """Return the follow-ups worth prefetching after commands, most likely first."""
+        predicted = []
+        for cmd in commands:
+            for pattern, follow_ups in self.rules:
+                if pattern.search(cmd):
+                    predicted.extend(follow_ups)
+            total = self.rounds[cmd]
+            for follow_up, count in self.follows[cmd].most_common():
+                if count < SPECULATION_MIN_COUNT or count / total < SPECULATION_MIN_PROBABILITY:
+                    break
+                predicted.append(follow_up)
+        unique = [cmd for cmd in dict.fromkeys(predicted) if self._safe(cmd)]
+        return unique[:SPECULATION_MAX_COMMANDS]
+
+    def speculate(self, results):
+        """Learn from a finished round of CommandResults and start prefetching its likely follow-ups."""
+        commands = [result.command for result in results]
+        self.discard()
+        with self.lock:
+            for result in results:
+                self.durations[result.command] = result.duration_ms or 0
+            if self.previous is not None:
+                self._count(self.previous, commands)
+            self.previous = commands
+            predictions = self.predict(commands)
+            for cmd in predictions:
+                self.pending[cmd] = self.pool.submit(execute_command, cmd, self.cwd, None, False)
+            self.stats["started"] += len(predictions)
+        if predictions:
+            print(f"Prefetching {len(predictions)} likely follow-up commands: {', '.join(predictions)}")
+
+    def claim(self, commands):
+        """Return {index: CommandResult} for the commands of a new round answered by prefetching.
+
+        A prefetched result is only used if no earlier command of the round
+        could change it. Unused prefetches are discarded.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        claimed = {}
+        if not pending:
+            return claimed
+        earlier = []
+        for index, cmd in enumerate(commands):
+            effects = analyze(cmd, self.cwd, self.shell)
+            future = pending.pop(cmd, None)
+            if future is not None and not any(conflicts(e, effects) for e in earlier):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Prefetch of {cmd} failed: {e}")
+                else:
+                    print(f"Using prefetched result for: {cmd}")
+                    recorder.record_command(cmd, result)
+                    claimed[index] = result
+                    self.stats["hits"] += 1
+                    self.stats["saved_ms"] = round(self.stats["saved_ms"] + (result.duration_ms or 0), 1)
+            elif future is not None:
+                pending[cmd] = future
+            earlier.append(effects)
+        self._drop(pending)
+        return claimed
+
+    def discard(self):
+        """Drop every prefetch that has not been claimed."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        self._drop(pending)
+
+    def _drop(self, pending):
+        if not pending:
+            return
+        self.stats["discarded"] += len(pending)
+        running = [future for future in pending.values() if not future.cancel()]
+        # Let running prefetches finish so they never overlap the commands that follow (e.g. git's index lock)
+        wait(running)
+
+    def close(self):
+        self.discard()
+        self.pool.shutdown(wait=True)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, pending=len(self.pending))
@@ -0,0 +1,12 @@
+import os
+import sys
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def no_history(monkeypatch):
+    """Keep tests from writing to the history database."""
+    import history_store
+    monkeypatch.setattr(history_store, "HISTORY_ENABLED", False)
@@ -0,0 +1,37 @@
+import os
+import attachments
+from attachments import build_attachments
+from command_result import CommandResult
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def test_large_outputs_are_split_into_parts_with_a_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_PART_BYTES", 100000)
+    monkeypatch.setattr(attachments, "ATTACHMENT_COMPRESS_MIN_BYTES", 10 ** 9)
+    spilled = CommandResult("RUN: cat big.log", stdout="".join(f"line {i}\n" for i in range(40000)), returncode=0)
+    assert spilled.stdout_truncated
+    paths = build_attachments({"RUN: ls": "a\nb", "RUN: cat big.log": spilled}, str(tmp_path))
+
+    manifest, parts = paths[0], paths[1:]
+    assert os.path.basename(manifest) == "command_outputs_manifest.txt"
+    assert len(parts) > 1 and all(os.path.getsize(p) <= 100000 for p in parts)
+    text = "".join(_read(p) for p in parts)
+    assert spilled.full_stdout() in text  # Streamed from the spill file, not the truncated copy
+    listing = _read(manifest)
+    assert f"split into {len(parts)} parts" in listing
+    assert "[[RUN: ls]] starts in part 01" in listing and "[[RUN: cat big.log]] starts in part 01" in listing
+
+def test_output_past_the_last_part_is_noted(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_PART_BYTES", 1000)
+    monkeypatch.setattr(attachments, "ATTACHMENT_MAX_PARTS", 2)
+    monkeypatch.setattr(attachments, "ATTACHMENT_COMPRESS_MIN_BYTES", 10 ** 9)
+    paths = build_attachments({"RUN: seq": "x" * 5000}, str(tmp_path))
+    assert len(paths) == 3
+    assert "bytes after part 2 were left out" in _read(paths[0])
+
+def test_small_outputs_are_one_plain_file(tmp_path):
+    paths = build_attachments({"RUN: ls": "a\nb"}, str(tmp_path), title="Results:\n\n")
+    assert [os.path.basename(p) for p in paths] == ["command_outputs.txt"]
+    assert _read(paths[0]).startswith("Results:\n\n") and "a\nb" in _read(paths[0])
@@ -0,0 +1,34 @@
+import asyncio
+import io
+import json
+from batch import read_prompts, group_prompts, run_batch
+from fake_poe import FakeAsyncPoeApi
+from poe_client import PoeClientWrapper
+
+def test_read_prompts_rejects_bad_max_rounds():
+    entries = read_prompts(io.StringIO('{"prompt": "a", "max_rounds": "3"}\n'
+                                       '{"prompt": "b", "max_rounds": -1}\n'
+                                       '{"prompt": "c", "max_rounds": 2}\n'))
+    assert "max_rounds" in entries[0]["error"] and "max_rounds" in entries[1]["error"]
+    assert "error" not in entries[2]
+
+def test_groups_share_a_session_only_when_they_must():
+    entries = read_prompts(io.StringIO('{"prompt": "a", "working_dir": "x"}\n"b"\n'
+                                       '{"prompt": "c", "working_dir": "x"}\n{"prompt": "d", "chat_code": "k"}\n'
+                                       '{"prompt": "e", "chat_code": "k"}\n'))
+    assert [[entry["prompt"] for entry in group] for group in group_prompts(entries)] == [["a", "c"], ["b"], ["d", "e"]]
+
+def test_independent_groups_use_separate_chats(tmp_path):
+    api = FakeAsyncPoeApi(script=lambda bot, message: "[[RUN: echo hi]]" if message.startswith("p") else "done")
+    lines = "".join(json.dumps({"prompt": f"p{i}", "working_dir": str(tmp_path / str(i))}) + "\n" for i in range(3))
+    output = io.StringIO()
+
+    async def run():
+        clients = [await PoeClientWrapper({}, "bot", "configured-chat", api=api).initialize() for _ in range(2)]
+        return await run_batch(clients, read_prompts(io.StringIO(lines)), output, 2)
+    assert asyncio.run(run()) == 0
+    first = [request["chat_code"] for request in api.requests if request["message"].startswith("p")]
+    reviews = [request["chat_code"] for request in api.requests if not request["message"].startswith("p")]
+    assert first == [None, None, None]
+    assert len(reviews) == 3 and len(set(reviews)) == 3 and "configured-chat" not in reviews
+    assert all(json.loads(line)["status"] == "ok" for line in output.getvalue().splitlines())
@@ -0,0 +1,29 @@
+import queue
+import threading
+import pytest
+from bounded_queue import BoundedQueue, BLOCK, COALESCE, DROP_OLDEST
+
+def test_block_waits_for_room_and_times_out():
+    q = BoundedQueue(1, BLOCK)
+    q.put("a")
+    with pytest.raises(queue.Full):
+        q.put("b", timeout=0.05)
+    threading.Timer(0.05, q.get).start()
+    q.put("c", timeout=5)
+    assert q.get_nowait() == "c"
+    with pytest.raises(queue.Empty):
+        q.get_nowait()
+
+def test_coalesce_merges_into_the_newest_item():
+    q = BoundedQueue(2, COALESCE, merge=lambda old, new: old + new)
+    for item in (["a"], ["b"], ["c"], ["d"]):
+        q.put(item)
+    assert [q.get_nowait(), q.get_nowait()] == [["a"], ["b", "c", "d"]]
+    assert q.get_stats()["coalesced"] == 2
+
+def test_drop_oldest_keeps_the_newest_items():
+    q = BoundedQueue(2, DROP_OLDEST)
+    for item in "abcd":
+        q.put(item)
+    assert [q.get_nowait(), q.get_nowait()] == ["c", "d"]
+    assert q.get_stats()["dropped"] == 2
@@ -0,0 +1,25 @@
+from context_budget import ContextBudgeter, estimate_tokens, _trim_block
+
+def test_fit_ends_when_trimmed_block_is_still_over_budget():
+    message = "hdr\n```\n" + ("x" * 2000 + "\n") * 100 + "```\n"
+    budgeter = ContextBudgeter()
+    fitted = budgeter.fit(message)
+    assert estimate_tokens(fitted) <= budgeter.max_message_tokens
+    assert fitted.startswith("hdr\n")
+
+def test_fit_trims_block_lines_before_cutting_the_message():
+    message = "intro\n```\n" + "".join(f"line {i}\n" for i in range(5000)) + "```\nend"
+    budgeter = ContextBudgeter(max_message_tokens=500, keep_lines=20)
+    fitted = budgeter.fit(message)
+    assert "line 0\n" in fitted and "line 4999\n```\nend" in fitted
+    assert "lines trimmed] ..." in fitted
+    assert "characters trimmed" not in fitted
+
+def test_trim_block_retrims_only_with_fewer_lines():
+    body = "".join(f"{i}\n" for i in range(100))
+    trimmed = _trim_block(body, 10)
+    assert trimmed.count("\n") == 21
+    assert _trim_block(trimmed, 10) is None
+    again = _trim_block(trimmed, 5)
+    assert "... [90 lines trimmed] ..." in again
+    assert again.startswith("0\n") and again.endswith("99\n")
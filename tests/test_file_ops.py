@@ -0,0 +1,24 @@
+import os
+import stat
+from file_ops import atomic_write
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_new_files_get_the_umask_and_existing_files_keep_their_mode(tmp_path):
+    umask = os.umask(0o027)
+    try:
+        new = tmp_path / "new.txt"
+        assert atomic_write(str(new), "hello")
+        assert new.read_text() == "hello"
+        assert _mode(new) == 0o640
+        assert os.umask(0o027) == 0o027  # Writing did not change the process umask
+
+        existing = tmp_path / "script.sh"
+        existing.write_text("old")
+        os.chmod(existing, 0o755)
+        atomic_write(str(existing), "new")
+        assert _mode(existing) == 0o755 and existing.read_text() == "new"
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".tmp_")] == []
+    finally:
+        os.umask(umask)
@@ -0,0 +1,32 @@
+import pytest
+from output_delta import OutputHistory
+
+def test_outputs_become_previous_only_when_committed():
+    history = OutputHistory(max_commands=8)
+    assert "unchanged" not in history.encode("ls", "a\nb\n")
+    history.commit(seen=False)  # The send failed
+    assert "unchanged" not in history.encode("ls", "a\nb\n")
+    history.commit()
+    assert "unchanged" in history.encode("ls", "a\nb\n")
+
+def test_outputs_of_a_trimmed_review_are_sent_in_full_next_time():
+    history = OutputHistory(max_commands=8)
+    history.encode("ls", "a\nb\n")
+    history.commit()
+    history.encode("ls", "a\nc\n")
+    history.commit(seen=False)  # The budgeter trimmed the review
+    assert history.encode("ls", "a\nc\n") == "a\nc"
+
+def test_outputs_too_long_to_diff_pass_through_for_streaming(monkeypatch):
+    import output_delta
+    from command_result import CommandResult
+    history = OutputHistory(max_commands=8)
+    result = CommandResult("cat big.log", stdout="line\n" * 120000, returncode=0)
+    assert result.stdout_truncated
+    monkeypatch.setattr(CommandResult, "full_stdout", lambda self: pytest.fail("read the whole spill file"))
+    assert history.encode("cat big.log", result, full=True) is result
+    history.commit()
+    assert "unchanged" in history.encode("cat big.log", result, full=True)
+    # The streamed digest matches the one of the text an in-memory encode would hash
+    monkeypatch.setattr(output_delta, "OUTPUT_DELTA_MAX_CHARS", 10 ** 7)
+    assert "unchanged" in history.encode("cat big.log", result, full=True)
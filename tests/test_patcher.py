@@ -0,0 +1,32 @@
+import pytest
+from patcher import apply_patch, parse_unified_diff, PatchError
+
+def test_content_lines_that_look_like_file_headers_stay_in_the_hunk(tmp_path):
+    path = tmp_path / "query.sql"
+    path.write_text("select 1;\n-- old comment\nselect 2;\n")
+    body = ("--- a/query.sql\n+++ b/query.sql\n"
+            "@@ -1,3 +1,3 @@\n select 1;\n--- old comment\n+++ new comment\n select 2;\n")
+    apply_patch(str(path), body, fsync=False)
+    assert path.read_text() == "select 1;\n++ new comment\nselect 2;\n"
+
+def test_headers_after_a_complete_hunk_are_skipped():
+    body = ("@@ -1 +1 @@\n-a\n+b\n--- a/other.txt\n+++ b/other.txt\n@@ -5,0 +6 @@\n+c\n")
+    first, second = parse_unified_diff(body)
+    assert (first.old, first.new) == ("a\n", "b\n")
+    assert (second.old, second.new, second.line) == ("", "c\n", 6)
+
+def test_hunk_at_the_end_of_a_file_without_a_final_newline(tmp_path):
+    path = tmp_path / "app.py"
+    path.write_text("a\nb\nlast")
+    apply_patch(str(path), "@@ -2,2 +2,2 @@\n b\n-last\n\\ No newline at end of file\n+final\n", fsync=False)
+    assert path.read_text() == "a\nb\nfinal\n"
+    path.write_text("a\nb\nlast")
+    apply_patch(str(path), "<<<<<<< SEARCH\nlast\n=======\nfinal\n>>>>>>> REPLACE\n", fsync=False)
+    assert path.read_text() == "a\nb\nfinal"
+
+def test_failed_hunk_reports_the_first_mismatch(tmp_path):
+    path = tmp_path / "app.py"
+    path.write_text("a\nb\nc\n")
+    with pytest.raises(PatchError, match=r"Hunk 1 failed at line 2: expected 'x', found 'b'"):
+        apply_patch(str(path), "@@ -2,2 +2,2 @@\n-x\n-c\n+y\n+c\n", fsync=False)
+    assert path.read_text() == "a\nb\nc\n"
@@ -0,0 +1,37 @@
+from planner import analyze, build_plan
+
+def test_env_is_analyzed_by_the_command_it_runs():
+    assert analyze("RUN: env rm -rf build").barrier
+    assert analyze("RUN: env -C /tmp ls").barrier
+    assert not analyze("RUN: env").barrier
+    effects = analyze("RUN: env LANG=C ls build", cwd="/repo")
+    assert not effects.barrier and effects.reads == {"/repo/build"}
+    nodes = build_plan(["RUN: env rm -rf build", "RUN: ls build"])
+    assert nodes[1].deps == {0}
+
+def test_find_is_read_only_only_with_known_safe_expressions():
+    assert not analyze("RUN: find . -name '*.py' -o -type d -print").barrier
+    assert not analyze("RUN: find . -maxdepth 2 -newermt 2024-01-01 -size -10k").barrier
+    for action in ("-delete", "-exec rm {} +", "-execdir rm {} +", "-ok rm {} ;", "-okdir rm {} ;",
+                   "-fprint out", "-fprintf out %p", "-fls out", "-fprint0 out"):
+        assert analyze(f"RUN: find . {action}").barrier, action
+
+def test_options_that_write_files_are_barriers():
+    assert analyze("RUN: tree -o listing.txt").barrier
+    assert analyze("RUN: rg --pre ./script pattern").barrier
+    assert not analyze("RUN: tree -L 2").barrier
+    assert analyze("RUN: file -C -m magic").barrier
+    assert analyze("RUN: sort -o out.txt in.txt").barrier
+    assert analyze("RUN: sort --output=out.txt in.txt").barrier
+    assert analyze("RUN: sort --compress-program=gzip in.txt").barrier
+    effects = analyze("RUN: sort -r in.txt", cwd="/repo")
+    assert not effects.barrier and effects.reads == {"/repo/in.txt"}
+
+def test_git_effects_follow_dash_c():
+    effects = analyze("GIT: -C ../other status", cwd="/repo")
+    assert effects.reads == {"/other"} and effects.resources == {"git:/other"}
+    effects = analyze("GIT: -C /a -C b -c core.pager=cat commit -m 'x'", cwd="/repo")
+    assert effects.writes == {"/a/b"}
+    assert analyze("GIT: --git-dir=/elsewhere/.git status", cwd="/repo").barrier
+    nodes = build_plan(["GIT: -C /other checkout main", "RUN: cat /other/file.txt"], cwd="/repo")
+    assert nodes[1].deps == {0}
@@ -0,0 +1,23 @@
+import asyncio
+import json
+import time
+from replay import ReplayPoeApi
+
+def _trace(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    entry = {"type": "exchange", "bot": "bot", "chat_code": None, "message": "hi",
+             "chunks": [[0, "a"], [200, "b"]]}
+    path.write_text(json.dumps(entry) + "\n")
+    return str(path)
+
+async def _replay_seconds(api):
+    start = time.perf_counter()
+    async for chunk in api.send_message("bot", "hi"):
+        text = chunk["text"]
+    assert text == "ab"
+    return time.perf_counter() - start
+
+def test_speed_is_the_pace_relative_to_the_recording(tmp_path):
+    path = _trace(tmp_path)
+    assert asyncio.run(_replay_seconds(ReplayPoeApi(path, speed=4))) < 0.15
+    assert asyncio.run(_replay_seconds(ReplayPoeApi(path, speed=1))) >= 0.19
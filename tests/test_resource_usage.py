@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+import pytest
+from resource_usage import run_measured
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "wait4"), reason="rusage needs os.wait4")
+
+def test_rusage_is_captured_for_each_child():
+    script = "import sys\nn = 0\nfor i in range(3000000): n += i\nsys.stdout.write('x' * 200000)\nsys.exit(3)"
+    completed = run_measured([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 3
+    assert completed.stdout == "x" * 200000
+    assert completed.rusage is not None
+    assert completed.rusage.ru_utime > 0 and completed.rusage.ru_maxrss > 0
+
+def test_timeout_kills_the_child():
+    with pytest.raises(subprocess.TimeoutExpired):
+        run_measured([sys.executable, "-c", "import time; time.sleep(30)"], capture_output=True, timeout=0.5)
@@ -0,0 +1,61 @@
+import asyncio
+from scheduler import Scheduler, INTERACTIVE, REVIEW, BACKGROUND
+
+def _job(log, name, gate=None):
+    async def run():
+        log.append(f"start {name}")
+        if gate is not None:
+            await gate.wait()
+        log.append(f"end {name}")
+        return name
+    return run
+
+def test_higher_lanes_start_first():
+    async def run():
+        scheduler = Scheduler(max_running=1)
+        log, gate = [], asyncio.Event()
+        first = scheduler.submit(REVIEW, _job(log, "review", gate))
+        later = [scheduler.submit(BACKGROUND, _job(log, "background")),
+                 scheduler.submit(REVIEW, _job(log, "review2")),
+                 scheduler.submit(INTERACTIVE, _job(log, "interactive"))]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *later)
+        return log
+    log = asyncio.run(run())
+    assert [entry for entry in log if entry.startswith("start")] == [
+        "start review", "start interactive", "start review2", "start background"]
+
+def test_interactive_work_preempts_background_jobs():
+    async def run():
+        scheduler = Scheduler(max_running=1)
+        log, gate = [], asyncio.Event()
+        background = scheduler.submit(BACKGROUND, _job(log, "background", gate))
+        await asyncio.sleep(0)
+        interactive = scheduler.submit(INTERACTIVE, _job(log, "interactive"))
+        assert await interactive == "interactive"
+        gate.set()
+        assert await background == "background"
+        return log, scheduler.get_stats()
+    log, stats = asyncio.run(run())
+    assert log == ["start background", "start interactive", "end interactive", "start background", "end background"]
+    assert stats[BACKGROUND]["preempted"] == 1 and stats[BACKGROUND]["completed"] == 1
+
+def test_jobs_with_the_same_key_never_overlap():
+    async def run():
+        scheduler = Scheduler(lane_limits={REVIEW: 3}, max_running=3)
+        running, peak = {}, {}
+
+        def job(key):
+            async def run():
+                running[key] = running.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), running[key])
+                await asyncio.sleep(0.01)
+                running[key] -= 1
+            return run
+
+        await asyncio.gather(*[scheduler.submit(REVIEW, job(key), key=key) for key in ("a", "a", "b", "a")])
+        return peak, scheduler.stats[REVIEW]
+    peak, stats = asyncio.run(run())
+    assert peak == {"a": 1, "b": 1}
+    assert stats["completed"] == 4
@@ -0,0 +1,28 @@
+import pytest
+from server import check_request, read_payload
+
+TOKEN = "secret"
+
+def test_requests_need_the_token_except_health():
+    headers = {"content-type": "application/json"}
+    assert check_request(headers, True, "/commands", TOKEN)[0] == 401
+    assert check_request(dict(headers, **{"x-lililia-token": "wrong"}), True, "/commands", TOKEN)[0] == 401
+    assert check_request(dict(headers, **{"x-lililia-token": TOKEN}), True, "/commands", TOKEN) is None
+    assert check_request({}, False, "/health", TOKEN) is None
+
+def test_browser_requests_are_refused():
+    headers = {"x-lililia-token": TOKEN}
+    assert check_request(dict(headers, origin="http://example.com",
+                              **{"content-type": "application/json"}), True, "/commands", TOKEN)[0] == 403
+    for content_type in ("text/plain", "application/x-www-form-urlencoded", "multipart/form-data"):
+        assert check_request(dict(headers, **{"content-type": content_type}), True, "/commands", TOKEN)[0] == 415
+    assert check_request(headers, True, "/commands", TOKEN)[0] == 415
+    assert check_request(dict(headers, **{"content-type": "application/json; charset=utf-8"}),
+                         True, "/commands", TOKEN) is None
+
+def test_payload_merges_query_and_object_body():
+    assert read_payload("session=a&limit=2", b'{"limit": 5}') == {"session": "a", "limit": 5}
+    assert read_payload("", b"") == {}
+    for body in (b"[1, 2]", b'"text"', b"3", b"null"):
+        with pytest.raises(ValueError):
+            read_payload("session=a", body)
@@ -0,0 +1,39 @@
+import asyncio
+from fake_poe import FakeAsyncPoeApi
+from poe_client import PoeClientWrapper
+from session_manager import SessionManager
+
+async def _manager(tmp_path, api):
+    client = await PoeClientWrapper({}, "bot", "configured-chat", api=api).initialize()
+    return SessionManager([client])
+
+def test_sessions_without_chat_code_get_their_own_chats(tmp_path):
+    async def run():
+        api = FakeAsyncPoeApi(script=["hello"])
+        manager = await _manager(tmp_path, api)
+        first = manager.create_session(working_dir=str(tmp_path / "a"))
+        second = manager.create_session(working_dir=str(tmp_path / "b"))
+        await manager.send_message(first.id, "one")
+        await manager.send_message(second.id, "two")
+        await manager.send_message(first.id, "three")
+        await manager.close()
+        return first, second, [request["chat_code"] for request in api.requests]
+    first, second, sent = asyncio.run(run())
+    assert first.chat_code and second.chat_code and first.chat_code != second.chat_code
+    assert "configured-chat" not in sent
+    assert sent == [None, None, first.chat_code]
+
+def test_close_session_fails_queued_requests(tmp_path):
+    async def run():
+        manager = await _manager(tmp_path, FakeAsyncPoeApi(script=["hello"], first_chunk_delay=0.2))
+        session = manager.create_session(working_dir=str(tmp_path))
+        running = asyncio.ensure_future(manager.send_message(session.id, "one"))
+        queued = asyncio.ensure_future(manager.send_message(session.id, "two"))
+        await asyncio.sleep(0.05)
+        await manager.close_session(session.id)
+        results = await asyncio.wait_for(asyncio.gather(running, queued, return_exceptions=True), 1)
+        await manager.close()
+        return results
+    running, queued = asyncio.run(run())
+    assert isinstance(running, asyncio.CancelledError)
+    assert isinstance(queued, RuntimeError) and "closed" in str(queued)
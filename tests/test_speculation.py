@@ -0,0 +1,24 @@
+from concurrent.futures import Future
+from command_result import CommandResult
+from speculation import Speculator
+
+def _prefetched(cmd):
+    future = Future()
+    future.set_result(CommandResult(cmd, stdout="old\n", returncode=0))
+    return future
+
+def test_claim_discards_prefetches_an_earlier_command_could_change(tmp_path):
+    speculator = Speculator(cwd=str(tmp_path), rules=[])
+    try:
+        speculator.pending = {"RUN: cat notes.txt": _prefetched("RUN: cat notes.txt"),
+                              "RUN: ls": _prefetched("RUN: ls")}
+        claimed = speculator.claim(["FILE: notes.txt]]new", "RUN: cat notes.txt"])
+        assert claimed == {}
+        assert speculator.get_stats()["discarded"] == 2
+
+        speculator.pending = {"RUN: cat notes.txt": _prefetched("RUN: cat notes.txt")}
+        claimed = speculator.claim(["RUN: cat notes.txt", "FILE: notes.txt]]new"])
+        assert list(claimed) == [0] and claimed[0].stdout == "old\n"
+        assert speculator.get_stats()["hits"] == 1
+    finally:
+        speculator.close()
@@ -0,0 +1,165 @@
+"""Lightweight spans for timing the message and command pipeline.
+
+Tracing is off unless a trace file is configured (TRACE_FILE in config.py or
+the LILILIA_TRACE environment variable). While off, span() hands back a shared
+no-op object, so instrumented code costs one attribute check per span.
+
+Finished spans are appended to the trace file as JSON lines. Convert a trace
+for chrome://tracing or Perfetto with:
+
+    python tracing.py trace.jsonl trace.json
+"""
+import json
+import os
+import sys
+import threading
+import time
+from config import TRACE_FILE
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """A timed region; use as a context manager in sync or async code."""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), **self.args)
+        return False
+
+    def set(self, **args):
+        """Attach more arguments to the span before it ends."""
+        self.args.update(args)
+
+class Tracer:
+    """Writes spans and instant events to a JSONL trace file."""
+
+    def __init__(self, path=None):
+        self.enabled = False
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        if path:
+            self.enable(path)
+
+    def enable(self, path):
+        """Start appending events to path."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self.path = path
+            self._file = open(path, "a", encoding="utf-8")
+            self.enabled = True
+
+    def disable(self):
+        """Stop tracing and close the trace file."""
+        with self._lock:
+            self.enabled = False
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def span(self, name, **args):
+        """Return a context manager that times the enclosed block."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start_ns, end_ns, **args):
+        """Record a span with explicit perf_counter_ns start and end times."""
+        if not self.enabled:
+            return
+        self._write({
+            "name": name,
+            "ph": "X",
+            "ts": start_ns // 1000,
+            "dur": (end_ns - start_ns) // 1000,
+            "tid": threading.current_thread().name,
+            "args": args,
+        })
+
+    def instant(self, name, **args):
+        """Record a point-in-time event."""
+        if not self.enabled:
+            return
+        self._write({
+            "name": name,
+            "ph": "i",
+            "ts": time.perf_counter_ns() // 1000,
+            "tid": threading.current_thread().name,
+            "args": args,
+        })
+
+    def _write(self, event):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._file.flush()
+
+def to_chrome_trace(jsonl_path, output_path):
+    """Convert a JSONL trace into the Chrome trace event format."""
+    events = []
+    thread_ids = {}
+    pid = os.getpid()
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            # Chrome expects numeric thread ids; keep the names as metadata
+            thread = event.pop("tid", "main")
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids) + 1
+                events.append({
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread_ids[thread],
+                    "args": {"name": thread},
+                })
+            event["pid"] = pid
+            event["tid"] = thread_ids[thread]
+            if event["ph"] == "i":
+                event["s"] = "t"
+            events.append(event)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+# Shared tracer for the whole process
+tracer = Tracer(os.environ.get("LILILIA_TRACE") or TRACE_FILE)
+span = tracer.span
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python tracing.py TRACE.jsonl OUTPUT.json")
+        sys.exit(1)
+    count = to_chrome_trace(sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} events to {sys.argv[2]}")
@@ -1,12 +1,28 @@
 import re
 import os
-from config import COMMAND_PATTERN
+from config import COMMAND_PATTERN, PATCH_COMMAND_PATTERN
+from tracing import span
+
+BINARY_SNIFF_CHARS = 8192
+
+COMBINED_COMMAND_RE = re.compile(f"{PATCH_COMMAND_PATTERN}|{COMMAND_PATTERN}")
 
 def extract_commands(text):
     """Extract commands from the text using the defined pattern."""
     if not text:
         return []
-    return re.findall(COMMAND_PATTERN, text)
+    with span("command.extract", chars=len(text)):
+        if "[[PATCH:" not in text:
+            return re.findall(COMMAND_PATTERN, text)
+        # Try the multi-line PATCH form first at each position so its body stays whole
+        return [m.group(1) or m.group(2) for m in COMBINED_COMMAND_RE.finditer(text)]
+
+def command_kind(cmd):
+    """Return the command prefix (RUN, GIT, FILE, ...) or "generic"."""
+    prefix, sep, _ = cmd.partition(":")
+    if sep and prefix.isupper() and prefix.isalpha():
+        return prefix
+    return "generic"
 
 def extract_image_prompt(text):
     """Extract image generation prompts from text."""
@@ -39,28 +55,75 @@ def extract_image_urls(text):
     
     return re.findall(url_pattern, text)
 
-def expand_path(path):
-    """Expand environment variables and user home in paths."""
+def expand_path(path, cwd=None):
+    """Expand environment variables and user home in paths.
+    
+    Relative paths are joined onto cwd when it is given.
+    """
     expanded = os.path.expandvars(path)
     expanded = os.path.expanduser(expanded)
+    if cwd and not os.path.isabs(expanded):
+        expanded = os.path.join(cwd, expanded)
     return expanded
 
-def format_command_output(cmd, output):
-    """Format command output for inclusion in messages."""
-    result = f"Command: [[{cmd}]]\n"
-    result += "Output:\n```\n"
+def output_size(output, full=False):
+    """Return the approximate number of characters output will take when formatted.
     
-    if isinstance(output, dict):
-        if output.get("message"):
-            result += f"{output['message']}\n"
-        if output.get("stdout"):
-            result += f"STDOUT:\n{output['stdout']}\n"
-        if output.get("stderr"):
-            result += f"STDERR:\n{output['stderr']}\n"
-        if output.get("returncode") is not None:
-            result += f"Exit code: {output['returncode']}\n"
-    else:
-        result += f"{output}\n"
+    With full, outputs truncated in memory count at their complete size.
+    """
+    if isinstance(output, str):
+        return len(output)
+    if full:
+        return len(output.message) + output.stdout_bytes + output.stderr_bytes + 40
+    return output.size() + 40
+
+def looks_binary(text):
+    """Return True if text looks like decoded binary data rather than a log."""
+    sample = text[:BINARY_SNIFF_CHARS]
+    if not sample:
+        return False
+    if "\x00" in sample:
+        return True
+    odd = sum(1 for c in sample if c == "\ufffd" or (c < " " and c not in "\t\n\r\f\b\x1b"))
+    return odd > len(sample) * 0.1
+
+def write_command_output(write, cmd, output, full=False):
+    """Write a formatted CommandResult piece by piece through write (e.g. a file's write).
     
-    result += "```\n\n"
-    return result
\ No newline at end of file
+    With full, outputs truncated in memory are read back in full.
+    """
+    write(f"Command: [[{cmd}]]\n")
+    write("Output:\n```\n")
+    write_output_body(write, output, full)
+    write("```\n\n")
+
+def write_output_body(write, output, full=False):
+    """Write the text inside a command's output block: message, STDOUT, STDERR and exit code."""
+    if isinstance(output, str):
+        write(f"{output}\n")
+        return
+    if output.message:
+        write(f"{output.message}\n")
+    if output.stdout:
+        _write_stream(write, "STDOUT", output.stdout, output.stdout_bytes,
+                      output.stream_stdout() if full else None)
+    if output.stderr:
+        _write_stream(write, "STDERR", output.stderr, output.stderr_bytes,
+                      output.stream_stderr() if full else None)
+    if output.returncode is not None:
+        write(f"Exit code: {output.returncode}\n")
+
+def _write_stream(write, label, text, size, chunks=None):
+    if looks_binary(text):
+        write(f"{label}: [binary output omitted, {size} bytes]\n")
+        return
+    write(f"{label}:\n")
+    for chunk in chunks or (text,):
+        write(chunk)
+    write("\n")
+
+def format_command_output(cmd, output):
+    """Format command output for inclusion in messages."""
+    parts = []
+    write_command_output(parts.append, cmd, output)
+    return "".join(parts)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""In-memory index of the workspace for answering the bot's exploration queries.
+
+The index keeps (size, mtime) for every file under a root and refreshes
+incrementally by mtime scanning: only files whose size or mtime changed have
+their cached text or summary dropped. Queries are answered from the index
+instead of spawning ls/find/cat/grep processes:
+
+    [[TREE: src 2]]          directory tree (optional path and depth)
+    [[GLOB: **/*.py]]        paths matching a glob
+    [[GREP: def main *.py]]  regex search, optionally limited to a glob
+    [[SUMMARY: src/app.py]]  size, line count and outline of a file
+"""
+import fnmatch
+import hashlib
+import os
+import re
+import threading
+import time
+from config import WORKSPACE_IGNORE_DIRS, WORKSPACE_MAX_FILE_BYTES
+from config import WORKSPACE_REFRESH_INTERVAL, WORKSPACE_SNAPSHOT_ENTRIES
+from tracing import span
+from settings import get_profile
+
+OUTLINE_PATTERN = re.compile(r"^\s*(?:async\s+def|def|class|function|export\s+(?:default\s+)?(?:function|class)|fn|func)\s+\w+")
+
+class FileEntry:
+    __slots__ = ("size", "mtime", "text", "summary")
+
+    def __init__(self, size, mtime):
+        self.size = size
+        self.mtime = mtime
+        self.text = None
+        self.summary = None
+
+class WorkspaceIndex:
+    """Index of the files under root, refreshed incrementally."""
+
+    def __init__(self, root, ignore_dirs=WORKSPACE_IGNORE_DIRS):
+        self.root = os.path.abspath(root)
+        self.ignore_dirs = set(ignore_dirs)
+        self.files = {}  # relative path -> FileEntry
+        self.last_scan = 0.0
+        self.dirty = True
+        self.last_snapshot_digest = None
+        self._lock = threading.RLock()
+
+    def mark_dirty(self):
+        """Force a rescan before the next query (e.g. after files were written)."""
+        self.dirty = True
+
+    def refresh(self, force=False):
+        """Rescan the tree, keeping cached data for unchanged files."""
+        with self._lock:
+            if not force and not self.dirty and time.monotonic() - self.last_scan < WORKSPACE_REFRESH_INTERVAL:
+                return
+            with span("workspace.scan", root=self.root):
+                seen = {}
+                stack = [self.root]
+                while stack:
+                    directory = stack.pop()
+                    try:
+                        entries = os.scandir(directory)
+                    except OSError:
+                        continue
+                    with entries:
+                        for entry in entries:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    if entry.name not in self.ignore_dirs:
+                                        stack.append(entry.path)
+                                elif entry.is_file():
+                                    stat = entry.stat()
+                                    rel = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                                    old = self.files.get(rel)
+                                    if old and old.size == stat.st_size and old.mtime == stat.st_mtime_ns:
+                                        seen[rel] = old
+                                    else:
+                                        seen[rel] = FileEntry(stat.st_size, stat.st_mtime_ns)
+                            except OSError:
+                                continue
+                self.files = seen
+            self.last_scan = time.monotonic()
+            self.dirty = False
+
+    def _read_text(self, rel, entry):
+        """Return the cached text of a file, or None for large or binary files."""
+        if entry.text is None:
+            if entry.size > WORKSPACE_MAX_FILE_BYTES:
+                return None
+            try:
+                with open(os.path.join(self.root, rel), "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+            if b"\0" in data[:8192]:
+                entry.text = False  # Binary
+            else:
+                entry.text = data.decode("utf-8", "replace")
+        return entry.text or None
+
+    def _resolve(self, path):
+        path = (path or ".").strip().replace("\\", "/")
+        full = os.path.normpath(os.path.join(self.root, path))
+        return os.path.relpath(full, self.root).replace(os.sep, "/")
+
+    def tree(self, path=".", depth=3):
+        """Render the directory tree under path down to depth."""
+        self.refresh()
+        prefix = self._resolve(path)
+        prefix = "" if prefix == "." else prefix + "/"
+        nodes = set()
+        for rel in self.files:
+            if not rel.startswith(prefix):
+                continue
+            parts = rel[len(prefix):].split("/")
+            for level in range(1, min(len(parts), depth) + 1):
+                is_dir = level < len(parts)
+                nodes.add(("/".join(parts[:level]), is_dir))
+        max_results = get_profile().workspace_max_results
+        lines = [prefix or "./"]
+        for node, is_dir in sorted(nodes):
+            if len(lines) > max_results:
+                lines.append(f"... ({len(nodes) - max_results} more)")
+                break
+            level = node.count("/")
+            name = node.rsplit("/", 1)[-1]
+            lines.append("  " * (level + 1) + name + ("/" if is_dir else ""))
+        return "\n".join(lines)
+
+    def glob(self, pattern):
+        """Return indexed paths matching a glob pattern."""
+        self.refresh()
+        pattern = pattern.strip()
+        matches = [rel for rel in self.files
+                   if fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(rel.rsplit("/", 1)[-1], pattern)]
+        return sorted(matches)[:get_profile().workspace_max_results]
+
+    def grep(self, pattern, path_glob=None):
+        """Search indexed text files for a regex; returns 'path:line: text' strings."""
+        self.refresh()
+        regex = re.compile(pattern)
+        max_results = get_profile().workspace_max_results
+        results = []
+        with span("workspace.grep", pattern=pattern):
+            for rel in sorted(self.files):
+                if path_glob and not (fnmatch.fnmatch(rel, path_glob)
+                                      or fnmatch.fnmatch(rel.rsplit("/", 1)[-1], path_glob)):
+                    continue
+                text = self._read_text(rel, self.files[rel])
+                if not text or not regex.search(text):
+                    continue
+                for number, line in enumerate(text.splitlines(), 1):
+                    if regex.search(line):
+                        results.append(f"{rel}:{number}: {line.strip()[:200]}")
+                        if len(results) >= max_results:
+                            return results
+        return results
+
+    def summary(self, path):
+        """Return size, line count and an outline of a file."""
+        self.refresh()
+        rel = self._resolve(path)
+        entry = self.files.get(rel)
+        if entry is None:
+            return f"Not found: {path}"
+        if entry.summary is None:
+            text = self._read_text(rel, entry)
+            if text is None:
+                entry.summary = f"{rel}: {entry.size} bytes (binary or too large to summarize)"
+            else:
+                lines = text.splitlines()
+                outline = [f"  {n}: {line.strip()}" for n, line in enumerate(lines, 1)
+                           if OUTLINE_PATTERN.match(line)][:50]
+                if not outline:
+                    outline = [f"  {n}: {line}" for n, line in enumerate(lines[:10], 1)]
+                entry.summary = "\n".join([f"{rel}: {entry.size} bytes, {len(lines)} lines"] + outline)
+        return entry.summary
+
+    def snapshot(self, only_if_changed=True):
+        """Return a compact listing of the workspace, or None if unchanged since the last one."""
+        self.refresh()
+        paths = sorted(self.files)
+        digest = hashlib.sha256("\n".join(
+            f"{p}:{self.files[p].size}" for p in paths).encode("utf-8")).hexdigest()
+        if only_if_changed and digest == self.last_snapshot_digest:
+            return None
+        self.last_snapshot_digest = digest
+        shown = paths[:WORKSPACE_SNAPSHOT_ENTRIES]
+        lines = [f"Workspace {self.root} ({len(paths)} files):"] + shown
+        if len(paths) > len(shown):
+            lines.append(f"... ({len(paths) - len(shown)} more)")
+        return "\n".join(lines)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(root=None):
+    """Return the shared index for a workspace root (default: current directory)."""
+    root = os.path.abspath(root or os.getcwd())
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = WorkspaceIndex(root)
+        return index
+
+def mark_dirty(root=None):
+    """Mark every index containing root as needing a rescan."""
+    root = os.path.abspath(root or os.getcwd())
+    with _indexes_lock:
+        for index_root, index in _indexes.items():
+            if root.startswith(index_root) or index_root.startswith(root):
+                index.mark_dirty()
+
+def with_snapshot(message, root=None):
+    """Append a workspace snapshot to message if the workspace changed since the last one."""
+    snapshot = get_index(root).snapshot()
+    if not snapshot:
+        return message
+    return f"{message}\n\n```\n{snapshot}\n```"